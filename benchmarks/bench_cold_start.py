@@ -0,0 +1,105 @@
+"""
+ワーカー1つあたりのコールドスタート時間のベンチマーク
+
+- import: `import main` だけにかかる時間（DB接続やスレッド起動をしないこと）
+- ready: uvicornを起動してから /health が200を返すまで（lifespanの起動処理を含む）
+- startup_ms: /health が返すlifespan内の起動処理時間（環境変数チェック・マイグレーション確認・サービス開始）
+- shutdown: SIGTERMを送ってからプロセスが終了するまで
+
+使い方:
+    DATABASE_URL=postgresql://... ADMIN_USERNAME=admin ADMIN_PASSWORD_HASH=... \\
+        python benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def measure_import():
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1]) * 1000
+
+
+def measure_server(port, timeout):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://localhost:{port}/health"
+        while True:
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError("サーバーが起動しませんでした")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    health = json.loads(response.read())
+                    break
+            except OSError:
+                time.sleep(0.02)
+        ready_ms = (time.perf_counter() - started) * 1000
+
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=timeout)
+        shutdown_ms = (time.perf_counter() - stopping) * 1000
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return {
+        "ready_ms": ready_ms,
+        "startup_ms": health.get("startup", {}).get("startup_ms"),
+        "shutdown_ms": shutdown_ms,
+    }
+
+
+def summarize(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {
+        "median": round(statistics.median(values), 1),
+        "p95": round(values[max(0, int(len(values) * 0.95) - 1)], 1),
+        "max": round(values[-1], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    servers = [measure_server(args.port, args.timeout) for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "import_ms": summarize(imports),
+        "ready_ms": summarize([s["ready_ms"] for s in servers]),
+        "startup_ms": summarize([s["startup_ms"] for s in servers]),
+        "shutdown_ms": summarize([s["shutdown_ms"] for s in servers]),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'metric':<12} {'median':>10} {'p95':>10} {'max':>10}")
+    for name in ("import_ms", "ready_ms", "startup_ms", "shutdown_ms"):
+        r = results[name] or {"median": "-", "p95": "-", "max": "-"}
+        print(f"{name:<12} {r['median']:>10} {r['p95']:>10} {r['max']:>10}")
+
+
+if __name__ == "__main__":
+    main()
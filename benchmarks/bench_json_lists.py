@@ -0,0 +1,123 @@
+"""
+一覧APIのJSON生成方式のベンチマーク
+
+- dict: RealDictCursor.fetchall() → jsonable_encoder → json.dumps（従来のFastAPIの経路）
+- pg_json: row_to_json(...)::text をサーバーサイドカーソルで読み連結（現在の経路）
+
+それぞれのレイテンシ（中央値・p95）とピークメモリ（tracemalloc）を比較する。
+
+使い方:
+    DATABASE_URL=postgresql://... python benchmarks/bench_json_lists.py --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from fastapi.encoders import jsonable_encoder
+
+STREAM_BATCH_SIZE = 500
+
+TARGETS = {
+    "bookings": (
+        """SELECT id, customer_name, phone_number, service_name,
+                  booking_date, booking_time, notes, created_at
+           FROM bookings ORDER BY booking_date DESC, booking_time DESC""",
+    ),
+    "products": (
+        "SELECT * FROM products ORDER BY COALESCE(category, ''), COALESCE(brand, ''), product_name, id",
+    ),
+    "services": (
+        "SELECT * FROM services ORDER BY display_order, service_name",
+    ),
+}
+
+
+def dict_path(conn, key, query):
+    """従来の経路: 行ごとの辞書 → jsonable_encoder → JSONResponse.render相当"""
+    with conn.cursor(cursor_factory=RealDictCursor) as c:
+        c.execute(query)
+        rows = c.fetchall()
+    content = jsonable_encoder({key: rows})
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    conn.rollback()
+    return len(body)
+
+
+def pg_json_path(conn, key, query):
+    """現在の経路: Postgresで作ったJSON文字列をバッチごとに連結（送信したバイト数だけ数える）"""
+    size = 0
+    with conn.cursor(name=f"bench_{key}") as c:
+        c.itersize = STREAM_BATCH_SIZE
+        c.execute(f"SELECT row_to_json(t)::text FROM ({query}) t")
+        size += len(('{"%s":[' % key).encode("utf-8"))
+        separator = ""
+        while True:
+            rows = c.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            size += len((separator + ",".join(row[0] for row in rows)).encode("utf-8"))
+            separator = ","
+        size += 2
+    conn.rollback()
+    return size
+
+
+def measure(conn, func, key, query, runs):
+    # ウォームアップ
+    size = func(conn, key, query)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(conn, key, query)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # tracemalloc自体が遅いので計測は別に1回だけ行う
+    tracemalloc.start()
+    func(conn, key, query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "bytes": size,
+        "median_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[max(0, int(len(timings) * 0.95) - 1)], 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--only", choices=sorted(TARGETS), action="append")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    results = []
+    try:
+        for key in args.only or TARGETS:
+            query = TARGETS[key][0]
+            for name, func in (("dict", dict_path), ("pg_json", pg_json_path)):
+                result = measure(conn, func, key, query, args.runs)
+                results.append({"endpoint": key, "path": name, **result})
+    finally:
+        conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'endpoint':<10} {'path':<8} {'bytes':>12} {'median_ms':>10} {'p95_ms':>10} {'peak_kib':>10}")
+    for r in results:
+        print(f"{r['endpoint']:<10} {r['path']:<8} {r['bytes']:>12} {r['median_ms']:>10} {r['p95_ms']:>10} {r['peak_kib']:>10}")
+
+
+if __name__ == "__main__":
+    main()
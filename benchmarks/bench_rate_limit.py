@@ -0,0 +1,98 @@
+"""
+レート制限1回あたりのオーバーヘッドのベンチマーク
+
+- memory: ワーカー内のカウンター（従来の経路、ワーカー間で共有されない）
+- postgres: main.PostgresRateLimitStorage（UNLOGGEDテーブル、全ワーカー共有）
+
+fixed-window / moving-window それぞれで limiter.hit() のレイテンシ（中央値・p95・p99）を測る。
+--workers を指定すると複数スレッドから同じキーを叩き、上限を超えて通していないかも確認する。
+
+使い方:
+    DATABASE_URL=postgresql://... python benchmarks/bench_rate_limit.py --runs 2000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from limits import parse
+from limits.storage import MemoryStorage
+from limits.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from main import PostgresRateLimitStorage  # noqa: E402
+
+STRATEGIES = {
+    "fixed-window": FixedWindowRateLimiter,
+    "moving-window": MovingWindowRateLimiter,
+}
+
+
+def percentile(sorted_values, ratio):
+    return sorted_values[max(0, int(len(sorted_values) * ratio) - 1)]
+
+
+def measure(limiter, runs):
+    # 上限に掛からないよう十分大きい制限で測る
+    item = parse("1000000/minute")
+    key = f"bench-{uuid.uuid4().hex}"
+    limiter.hit(item, key)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        limiter.hit(item, key)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    timings.sort()
+    return {
+        "median_us": round(statistics.median(timings), 1),
+        "p95_us": round(percentile(timings, 0.95), 1),
+        "p99_us": round(percentile(timings, 0.99), 1),
+    }
+
+
+def check_concurrency(limiter, workers, limit):
+    """同じキーに同時アクセスしても許可数が上限ちょうどになるか"""
+    item = parse(f"{limit}/minute")
+    key = f"bench-race-{uuid.uuid4().hex}"
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        allowed = sum(pool.map(lambda _: limiter.hit(item, key), range(limit * 3)))
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=8, help="同時実行チェックのスレッド数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    storages = {
+        "memory": MemoryStorage(),
+        "postgres": PostgresRateLimitStorage("salon-postgres://"),
+    }
+    results = []
+    for storage_name, storage in storages.items():
+        for strategy_name, strategy in STRATEGIES.items():
+            limiter = strategy(storage)
+            result = measure(limiter, args.runs)
+            result["allowed_of_10"] = check_concurrency(limiter, args.workers, 10)
+            results.append({"storage": storage_name, "strategy": strategy_name, **result})
+        storage.reset()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'storage':<10} {'strategy':<14} {'median_us':>10} {'p95_us':>10} {'p99_us':>10} {'allowed/10':>11}")
+    for r in results:
+        print(f"{r['storage']:<10} {r['strategy']:<14} {r['median_us']:>10} {r['p95_us']:>10} "
+              f"{r['p99_us']:>10} {r['allowed_of_10']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+実際のアプリに対する負荷試験（エンドポイントごとのレイテンシ・スループット・メモリ）
+
+- uvicornでアプリを起動し、SendGrid / LINE の送信先をこのプロセス内のスタブサーバーに向ける
+- エンドポイントごとに単独で --duration 秒ずつ叩いたあと、重み付きで混ぜたワークロードを流す
+- 結果はJSON（--output）で出力し、--compare で前回の結果との差を表示する
+
+データ量を揃えるには先に seed_data.py で投入しておくこと。
+
+使い方:
+    DATABASE_URL=postgresql://... ADMIN_USERNAME=admin ADMIN_PASSWORD=... \\
+        python benchmarks/bench_workload.py --duration 20 --concurrency 8 --output results.json
+    python benchmarks/bench_workload.py --compare baseline.json --output results.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RSS_SAMPLE_SECONDS = 0.2
+
+
+def booking_form(rng):
+    """既存の予約と重ならないよう、5年以上先の日時で予約する"""
+    booking_date = date.today() + timedelta(days=rng.randrange(5 * 365, 50 * 365))
+    return urlencode({
+        "customer_name": "負荷試験",
+        "phone_number": "090-0000-0000",
+        "service_name": "シミケア",
+        "booking_date": booking_date.isoformat(),
+        "booking_time": f"{rng.randrange(9, 21):02d}:{rng.randrange(60):02d}",
+        "notes": "",
+    })
+
+
+# (名前, メソッド, パス, フォームを作る関数, 混合ワークロードでの重み)
+ENDPOINTS = [
+    ("GET /booking", "GET", "/booking", None, 3),
+    ("POST /book", "POST", "/book", booking_form, 1),
+    ("GET /bookings", "GET", "/bookings", None, 1),
+    ("GET /products", "GET", "/products", None, 2),
+    ("GET /products?limit=24", "GET", "/products?limit=24", None, 3),
+    ("GET /available-slots", "GET", "/available-slots", None, 2),
+]
+
+
+# ========== 通知スタブ ==========
+
+class StubHandler(BaseHTTPRequestHandler):
+    """SendGrid（202）とLINE（200）の代わりに、一定時間待って成功を返す"""
+
+    latency = 0.0
+    counts = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        with self.lock:
+            self.counts[self.path] = self.counts.get(self.path, 0) + 1
+        status = 202 if self.path.startswith("/sendgrid") else 200
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency_ms):
+    StubHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ========== アプリの起動 ==========
+
+def start_app(port, workers, stub_port, timeout):
+    stub = f"http://127.0.0.1:{stub_port}"
+    env = dict(os.environ)
+    env.setdefault("ADMIN_USERNAME", "admin")
+    if not env.get("ADMIN_PASSWORD_HASH"):
+        env.setdefault("ADMIN_PASSWORD", "benchmark-password")
+    env.update({
+        "SENDGRID_API_KEY": "stub",
+        "GMAIL_USER": "bench@example.com",
+        "LINE_CHANNEL_ACCESS_TOKEN": "stub",
+        "LINE_USER_ID": "stub",
+        "SENDGRID_API_URL": f"{stub}/sendgrid/v3/mail/send",
+        "LINE_API_URL": f"{stub}/line/v2/bot/message/push",
+        "RATE_LIMIT_ENABLED": "false",
+    })
+    env.setdefault("SQL_DEBUG_HEADER", "false")
+    env.setdefault("LOG_LEVEL", "WARNING")
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    started = time.perf_counter()
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError("サーバーが終了しました（環境変数を確認してください）")
+        if time.perf_counter() - started > timeout:
+            process.kill()
+            raise TimeoutError("サーバーが起動しませんでした")
+        try:
+            with urllib.request.urlopen(f"http://localhost:{port}/health", timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.05)
+
+
+def stop_app(process, timeout):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def process_tree_rss(pid):
+    """プロセスと子プロセス（--workers）のRSS合計（バイト、Linuxのみ）"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class RssSampler:
+    """計測中のRSSを一定間隔で記録"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(process_tree_rss(self.pid))
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.samples.append(process_tree_rss(self.pid))
+
+    def summary(self):
+        to_mb = 1 / (1024 * 1024)
+        return {
+            "rss_start_mb": round(self.samples[0] * to_mb, 1),
+            "rss_peak_mb": round(max(self.samples) * to_mb, 1),
+            "rss_end_mb": round(self.samples[-1] * to_mb, 1),
+        }
+
+
+# ========== 負荷 ==========
+
+def run_phase(port, endpoints, duration, concurrency, seed):
+    """endpointsを重みに従って選びながら、concurrency本のスレッドでduration秒叩く"""
+    weights = [endpoint[4] for endpoint in endpoints]
+    results = {endpoint[0]: {"timings": [], "errors": 0, "rate_limited": 0, "bytes": 0} for endpoint in endpoints}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        conn = http.client.HTTPConnection("localhost", port, timeout=30)
+        local = {name: {"timings": [], "errors": 0, "rate_limited": 0, "bytes": 0} for name in results}
+        while time.perf_counter() < deadline:
+            name, method, path, make_form, _ = rng.choices(endpoints, weights)[0]
+            body = make_form(rng) if make_form else None
+            headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+            stats = local[name]
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                stats["bytes"] += len(response.read())
+            except (OSError, http.client.HTTPException):
+                stats["errors"] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("localhost", port, timeout=30)
+                continue
+            stats["timings"].append(time.perf_counter() - started)
+            if response.status == 429:
+                stats["rate_limited"] += 1
+            elif response.status >= 500:
+                stats["errors"] += 1
+        conn.close()
+        with lock:
+            for name, stats in local.items():
+                for key in ("errors", "rate_limited", "bytes"):
+                    results[name][key] += stats[key]
+                results[name]["timings"].extend(stats["timings"])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {name: summarize(stats, elapsed) for name, stats in results.items()}
+
+
+def percentile(sorted_values, ratio):
+    return sorted_values[max(0, int(len(sorted_values) * ratio) - 1)]
+
+
+def summarize(stats, elapsed):
+    timings = sorted(stats["timings"])
+    if not timings:
+        return {"requests": 0, "errors": stats["errors"]}
+    return {
+        "requests": len(timings),
+        "errors": stats["errors"],
+        "rate_limited": stats["rate_limited"],
+        "throughput_rps": round(len(timings) / elapsed, 1),
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 2),
+        "max_ms": round(timings[-1] * 1000, 2),
+        "avg_kb": round(stats["bytes"] / len(timings) / 1024, 1),
+    }
+
+
+# ========== 結果 ==========
+
+def data_volumes():
+    """投入済みのデータ量（結果を比べるときの前提として記録）"""
+    try:
+        import psycopg2
+        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    except Exception:
+        return None
+    try:
+        with conn.cursor() as c:
+            volumes = {}
+            for table in ("bookings", "products", "page_views", "reminders", "services"):
+                c.execute(f"SELECT COUNT(*) FROM {table}")
+                volumes[table] = c.fetchone()[0]
+            return volumes
+    finally:
+        conn.close()
+
+
+def git_revision():
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(report, baseline=None):
+    """結果の表（baselineがあれば前回からの変化率を併記）"""
+    columns = ("requests", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "errors", "rss_peak_mb")
+    print(f"{'phase':<9} {'endpoint':<24}" + "".join(f" {column:>16}" for column in columns))
+    for phase, endpoints in report["phases"].items():
+        for name, result in endpoints.items():
+            old_result = (baseline or {}).get("phases", {}).get(phase, {}).get(name, {})
+            cells = []
+            for column in columns:
+                value = result.get(column, "-")
+                old = old_result.get(column)
+                if old and isinstance(value, (int, float)) and column not in ("requests", "errors"):
+                    value = f"{value} ({(value - old) / old * 100:+.0f}%)"
+                cells.append(f" {value:>16}")
+            print(f"{phase:<9} {name:<24}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20, help="エンドポイント単独の計測時間（秒）")
+    parser.add_argument("--mixed-duration", type=float, default=60, help="混合ワークロードの計測時間（秒、0で省略）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=1, help="uvicornのワーカー数")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--stub-latency-ms", type=float, default=150, help="SendGrid / LINE スタブの応答時間")
+    parser.add_argument("--endpoints", help="計測するエンドポイント名をカンマ区切りで指定（例: 'GET /booking,POST /book'）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル")
+    parser.add_argument("--compare", help="比較する前回の結果（JSON）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    endpoints = ENDPOINTS
+    if args.endpoints:
+        selected = {name.strip() for name in args.endpoints.split(",")}
+        endpoints = [endpoint for endpoint in ENDPOINTS if endpoint[0] in selected]
+        if not endpoints:
+            parser.error(f"該当するエンドポイントがありません: {args.endpoints}")
+
+    stub = start_stub_server(args.stub_latency_ms)
+    process = start_app(args.port, args.workers, stub.server_address[1], args.timeout)
+    phases = {"isolated": {}}
+    try:
+        # 単独: エンドポイントごとのメモリも記録する
+        for endpoint in endpoints:
+            with RssSampler(process.pid) as rss:
+                result = run_phase(args.port, [endpoint], args.duration, args.concurrency, args.seed)
+            phases["isolated"][endpoint[0]] = {**result[endpoint[0]], **rss.summary()}
+        if args.mixed_duration > 0 and len(endpoints) > 1:
+            with RssSampler(process.pid) as rss:
+                result = run_phase(args.port, endpoints, args.mixed_duration, args.concurrency, args.seed)
+            memory = rss.summary()
+            phases["mixed"] = {name: {**stats, **memory} for name, stats in result.items()}
+    finally:
+        stop_app(process, args.timeout)
+        stub.shutdown()
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "duration": args.duration,
+            "mixed_duration": args.mixed_duration,
+            "stub_latency_ms": args.stub_latency_ms,
+            "seed": args.seed,
+            "data": data_volumes(),
+            "stub_requests": dict(StubHandler.counts),
+        },
+        "phases": phases,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
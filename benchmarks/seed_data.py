@@ -0,0 +1,187 @@
+"""
+ベンチマーク用の合成データをCOPYで投入する
+
+- bookings: 今日を中心に過去・未来へ広げた予約（1日あたり9:00〜20:59の1分刻み、UNIQUE制約を満たす）
+- products: 画像（data URL）付きの商品
+- page_views: 指定日数ぶんのページ別アクセス数
+- reminders: 未送信・送信済みのリマインダー
+
+同じ --seed なら同じデータになるので、バージョン間で結果を比べられる。
+ローカルのベンチマーク用DBで使うこと（--truncate は対象テーブルを空にする）。
+
+使い方:
+    DATABASE_URL=postgresql://... python benchmarks/seed_data.py --bookings 500000 --products 10000 \\
+        --page-view-days 730 --truncate
+"""
+import argparse
+import base64
+import csv
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from main import IterStream, run_migrations, start_logging, stop_logging  # noqa: E402
+
+SLOTS_PER_DAY = 12 * 60  # 9:00〜20:59
+COPY_CHUNK_ROWS = 5000
+PAGES = ["home", "shop", "services_intro", "booking_form", "complete"]
+SEEDED_TABLES = ["bookings", "products", "page_views", "reminders"]
+CATALOG_TABLES = ["products"]
+
+FAMILY_NAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+GIVEN_NAMES = ["花子", "美咲", "陽菜", "結衣", "さくら", "葵", "凛", "真央", "彩", "優子"]
+SERVICES = ["シミケア", "フェイシャルWAX", "脳洗浄", "ピーリング", "ハーブサウナ"]
+CATEGORIES = ["スキンケア", "ヘアケア", "ボディケア", "サプリメント"]
+BRANDS = [f"ブランド{i:02d}" for i in range(1, 21)]
+
+
+def csv_chunks(rows):
+    """行のイテレーターをCSVのバイト列に変換（COPY_CHUNK_ROWS行ずつ）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if index % COPY_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def booking_rows(rng, count):
+    days = -(-count // SLOTS_PER_DAY)
+    first_day = date.today() - timedelta(days=days // 2)
+    for index in range(count):
+        day, slot = divmod(index, SLOTS_PER_DAY)
+        booking_date = first_day + timedelta(days=day)
+        hour, minute = divmod(9 * 60 + slot, 60)
+        yield (
+            rng.choice(FAMILY_NAMES) + rng.choice(GIVEN_NAMES),
+            f"090-{rng.randrange(10000):04d}-{rng.randrange(10000):04d}",
+            rng.choice(SERVICES),
+            booking_date.isoformat(),
+            f"{hour:02d}:{minute:02d}:00",
+            "" if rng.random() < 0.7 else "初めての来店です",
+        )
+
+
+def product_rows(rng, count, image_kb):
+    for index in range(count):
+        image = ""
+        if image_kb:
+            image = "data:image/jpeg;base64," + base64.b64encode(rng.randbytes(image_kb * 768)).decode("ascii")
+        price = rng.randrange(1000, 30000, 100)
+        yield (
+            f"SEED-{index:07d}",
+            f"{rng.choice(BRANDS)} 商品{index}",
+            "ベンチマーク用の商品説明です。" * rng.randint(1, 5),
+            price,
+            price + 1000 if rng.random() < 0.2 else "",
+            rng.choice(BRANDS),
+            rng.choice(CATEGORIES),
+            rng.randrange(100),
+            image,
+            "t" if rng.random() < 0.95 else "f",
+        )
+
+
+def page_view_rows(rng, days):
+    today = date.today()
+    for offset in range(days):
+        view_date = (today - timedelta(days=offset)).isoformat()
+        for page in PAGES:
+            yield (page, view_date, rng.randrange(10, 2000))
+
+
+def reminder_rows(rng, count):
+    today = date.today()
+    for index in range(count):
+        yield (
+            f"seed{index}@example.com",
+            (today + timedelta(days=rng.randrange(-30, 30))).isoformat(),
+            f"{rng.randrange(9, 21):02d}:00:00",
+            rng.choice(FAMILY_NAMES) + rng.choice(GIVEN_NAMES),
+            rng.choice(SERVICES),
+            "t" if rng.random() < 0.5 else "f",
+        )
+
+
+def copy_rows(cursor, table, columns, rows):
+    started = time.perf_counter()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        IterStream(csv_chunks(rows)),
+    )
+    print(f"  {table}: {cursor.rowcount}件 ({time.perf_counter() - started:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=500_000)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--image-kb", type=int, default=30, help="商品画像1件あたりのサイズ（0で画像なし）")
+    parser.add_argument("--page-view-days", type=int, default=730)
+    parser.add_argument("--reminders", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--truncate", action="store_true", help="投入前に対象テーブルを空にする")
+    parser.add_argument("--keep-triggers", action="store_true",
+                        help="変更履歴・通知トリガーを動かしたまま投入する（既定ではsession_replication_roleで止める）")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start_logging()
+    try:
+        run_migrations()
+    finally:
+        stop_logging()
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        with conn.cursor() as c:
+            if not args.keep_triggers:
+                # 50万件の変更履歴を作らないよう、このセッションだけトリガーを止める（要スーパーユーザー）
+                c.execute("SET session_replication_role = replica")
+            if args.truncate:
+                c.execute(f"TRUNCATE {', '.join(SEEDED_TABLES)} RESTART IDENTITY")
+
+            print("📥 投入中...")
+            copy_rows(c, "bookings",
+                      ["customer_name", "phone_number", "service_name", "booking_date", "booking_time", "notes"],
+                      booking_rows(rng, args.bookings))
+            copy_rows(c, "products",
+                      ["sku", "product_name", "description", "price", "original_price", "brand", "category",
+                       "stock_quantity", "image_data", "is_active"],
+                      product_rows(rng, args.products, args.image_kb))
+            copy_rows(c, "page_views", ["page_name", "view_date", "view_count"],
+                      page_view_rows(rng, args.page_view_days))
+            copy_rows(c, "reminders",
+                      ["email", "booking_date", "booking_time", "customer_name", "service_name", "sent"],
+                      reminder_rows(rng, args.reminders))
+
+            # トリガーを止めた分、キャッシュの世代を進めて起動中のワーカーに読み直させる
+            c.execute("""
+                UPDATE table_versions SET version = version + 1, updated_at = (NOW() AT TIME ZONE 'Asia/Tokyo')
+                WHERE table_name = ANY(%s)
+            """, (CATALOG_TABLES + ["bookings"],))
+            for table in CATALOG_TABLES:
+                c.execute("SELECT pg_notify('catalog_changed', %s)", (table,))
+        conn.commit()
+
+        conn.set_session(autocommit=True)
+        with conn.cursor() as c:
+            for table in SEEDED_TABLES:
+                c.execute(f"ANALYZE {table}")
+        print("✅ 投入完了")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,174 @@
-from fastapi import FastAPI, Request, Form, Depends, Cookie, Response
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, APIRouter, Request, Form, Depends, Cookie, Response, File, UploadFile
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from limits.storage import Storage, MovingWindowSupport
 import schedule
-from contextlib import contextmanager
-from urllib.parse import urlencode
+from contextlib import contextmanager, asynccontextmanager
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from urllib.parse import urlencode, urlsplit
+from email.utils import format_datetime, parsedate_to_datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.pool import ThreadedConnectionPool
 import os
+import sys
 import json
+import csv
+import io
+import zlib
 import requests
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 import pytz
 import schedule
 import threading
+import logging
+import logging.handlers
+import copy
+import queue
+import random
+import bisect
+import functools
+import asyncio
+import contextvars
+import select
 import time
+import re
 import hashlib
+import base64
+import unicodedata
 import secrets
 import bcrypt
 
+# コールドスタート計測用（import開始からlifespanの起動完了まで）
+_import_started = time.perf_counter()
+
+# ========== ログ ==========
+
+# ログは呼び出し側ではキューに積むだけにし、標準出力への書き込みは専用スレッドで行う
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json または text
+# extra=SAMPLED を付けた頻出ログはこの割合だけ出す（WARNING以上でも付いていれば間引く）
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_QUEUE_SIZE = 10000
+SAMPLED = {"sampled": True}
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_LOG_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sampled", "request_id", "trace_id"}
+
+class ContextFilter(logging.Filter):
+    """呼び出し元のスレッドでリクエストID・トレースIDを付け、間引き対象のログを落とす"""
+
+    def filter(self, record):
+        if getattr(record, "sampled", False) and random.random() >= LOG_SAMPLE_RATE:
+            return False
+        record.request_id = _request_id.get()
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span is not None else None
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """キューが一杯のときは待たずに捨てる"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def prepare(self, record):
+        # メッセージと例外の整形だけ呼び出し元で行い、JSON化は書き込みスレッドに任せる
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, JST).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        if record.request_id:
+            entry["request_id"] = record.request_id
+        if record.trace_id:
+            entry["trace_id"] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{datetime.fromtimestamp(record.created, JST):%H:%M:%S} {record.levelname:<7} [{record.request_id or '-'}] {record.getMessage()}"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+logger = logging.getLogger("salon")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_handler = DroppingQueueHandler(_log_queue)
+_log_handler.addFilter(ContextFilter())
+logger.addHandler(_log_handler)
+_log_output = logging.StreamHandler(sys.stdout)
+_log_output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_output)
+
+def start_logging():
+    """書き込みスレッドを開始（それまでのログはキューに溜まっている）"""
+    if _log_listener._thread is None:
+        _log_listener.start()
+
+def stop_logging():
+    """キューに残ったログを書き出してから止める"""
+    if _log_listener._thread is not None:
+        _log_listener.stop()
+
+class RequestIdMiddleware:
+    """X-Request-IDを引き継ぐか生成し、ログとレスポンスヘッダーに付ける"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # バッチ読み取りのサブリクエストは元のリクエストIDを引き継ぐ
+        if scope["type"] != "http" or _request_id.get() is not None:
+            await self.app(scope, receive, send)
+            return
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        if not re.fullmatch(r"[A-Za-z0-9._-]{1,64}", request_id):
+            request_id = secrets.token_hex(8)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = _request_id.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_id.reset(token)
+
 # ========== 環境変数バリデーション ==========
 
 REQUIRED_ENV_VARS = {
@@ -53,6 +199,20 @@ def validate_env_vars():
             missing_vars.append(f"  ❌ {var}: {description}")
         else:
             print(f"  ✅ {var}: 設定済み")
+
+    # パスワード系の特別チェック
+    has_hash = os.getenv("ADMIN_PASSWORD_HASH")
+    has_plain = os.getenv("ADMIN_PASSWORD")
+
+    if not has_hash and not has_plain:
+        missing_vars.append("  ❌ ADMIN_PASSWORD または ADMIN_PASSWORD_HASH: 管理者パスワード")
+    elif has_hash:
+        print("  ✅ ADMIN_PASSWORD_HASH: 設定済み（推奨）")
+        if has_plain:
+            print("  ⚠️  ADMIN_PASSWORDも設定されていますが、ADMIN_PASSWORD_HASHが優先されます")
+    else:
+        print("  ⚠️  ADMIN_PASSWORD: 設定済み（非推奨・平文）")
+        print("      → bcryptハッシュ化への移行を強く推奨します")
     
     if missing_vars:
         print("\n🚨 以下の必須環境変数が設定されていません:")
@@ -73,9 +233,8 @@ def validate_env_vars():
         print("\n⚠️  以下のオプション環境変数が未設定です（一部機能が制限されます）:")
         print("\n".join(missing_optional))
     
-    # セキュリティチェック
-    admin_password = os.getenv("ADMIN_PASSWORD", "")
-    if len(admin_password) < 8:
+    # セキュリティチェック（平文のパスワードを使う場合のみ）
+    if has_plain and not has_hash and len(has_plain) < 8:
         print("\n⚠️  セキュリティ警告: ADMIN_PASSWORDは8文字以上を推奨します")
     
     # 環境チェック
@@ -89,87 +248,221 @@ def validate_env_vars():
     
     print("\n✅ 環境変数のバリデーション完了\n")
 
-# アプリケーション起動時に実行
-validate_env_vars()
-
-# DATABASE_URLを取得（バリデーション後なので安全）
+# データベース接続情報
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# ✅ FastAPI初期化
-app = FastAPI()
+# ✅ エンドポイントはrouterに登録し、create_app()でアプリに組み込む
+router = APIRouter()
+
+# ✅ 本番・開発問わずすべて許可したいホストをまとめる
+ALLOWED_HOSTS = [
+    "salon-booking-k54d.onrender.com",  # RenderのURL
+    "*.onrender.com",
+    "salon-couer.jp",
+    "www.salon-couer.jp",
+    "localhost"  # 開発用
+]
+security = HTTPBasic()
+
+# 環境変数から設定を取得
+ENVIRONMENT = os.getenv("ENVIRONMENT", "development")  # production or development
+IS_PRODUCTION = ENVIRONMENT == "production"
+    
+# ========== レート制限のカウンター（全ワーカー共有） ==========
 
-# ========== 起動時：servicesテーブルのカラムを自動追加 ==========
+class PostgresRateLimitStorage(Storage, MovingWindowSupport):
+    """
+    slowapi(limits)のカウンターをPostgresのUNLOGGEDテーブルに置き、全ワーカーで共有する
+    - 判定と記録は1文で行うので、同時リクエストでも上限を超えて通さない
+    - 時刻はDB側の時計を使い、ワーカー間の時計のずれの影響を受けない
+    - UNLOGGEDなのでWALを書かず速い（クラッシュ時は消えるが、レート制限には問題ない）
+    """
+    STORAGE_SCHEME = ["salon-postgres"]
 
-def get_db_connection():
-    return psycopg2.connect(DATABASE_URL, sslmode="require")
+    def __init__(self, uri: str = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # プールは空きがないと待たずにPoolErrorを投げ、slowapiがワーカー内のカウンターに切り替えてしまう
+        # 同時に借りる数をセマフォで抑え、空くまで（上限RATE_LIMIT_CHECKOUT_TIMEOUT秒）待たせる
+        self._slots = threading.BoundedSemaphore(RATE_LIMIT_POOL_SIZE)
 
-try:
-    with get_db_connection() as conn:
-        with conn.cursor() as c:
-            print("🧩 カラム構成チェック中...")
+    @property
+    def base_exceptions(self):
+        return psycopg2.Error
 
-            # 🔸 サービス用カラム追加
-            c.execute("""
-                ALTER TABLE services 
-                ADD COLUMN IF NOT EXISTS campaign_price NUMERIC;
-            """)
+    @contextmanager
+    def _cursor(self):
+        # リクエストのたびに接続しないよう、小さなプールを使い回す
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(1, RATE_LIMIT_POOL_SIZE, DATABASE_URL)
+        if not self._slots.acquire(timeout=RATE_LIMIT_CHECKOUT_TIMEOUT):
+            raise psycopg2.OperationalError("レート制限用の接続を取得できませんでした")
+        try:
+            conn = self._pool.getconn()
+            try:
+                conn.autocommit = True
+                with conn.cursor() as c:
+                    yield c
+            except psycopg2.OperationalError:
+                self._pool.putconn(conn, close=True)
+                conn = None
+                raise
+            finally:
+                if conn is not None:
+                    self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    # 固定ウィンドウ（strategy="fixed-window"）
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        with self._cursor() as c:
             c.execute("""
-                ALTER TABLE services 
-                ADD COLUMN IF NOT EXISTS is_campaign BOOLEAN DEFAULT false;
-            """)
+                INSERT INTO rate_limit_counters AS r (key, hits, expires_at)
+                VALUES (%(key)s, %(amount)s, extract(epoch FROM statement_timestamp()) + %(expiry)s)
+                ON CONFLICT (key) DO UPDATE SET
+                    hits = CASE WHEN r.expires_at <= extract(epoch FROM statement_timestamp())
+                                THEN EXCLUDED.hits ELSE r.hits + EXCLUDED.hits END,
+                    expires_at = CASE WHEN r.expires_at <= extract(epoch FROM statement_timestamp()) OR %(elastic)s
+                                      THEN EXCLUDED.expires_at ELSE r.expires_at END
+                RETURNING hits
+            """, {"key": key, "amount": amount, "expiry": expiry, "elastic": elastic_expiry})
+            return c.fetchone()[0]
 
-            # 🔸 （任意）productsにも他のカラムを補完したい場合
+    def get(self, key: str) -> int:
+        with self._cursor() as c:
             c.execute("""
-                ALTER TABLE products ADD COLUMN IF NOT EXISTS image_data TEXT;
-            """)
+                SELECT hits FROM rate_limit_counters
+                WHERE key = %s AND expires_at > extract(epoch FROM statement_timestamp())
+            """, (key,))
+            row = c.fetchone()
+            return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        with self._cursor() as c:
+            c.execute("SELECT expires_at FROM rate_limit_counters WHERE key = %s", (key,))
+            row = c.fetchone()
+            return row[0] if row else time.time()
+
+    # スライディングウィンドウ（strategy="moving-window"）: キーごとに窓内のアクセス時刻を配列で持つ
+    def acquire_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        with self._cursor() as c:
             c.execute("""
-                ALTER TABLE products ADD COLUMN IF NOT EXISTS original_price DECIMAL(10, 2);
-            """)
+                INSERT INTO rate_limit_windows AS w (key, hits)
+                VALUES (%(key)s, array_fill(extract(epoch FROM statement_timestamp())::float8, ARRAY[%(amount)s]))
+                ON CONFLICT (key) DO UPDATE SET
+                    hits = ARRAY(SELECT h FROM unnest(w.hits) AS h
+                                 WHERE h > extract(epoch FROM statement_timestamp()) - %(expiry)s) || EXCLUDED.hits
+                WHERE (SELECT count(*) FROM unnest(w.hits) AS h
+                       WHERE h > extract(epoch FROM statement_timestamp()) - %(expiry)s) + %(amount)s <= %(limit)s
+                RETURNING 1
+            """, {"key": key, "amount": amount, "expiry": expiry, "limit": limit})
+            return c.fetchone() is not None
+
+    def get_moving_window(self, key: str, limit: int, expiry: int) -> tuple:
+        with self._cursor() as c:
             c.execute("""
-                ALTER TABLE products ADD COLUMN IF NOT EXISTS brand VARCHAR(100);
-            """)
+                SELECT COALESCE(min(h), extract(epoch FROM statement_timestamp())), count(h)
+                FROM rate_limit_windows w
+                CROSS JOIN LATERAL unnest(w.hits) AS h
+                WHERE w.key = %s AND h > extract(epoch FROM statement_timestamp()) - %s
+            """, (key, expiry))
+            oldest, count = c.fetchone()
+            return float(oldest), count
 
-            conn.commit()
-            print("✅ カラムチェック・追加完了")
+    def check(self) -> bool:
+        try:
+            with self._cursor() as c:
+                c.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
 
-except Exception as e:
-    print(f"⚠️ カラム追加スキップ: {e}")
+    def reset(self):
+        with self._cursor() as c:
+            c.execute("TRUNCATE rate_limit_counters, rate_limit_windows")
 
-# ✅ 本番・開発問わずすべて許可したいホストをまとめる
-app.add_middleware(
-    TrustedHostMiddleware,
-    allowed_hosts=[
-        "salon-booking-k54d.onrender.com",  # RenderのURL
-        "*.onrender.com",
-        "salon-couer.jp",
-        "www.salon-couer.jp",
-        "localhost"  # 開発用
-    ]
+    def clear(self, key: str):
+        with self._cursor() as c:
+            c.execute("DELETE FROM rate_limit_counters WHERE key = %s", (key,))
+            c.execute("DELETE FROM rate_limit_windows WHERE key = %s", (key,))
+
+def prune_rate_limits():
+    """期限切れのカウンターと、しばらくアクセスのないキーを削除"""
+    if RATE_LIMIT_STORAGE != "postgres":
+        return
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                c.execute("DELETE FROM rate_limit_counters WHERE expires_at < extract(epoch FROM statement_timestamp())")
+                # 配列の最後が一番新しいアクセス
+                c.execute("""
+                    DELETE FROM rate_limit_windows
+                    WHERE hits[cardinality(hits)] < extract(epoch FROM statement_timestamp()) - 86400
+                       OR cardinality(hits) = 0
+                """)
+                conn.commit()
+    except Exception as e:
+        logger.error(f"レート制限カウンターの削除エラー: {e}")
+
+# postgres: 全ワーカーで共有（既定） / memory: ワーカーごと（開発用）
+RATE_LIMIT_STORAGE = os.getenv("RATE_LIMIT_STORAGE", "postgres" if DATABASE_URL else "memory")
+# 判定は1文で数百μsなので、スレッドプール（既定40）のスレッドが少数の接続を順に使えば足りる
+RATE_LIMIT_POOL_SIZE = int(os.getenv("RATE_LIMIT_POOL_SIZE", "4"))
+RATE_LIMIT_CHECKOUT_TIMEOUT = 5
+# 共有カウンターに届かない間、ワーカーごとのカウンターで判定を続けるか（既定は無効: 判定できなければエラー）
+# 有効にするとワーカー数倍まで通ってしまうので、切り替わったときは警告ログが出る
+RATE_LIMIT_MEMORY_FALLBACK = os.getenv("RATE_LIMIT_MEMORY_FALLBACK", "false").lower() == "true"
+
+# Limiterの初期化（同時リクエストでも上限を超えないスライディングウィンドウで判定）
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=["200/minute"],
+    storage_uri="salon-postgres://" if RATE_LIMIT_STORAGE == "postgres" else "memory://",
+    strategy="moving-window",
+    in_memory_fallback_enabled=RATE_LIMIT_MEMORY_FALLBACK,
+    # 負荷試験で1つのIPから叩くとき用（本番では無効にしないこと）
+    enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true",
 )
-security = HTTPBasic()
+# slowapiのログ（共有カウンターからの切り替え・復旧、判定エラー）もアプリのログとして出す
+limiter.logger = logger.getChild("ratelimit")
 
-# 環境変数から設定を取得
-ENVIRONMENT = os.getenv("ENVIRONMENT", "development")  # production or development
-IS_PRODUCTION = ENVIRONMENT == "production"
-    
-# Limiterの初期化
-limiter = Limiter(key_func=get_remote_address, default_limits=["200/minute"])
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+def limit_off_loop(endpoint):
+    """
+    async def のエンドポイント用: レート制限の判定（DBへの問い合わせ）をスレッドプールで行う
+    - @limiter.limit の外側に付ける
+    - slowapiは判定済みの印（request.state._rate_limiting_complete）があると、イベントループ上で判定し直さない
+    """
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        request = kwargs.get("request")
+        if request is not None and not getattr(request.state, "_rate_limiting_complete", False):
+            await run_in_threadpool(limiter._check_request_limit, request, endpoint, False)
+            request.state._rate_limiting_complete = True
+        return await endpoint(*args, **kwargs)
+    return wrapper
 
-# ディレクトリの存在確認と作成
 templates_dir = "templates"
 static_dir = "static"
 
-if not os.path.exists(templates_dir):
-    os.makedirs(templates_dir)
-if not os.path.exists(static_dir):
-    os.makedirs(static_dir)
+def ensure_directories():
+    """ディレクトリの存在確認と作成（import時ではなく起動時に行う）"""
+    os.makedirs(templates_dir, exist_ok=True)
+    os.makedirs(static_dir, exist_ok=True)
 
-templates = Jinja2Templates(directory=templates_dir)
+class TracedTemplates(Jinja2Templates):
+    """テンプレートの描画をSpanにする"""
 
-# データベース接続情報
-DATABASE_URL = os.getenv("DATABASE_URL")
+    def TemplateResponse(self, *args, **kwargs):
+        name = kwargs.get("name") or next((arg for arg in args if isinstance(arg, str)), "template")
+        with trace_span(f"render {name}", template=name):
+            return super().TemplateResponse(*args, **kwargs)
+
+templates = TracedTemplates(directory=templates_dir)
 
 # 日本時間のタイムゾーンを定義
 JST = pytz.timezone('Asia/Tokyo')
@@ -178,10 +471,624 @@ def get_jst_now():
     """現在の日本時間を取得"""
     return datetime.now(JST)
 
+# ========== メトリクス（Prometheus形式） ==========
+
+# 計測はリクエストごとに数μsで済むよう、メトリクスごとのロック1つと辞書の加算だけで行う
+# 値はワーカー（プロセス）ごと。すべての系列にpidラベルを付けるので、ワーカーごとの系列は単調に増え、
+# rate()やhistogram_quantile()はpidごとに計算してから sum without (pid) で合算する
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []
+
+class Metric:
+    def __init__(self, name: str, documentation: str, labelnames=(), kind: str = "counter"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _label_text(self, labels, extra: str = "") -> str:
+        pairs = [f'pid="{os.getpid()}"']
+        pairs.extend(f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels))
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}"
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{self._label_text(labels)} {format_metric_value(value)}"
+
+class Counter(Metric):
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames, "counter")
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    """値を直接設定するか、collectで出力時に計算する"""
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames, "gauge")
+        self._collect = collect
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self._collect is not None:
+            try:
+                collected = list(self._collect())
+                with self._lock:
+                    self._values.update(collected)
+            except Exception as e:
+                logger.error(f"メトリクス取得エラー ({self.name}): {e}")
+        yield from super().samples()
+
+class Histogram(Metric):
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames, "histogram")
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        # 累積はせずバケットごとに数え、出力時に累積する（観測ごとの処理を最小にする）
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else format_metric_value(bound)
+                le_label = f'le="{le}"'
+                yield f"{self.name}_bucket{self._label_text(labels, le_label)} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(labels)} {format_metric_value(total)}"
+            yield f"{self.name}_count{self._label_text(labels)} {cumulative}"
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_metric_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTPリクエスト数", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTPリクエストの処理時間", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "処理中のHTTPリクエスト数")
+BATCH_SUBREQUESTS = Counter("http_batch_subrequests_total", "/admin/batch の中で処理したサブリクエスト数", ("route", "status"))
+DB_CONNECT_SECONDS = Histogram("db_connect_duration_seconds", "psycopg2.connect()で新しい接続を張るのにかかった時間（プールは使っていない）")
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL1文の実行時間")
+NOTIFICATION_SECONDS = Histogram("notification_send_duration_seconds", "通知の送信時間", ("channel",),
+                                 buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+NOTIFICATIONS = Counter("notifications_total", "通知の送信結果（sent / failed / skipped）", ("channel", "result"))
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "キューが一杯で捨てたログ数")
+CACHE_REQUESTS = Counter("cache_requests_total", "キャッシュの参照結果（hit / miss）", ("cache", "result"))
+
+class MetricsMiddleware:
+    """
+    ルートごとの件数・処理時間と処理中のリクエスト数を記録するASGIミドルウェア
+    - /admin/batch のサブリクエスト（scopeのbatch_subrequest）はHTTPリクエストとして数えず、
+      http_batch_subrequests_total にだけ記録する
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        if scope.get("batch_subrequest"):
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                BATCH_SUBREQUESTS.inc(getattr(route, "path", None) or "unmatched", status)
+            return
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # パスそのままだとラベルが増え続けるので、ルートのテンプレート（/admin/products/{product_id}）を使う
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(scope["method"], route_path, status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], route_path)
+
+def observe_notification(channel: str, configured):
+    """通知の送信時間と結果を記録（未設定で送らなかった場合はskipped）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not configured():
+                NOTIFICATIONS.inc(channel, "skipped")
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            result = False
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                NOTIFICATION_SECONDS.observe(time.perf_counter() - started, channel)
+                NOTIFICATIONS.inc(channel, "sent" if result else "failed")
+        return wrapper
+    return decorator
+
+class TimedCursorMixin:
+    """SQL1文ごとの実行時間を記録するカーソル"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed)
+            record_query(query, vars, elapsed, self.rowcount)
+            record_db_span(query, elapsed, self.rowcount)
+
+_timed_cursor_classes = {}
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """cursor_factoryに関係なく、作るカーソルすべてを計測付きにする接続"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(factory)
+        if timed is None:
+            timed = _timed_cursor_classes[factory] = type(f"Timed{factory.__name__}", (TimedCursorMixin, factory), {})
+        kwargs["cursor_factory"] = timed
+        return super().cursor(*args, **kwargs)
+
+def connect_db(**kwargs):
+    """計測付きでDBに接続（接続にかかった時間も記録）"""
+    started = time.perf_counter()
+    conn = psycopg2.connect(DATABASE_URL, connection_factory=InstrumentedConnection, **kwargs)
+    DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
+    return conn
+
+# ========== SQL計測 ==========
+
+# リクエスト（またはバックグラウンドジョブ）ごとに、正規化したSQLごとの回数・時間・行数を集計する
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# 同じSQLを1リクエストでこの回数以上実行したらN+1の疑いとしてログに出す
+REPEATED_QUERY_THRESHOLD = int(os.getenv("REPEATED_QUERY_THRESHOLD", "10"))
+# X-SQL-Summaryヘッダーで集計を返すか（本番ではSQL文が見えるので既定でオフ）
+SQL_DEBUG_HEADER = os.getenv("SQL_DEBUG_HEADER", "true" if ENVIRONMENT == "development" else "false").lower() == "true"
+SQL_SUMMARY_STATEMENTS = 5
+
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s")
+_SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_COMMENT = re.compile(r"--[^\n]*")
+_normalized_sql = {}
+
+REPEATED_QUERIES = Counter("db_repeated_statements_total", "同じSQLを繰り返し実行したリクエスト数（N+1の疑い）", ("scope",))
+
+def normalize_sql(query) -> str:
+    """値を?に置き換え、空白をまとめたSQL（同じ形の文を1つにまとめて数えるため）"""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composed など
+        query = str(query)
+    normalized = _normalized_sql.get(query)
+    if normalized is None:
+        text = _SQL_COMMENT.sub("", query)
+        text = _SQL_LITERAL.sub("?", text)
+        text = _SQL_IN_LIST.sub("(...)", text)
+        normalized = " ".join(text.split())
+        # 文字列を組み立てたSQLでキャッシュが増え続けないよう上限を設ける
+        if len(_normalized_sql) < 1000:
+            _normalized_sql[query] = normalized
+    return normalized
+
+def param_shape(value) -> str:
+    """パラメーターの型と大きさだけを表す（値そのものは個人情報を含みうるのでログに出さない）"""
+    if value is None:
+        return "None"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k}: {param_shape(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        if len(value) > 5:
+            return f"{type(value).__name__}[{len(value)}]"
+        return "(" + ", ".join(param_shape(v) for v in value) + ")"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+class QueryStats:
+    """1リクエスト分のSQL集計"""
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self.count = 0
+        self.total_seconds = 0.0
+        self.statements = {}  # 正規化SQL -> [回数, 合計秒, 行数]
+
+    def record(self, sql: str, seconds: float, rows: int):
+        self.count += 1
+        self.total_seconds += seconds
+        entry = self.statements.get(sql)
+        if entry is None:
+            entry = self.statements[sql] = [0, 0.0, 0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += max(rows, 0)
+
+    def repeated(self):
+        return [(sql, entry[0]) for sql, entry in self.statements.items()
+                if entry[0] >= REPEATED_QUERY_THRESHOLD]
+
+    def summary(self) -> dict:
+        top = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:SQL_SUMMARY_STATEMENTS]
+        return {
+            "queries": self.count,
+            "total_ms": round(self.total_seconds * 1000, 1),
+            "statements": [
+                {"sql": sql[:120], "count": count, "total_ms": round(seconds * 1000, 1), "rows": rows}
+                for sql, (count, seconds, rows) in top
+            ],
+        }
+
+    def report(self):
+        """N+1の疑いがあればログに出す"""
+        repeated = self.repeated()
+        if not repeated:
+            return
+        REPEATED_QUERIES.inc(self.scope)
+        for sql, count in repeated:
+            logger.warning("⚠️ 同じSQLを%d回実行 (%s)", count, self.scope,
+                           extra={"scope": self.scope, "sql": sql[:200], "count": count})
+
+_query_stats = contextvars.ContextVar('query_stats', default=None)
+
+def record_query(query, vars, seconds: float, rows: int):
+    """カーソルから1文ごとに呼ばれる（遅いSQLはパラメーターの形と一緒にログに出す）"""
+    stats = _query_stats.get()
+    slow = seconds * 1000 >= SLOW_QUERY_MS
+    if stats is None and not slow:
+        return
+    sql = normalize_sql(query)
+    if stats is not None:
+        stats.record(sql, seconds, rows)
+    if slow:
+        scope = stats.scope if stats is not None else "-"
+        logger.warning("🐢 遅いSQL %.1fms (%s)", seconds * 1000, scope, extra={
+            "scope": scope, "sql": sql[:500], "duration_ms": round(seconds * 1000, 1),
+            "rows": rows, "params": param_shape(vars),
+        })
+
+@contextmanager
+def track_queries(scope: str):
+    """このブロック内で実行したSQLを集計する"""
+    stats = QueryStats(scope)
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+        stats.report()
+
+class QueryLogMiddleware:
+    """リクエストごとのSQL集計（SQL_DEBUG_HEADERが有効ならX-SQL-Summaryヘッダーで返す）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(f"{scope['method']} {scope['path']}")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and SQL_DEBUG_HEADER:
+                route = scope.get("route")
+                if route is not None:
+                    stats.scope = f"{scope['method']} {route.path}"
+                summary = json.dumps(stats.summary(), ensure_ascii=True, separators=(",", ":"))
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-sql-summary", summary.encode("latin-1")),
+                    (b"server-timing", f'db;dur={stats.total_seconds * 1000:.1f};desc="{stats.count} queries"'.encode("latin-1")),
+                ]
+            await send(message)
+
+        token = _query_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _query_stats.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                stats.scope = f"{scope['method']} {route.path}"
+            stats.report()
+
+# ========== トレーシング ==========
+
+# サンプリングしたリクエスト（とスケジュールジョブ）だけSpanを作り、別スレッドでまとめて書き出す
+# TRACE_EXPORT: file:///path/to/spans.jsonl または http://collector:4318/v1/traces（OTLP/HTTP JSON）。未設定なら無効
+TRACE_EXPORT = os.getenv("TRACE_EXPORT")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_BATCH_SIZE = 256
+TRACE_FLUSH_SECONDS = 5
+TRACE_QUEUE_SIZE = 10000
+TRACE_SERVICE_NAME = "salon-booking"
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+TRACE_SPANS_DROPPED = Counter("trace_spans_dropped_total", "キューが一杯で捨てたSpan数")
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, kind: int = SPAN_KIND_INTERNAL):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+
+    def child(self, name: str, kind: int = SPAN_KIND_INTERNAL) -> "Span":
+        return Span(name, self.trace_id, self.span_id, kind)
+
+    def finish(self, end_ns: int = None):
+        self.end_ns = end_ns or time.time_ns()
+        span_exporter.submit(self)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [otlp_attribute(key, value) for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error:
+            span["status"] = {"code": 2, "message": self.error}
+        return span
+
+def otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+class SpanExporter:
+    """終了したSpanをキューに積み、バックグラウンドスレッドでまとめて書き出す（リクエスト側は待たない）"""
+
+    def __init__(self, target: str):
+        self.target = target
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.target)
+
+    def submit(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            TRACE_SPANS_DROPPED.inc()
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="span_exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """残っているSpanを書き出してから止める"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(BACKGROUND_SHUTDOWN_TIMEOUT)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                try:
+                    self.export(batch)
+                except Exception as e:
+                    logger.error(f"トレース送信エラー: {e}")
+            elif self._stop.is_set():
+                return
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+        while len(batch) < TRACE_BATCH_SIZE:
+            timeout = 0 if self._stop.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(timeout, 0)) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def export(self, batch):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [
+                otlp_attribute("service.name", TRACE_SERVICE_NAME),
+                otlp_attribute("process.pid", os.getpid()),
+            ]},
+            "scopeSpans": [{"scope": {"name": "main"}, "spans": [span.to_otlp() for span in batch]}],
+        }]}
+        if self.target.startswith("file://"):
+            # 1行に1バッチ（OTLP/JSONのExportTraceServiceRequest）
+            with open(self.target[len("file://"):], "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n")
+        else:
+            response = requests.post(self.target, json=payload, timeout=10)
+            response.raise_for_status()
+
+span_exporter = SpanExporter(TRACE_EXPORT)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def start_trace(name: str, traceparent: str = None, kind: int = SPAN_KIND_SERVER):
+    """ルートのSpanを作る（サンプリングされなければNone）。traceparentがあれば呼び出し元の判定に従う"""
+    if not span_exporter.enabled:
+        return None
+    parent = _current_span.get()
+    if parent is not None:
+        return parent.child(name, kind)
+    match = _TRACEPARENT.match(traceparent or "")
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        if not int(flags, 16) & 1:
+            return None
+        return Span(name, trace_id, parent_id, kind)
+    if random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    return Span(name, secrets.token_hex(16), kind=kind)
+
+@contextmanager
+def trace_span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """実行中のトレースに子Spanを追加（トレース中でなければ何もしない）"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    span = parent.child(name, kind)
+    span.attributes.update(attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        span.finish()
+
+def record_db_span(query, seconds: float, rows: int):
+    """カーソルから1文ごとに呼ばれる（実行後に開始時刻を逆算してSpanにする）"""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    end_ns = time.time_ns()
+    span = parent.child("db.query", SPAN_KIND_CLIENT)
+    span.start_ns = end_ns - int(seconds * 1_000_000_000)
+    span.attributes.update({"db.system": "postgresql", "db.statement": normalize_sql(query), "db.rows": rows})
+    span.finish(end_ns)
+
+def traced_post(url: str, **kwargs):
+    """requests.postをSpan付きで実行（外部サービスへのtraceparentは付けない）"""
+    with trace_span(f"POST {urlsplit(url).netloc}", SPAN_KIND_CLIENT, **{"http.method": "POST", "http.url": url}) as span:
+        response = requests.post(url, **kwargs)
+        if span is not None:
+            span.attributes["http.status_code"] = response.status_code
+        return response
+
+class TracingMiddleware:
+    """サンプリングしたリクエストのルートSpanを作る（子Spanはこのコンテキストに付く）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not span_exporter.enabled:
+            await self.app(scope, receive, send)
+            return
+        traceparent = dict(scope["headers"]).get(b"traceparent", b"").decode("latin-1")
+        span = start_trace(f"{scope['method']} {scope['path']}", traceparent)
+        if span is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    span.error = f"HTTP {message['status']}"
+            await send(message)
+
+        span.attributes.update({"http.method": scope["method"], "http.target": scope["path"]})
+        token = _current_span.set(span)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                span.name = f"{scope['method']} {route.path}"
+            span.finish()
+
+# バッチ読み取り中はこの接続を全サブリクエストで共有する
+_shared_connection = contextvars.ContextVar('shared_connection', default=None)
+
 @contextmanager
-def get_db_connection():
+def get_db_connection(reuse_shared: bool = True):
     """データベース接続を安全に管理（日本時間設定付き）"""
-    conn = psycopg2.connect(DATABASE_URL)
+    shared = _shared_connection.get() if reuse_shared else None
+    if shared is not None:
+        yield shared
+        return
+
+    conn = connect_db()
     try:
         # 接続時に日本時間に設定
         with conn.cursor() as c:
@@ -191,10 +1098,12 @@ def get_db_connection():
         conn.close()
 
 # ========== LINE通知設定==========
-@app.post("/line/webhook")
+@router.post("/line/webhook")
 async def line_webhook(request: Request):
     body = await request.json()
-    print("LINE Webhook:", body)
+    # 本文にはユーザーIDやメッセージが含まれるので、イベントの種類だけを記録する
+    events = body.get("events", [])
+    logger.info("LINE Webhook: %d件", len(events), extra={"event_types": [event.get("type") for event in events]})
     return {"status": "ok"}
 
 # 通知設定
@@ -202,6 +1111,9 @@ GMAIL_USER = os.getenv("GMAIL_USER")
 SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 LINE_USER_ID = os.getenv("LINE_USER_ID")
+# 送信先API（ベンチマークではローカルのスタブに向ける）
+SENDGRID_API_URL = os.getenv("SENDGRID_API_URL", "https://api.sendgrid.com/v3/mail/send")
+LINE_API_URL = os.getenv("LINE_API_URL", "https://api.line.me/v2/bot/message/push")
 
 # 管理者認証情報（環境変数から取得）
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
@@ -209,26 +1121,109 @@ ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 # 後方互換性: ADMIN_PASSWORD_HASHがあればそれを使用、なければADMIN_PASSWORDを使用
 ADMIN_PASSWORD_HASH = os.getenv("ADMIN_PASSWORD_HASH")
 ADMIN_PASSWORD_PLAIN = os.getenv("ADMIN_PASSWORD")  # 後方互換性用
+# どちらも未設定の場合は起動時の validate_env_vars() で止める
 
-if not ADMIN_PASSWORD_HASH and not ADMIN_PASSWORD_PLAIN:
-    print("⚠️  警告: ADMIN_PASSWORD_HASHもADMIN_PASSWORDも設定されていません")
+# ========== セッション管理 ==========
 
-    # パスワード系の特別チェック
-    has_hash = os.getenv("ADMIN_PASSWORD_HASH")
-    has_plain = os.getenv("ADMIN_PASSWORD")
-    
-    if not has_hash and not has_plain:
-        missing_vars.append(f"  ❌ ADMIN_PASSWORD または ADMIN_PASSWORD_HASH: 管理者パスワード")
-    elif has_hash:
-        print(f"  ✅ ADMIN_PASSWORD_HASH: 設定済み（推奨）")
-        if has_plain:
-            print(f"  ⚠️  ADMIN_PASSWORDも設定されていますが、ADMIN_PASSWORD_HASHが優先されます")
-    elif has_plain:
-        print(f"  ⚠️  ADMIN_PASSWORD: 設定済み（非推奨・平文）")
-        print(f"      → bcryptハッシュ化への移行を強く推奨します")    
+SESSION_MAX_AGE = 86400          # 24時間
+SESSION_CACHE_SECONDS = 30       # 検証結果をワーカー内で再利用する時間（他ワーカーでのログアウトはこの時間内に反映）
+SESSION_CACHE_MAX = 1000
+SESSION_STORE = os.getenv("SESSION_STORE", "database")  # database または memory（ワーカー1つのときのみ）
+
+def session_key(session_token: str) -> str:
+    """保存用のキー（DBが漏れてもトークンとしては使えないようハッシュにする）"""
+    return hashlib.sha256(session_token.encode('utf-8')).hexdigest()
+
+class MemorySessionStore:
+    """プロセス内の辞書に保存（開発用、ワーカー間では共有されない）"""
+
+    def __init__(self):
+        self._sessions = {}
+
+    def create(self, session_token: str, username: str):
+        self._sessions[session_key(session_token)] = {'username': username, 'expires_at': time.time() + SESSION_MAX_AGE}
+
+    def verify(self, session_token: str) -> bool:
+        session = self._sessions.get(session_key(session_token))
+        return session is not None and session['expires_at'] > time.time()
+
+    def revoke(self, session_token: str):
+        self._sessions.pop(session_key(session_token), None)
+
+    def sweep(self) -> int:
+        now = time.time()
+        expired = [key for key, session in list(self._sessions.items()) if session['expires_at'] <= now]
+        for key in expired:
+            self._sessions.pop(key, None)
+        return len(expired)
+
+class DatabaseSessionStore:
+    """
+    admin_sessionsテーブルに保存して全ワーカーで共有
+    - 検証結果はSESSION_CACHE_SECONDSの間ワーカー内にキャッシュし、リクエストごとのDBアクセスを避ける
+    """
+
+    def __init__(self):
+        self._cache = {}  # キー: (有効期限, 確認した時刻)
+
+    def create(self, session_token: str, username: str):
+        with get_db_connection(reuse_shared=False) as conn:
+            with conn.cursor() as c:
+                c.execute("""
+                    INSERT INTO admin_sessions (token_hash, username, expires_at)
+                    VALUES (%s, %s, (NOW() AT TIME ZONE 'Asia/Tokyo') + make_interval(secs => %s))
+                """, (session_key(session_token), username, SESSION_MAX_AGE))
+                conn.commit()
+        self._cache[session_key(session_token)] = (time.time() + SESSION_MAX_AGE, time.monotonic())
+
+    def verify(self, session_token: str) -> bool:
+        key = session_key(session_token)
+        cached = self._cache.get(key)
+        if cached and time.monotonic() - cached[1] < SESSION_CACHE_SECONDS:
+            CACHE_REQUESTS.inc("session", "hit")
+            return cached[0] > time.time()
+        CACHE_REQUESTS.inc("session", "miss")
+
+        with get_db_connection(reuse_shared=False) as conn:
+            with conn.cursor() as c:
+                c.execute("""
+                    SELECT EXTRACT(EPOCH FROM expires_at - (NOW() AT TIME ZONE 'Asia/Tokyo'))
+                    FROM admin_sessions WHERE token_hash = %s
+                """, (key,))
+                row = c.fetchone()
+        if row is None or row[0] <= 0:
+            self._cache.pop(key, None)
+            return False
+        if len(self._cache) >= SESSION_CACHE_MAX:
+            self._cache.clear()
+        self._cache[key] = (time.time() + float(row[0]), time.monotonic())
+        return True
+
+    def revoke(self, session_token: str):
+        key = session_key(session_token)
+        self._cache.pop(key, None)
+        with get_db_connection(reuse_shared=False) as conn:
+            with conn.cursor() as c:
+                c.execute("DELETE FROM admin_sessions WHERE token_hash = %s", (key,))
+                conn.commit()
+
+    def sweep(self) -> int:
+        now = time.time()
+        for key, (expires_at, _) in list(self._cache.items()):
+            if expires_at <= now:
+                self._cache.pop(key, None)
+        with get_db_connection(reuse_shared=False) as conn:
+            with conn.cursor() as c:
+                c.execute("DELETE FROM admin_sessions WHERE expires_at <= (NOW() AT TIME ZONE 'Asia/Tokyo')")
+                deleted = c.rowcount
+                conn.commit()
+        return deleted
+
+session_store = MemorySessionStore() if SESSION_STORE == "memory" else DatabaseSessionStore()
 
-# セッション管理用（本番環境では Redis などを推奨）
-active_sessions = {}
+# bcryptは1回数百msかかるため、イベントループの外の専用スレッドで実行する
+# （同時に試行されても使うスレッド数はこの上限まで）
+password_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bcrypt")
 
 def hash_password(password: str) -> str:
     """パスワードをハッシュ化"""
@@ -248,11 +1243,11 @@ def verify_password(plain_password: str, username: str) -> bool:
                 ADMIN_PASSWORD_HASH.encode('utf-8')
             )
         except Exception as e:
-            print(f"bcrypt検証エラー: {e}")
+            logger.error(f"bcrypt検証エラー: {e}")
             return False
     elif ADMIN_PASSWORD_PLAIN:
         # 平文比較（非推奨・後方互換性用）
-        print("⚠️  警告: 平文パスワード比較を使用中。ADMIN_PASSWORD_HASHへの移行を推奨します")
+        logger.warning("⚠️  警告: 平文パスワード比較を使用中。ADMIN_PASSWORD_HASHへの移行を推奨します")
         return plain_password == ADMIN_PASSWORD_PLAIN
     else:
         return False
@@ -262,29 +1257,29 @@ def create_session_token() -> str:
     return secrets.token_urlsafe(32)
 
 def verify_admin_session(session_token: str = Cookie(None)) -> bool:
-    """セッショントークンを検証（タイムアウトチェック追加）"""
+    """セッショントークンを検証（有効期限切れ・未登録ならFalse）"""
     if not session_token:
         return False
-    
-    if session_token not in active_sessions:
+    try:
+        return session_store.verify(session_token)
+    except Exception as e:
+        logger.error("セッション検証エラー: %s", e, extra=SAMPLED)
         return False
-    
-    # セッションのタイムアウトチェック（24時間）
-    session_data = active_sessions[session_token]
-    login_time = session_data.get('login_time')
-    
-    if login_time:
-        elapsed = datetime.now() - login_time
-        if elapsed.total_seconds() > 86400:  # 24時間経過
-            del active_sessions[session_token]
-            return False
-    
-    return True
 
+def sweep_sessions():
+    """期限切れのセッションを削除"""
+    try:
+        deleted = session_store.sweep()
+        if deleted:
+            logger.info(f"期限切れセッションを削除: {deleted}件")
+    except Exception as e:
+        logger.error(f"セッション削除エラー: {e}")
+
+@observe_notification("sendgrid", lambda: SENDGRID_API_KEY and GMAIL_USER)
 def send_gmail_notification(booking_data):
     """SendGrid経由でメール通知を送信"""
     if not SENDGRID_API_KEY or not GMAIL_USER:
-        print("SendGrid設定が見つかりません")
+        logger.info("SendGrid設定が見つかりません", extra=SAMPLED)
         return False
     
     try:
@@ -368,7 +1363,7 @@ def send_gmail_notification(booking_data):
 Salon Coeur 予約システム
         """
         
-        url = "https://api.sendgrid.com/v3/mail/send"
+        url = SENDGRID_API_URL
         headers = {
             "Authorization": f"Bearer {SENDGRID_API_KEY}",
             "Content-Type": "application/json"
@@ -385,25 +1380,24 @@ Salon Coeur 予約システム
             ]
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = traced_post(url, headers=headers, json=data)
         
         if response.status_code == 202:
-            print("メール通知を送信しました")
+            logger.info("メール通知を送信しました")
             return True
         else:
-            print(f"メール送信エラー: {response.status_code}, {response.text}")
+            logger.error(f"メール送信エラー: {response.status_code}, {response.text}")
             return False
         
     except Exception as e:
-        print(f"メール送信エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"メール送信エラー: {e}")
         return False
 
+@observe_notification("sendgrid", lambda: SENDGRID_API_KEY and GMAIL_USER)
 def send_reminder_email(reminder):
     """リマインダーメールを送信"""
     if not SENDGRID_API_KEY or not GMAIL_USER:
-        print("SendGrid設定が見つかりません")
+        logger.info("SendGrid設定が見つかりません", extra=SAMPLED)
         return False
     
     try:
@@ -472,7 +1466,7 @@ def send_reminder_email(reminder):
 Salon Coeur
         """
         
-        url = "https://api.sendgrid.com/v3/mail/send"
+        url = SENDGRID_API_URL
         headers = {
             "Authorization": f"Bearer {SENDGRID_API_KEY}",
             "Content-Type": "application/json"
@@ -489,25 +1483,24 @@ Salon Coeur
             ]
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = traced_post(url, headers=headers, json=data)
         
         if response.status_code == 202:
-            print(f"リマインダーメールを送信しました: {reminder['email']}")
+            logger.info("リマインダーメールを送信しました: ID %s", reminder['id'], extra=SAMPLED)
             return True
         else:
-            print(f"リマインダー送信エラー: {response.status_code}, {response.text}")
+            logger.error(f"リマインダー送信エラー: {response.status_code}, {response.text}")
             return False
         
     except Exception as e:
-        print(f"リマインダー送信エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"リマインダー送信エラー: {e}")
         return False
 
+@observe_notification("line", lambda: LINE_CHANNEL_ACCESS_TOKEN and LINE_USER_ID)
 def send_line_notification(booking_data):
     """LINE Messaging APIで予約通知を送信"""
     if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_USER_ID:
-        print("LINE Messaging API設定が見つかりません")
+        logger.info("LINE Messaging API設定が見つかりません", extra=SAMPLED)
         return False
     
     try:
@@ -524,7 +1517,7 @@ def send_line_notification(booking_data):
         base_url = os.getenv("BASE_URL", "https://salon-booking-k54d.onrender.com")
         admin_url = f"{base_url}/admin"
         
-        url = "https://api.line.me/v2/bot/message/push"
+        url = LINE_API_URL
         headers = {
             "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
             "Content-Type": "application/json"
@@ -554,18 +1547,16 @@ def send_line_notification(booking_data):
             ]
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = traced_post(url, headers=headers, json=data)
         
         if response.status_code == 200:
-            print("LINE通知を送信しました")
+            logger.info("LINE通知を送信しました")
             return True
         else:
-            print(f"LINE送信エラー: {response.status_code}, {response.text}")
+            logger.error(f"LINE送信エラー: {response.status_code}, {response.text}")
             return False
     except Exception as e:
-        print(f"LINE送信エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"LINE送信エラー: {e}")
         return False
 
 def track_page_view(page_name: str):
@@ -581,7 +1572,7 @@ def track_page_view(page_name: str):
                 """, (page_name,))
                 conn.commit()
     except Exception as e:
-        print(f"ページビュー記録エラー: {e}")
+        logger.error("ページビュー記録エラー: %s", e, extra=SAMPLED)
 
 def get_page_view_stats():
     """ページビュー統計を取得"""
@@ -620,226 +1611,110 @@ def get_page_view_stats():
                     'total': int(total_views)
                 }
     except Exception as e:
-        print(f"統計取得エラー: {e}")
+        logger.error(f"統計取得エラー: {e}")
         return {'today': 0, 'yesterday': 0, 'total': 0}
 
-def init_db():
-    """データベースとテーブルを初期化"""
-    with get_db_connection() as conn:
-        with conn.cursor() as c:
-            # bookingsテーブル - created_atを日本時間で保存
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS bookings (
-                    id SERIAL PRIMARY KEY,
-                    customer_name VARCHAR(100) NOT NULL,
-                    phone_number VARCHAR(20) NOT NULL,
-                    service_name VARCHAR(100) NOT NULL,
-                    booking_date DATE NOT NULL,
-                    booking_time TIME NOT NULL,
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
-                    UNIQUE(booking_date, booking_time)
-                )
-            """)
-            
-            # productsテーブル
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS products (
-                    id SERIAL PRIMARY KEY,
-                    product_name VARCHAR(200) NOT NULL,
-                    description TEXT,
-                    price DECIMAL(10, 2) NOT NULL,
-                    original_price DECIMAL(10, 2),
-                    brand VARCHAR(100),
-                    category VARCHAR(50),
-                    stock_quantity INTEGER DEFAULT 0,
-                    image_data TEXT,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
-                    updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
-                )
-            """)
-            
-            # categoriesテーブル
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    id SERIAL PRIMARY KEY,
-                    category_name VARCHAR(50) UNIQUE NOT NULL,
-                    display_order INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
-                )
-            """)
-            
-            # brandsテーブル
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS brands (
-                    id SERIAL PRIMARY KEY,
-                    brand_name VARCHAR(100) UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
-                )
-            """)
-            
-            # remindersテーブル
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS reminders (
-                    id SERIAL PRIMARY KEY,
-                    email VARCHAR(255) NOT NULL,
-                    booking_date DATE NOT NULL,
-                    booking_time TIME NOT NULL,
-                    customer_name VARCHAR(100) NOT NULL,
-                    service_name VARCHAR(100) NOT NULL,
-                    sent BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
-                )
-            """)
-            
-            # page_viewsテーブル
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS page_views (
-                    id SERIAL PRIMARY KEY,
-                    page_name VARCHAR(100) NOT NULL,
-                    view_date DATE NOT NULL,
-                    view_count INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
-                    UNIQUE(page_name, view_date)
-                )
-            """)
+# カタログ（サービス・商品・カテゴリー・ブランド・時間枠）の変更通知チャンネル
+# （トリガーは migrations/0002_catalog_versions.sql）
+CATALOG_CHANNEL = "catalog_changed"
 
-            # available_slotsテーブル（予約可能時間管理）
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS available_slots (
-                    id SERIAL PRIMARY KEY,
-                    slot_time TIME NOT NULL UNIQUE,
-                    slot_label VARCHAR(20) NOT NULL,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    display_order INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
-                )
-            """)
-            
-            # business_hoursテーブル（営業日管理）
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS business_hours (
-                    id SERIAL PRIMARY KEY,
-                    date DATE NOT NULL UNIQUE,
-                    is_open BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
-                )
-            """)
-            
-            # slot_availabilityテーブル（時間枠ごとの有効/無効管理）
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS slot_availability (
-                    id SERIAL PRIMARY KEY,
-                    date DATE NOT NULL,
-                    slot_time TIME NOT NULL,
-                    is_available BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
-                    updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
-                    UNIQUE(date, slot_time)
-                )
-            """)
-            
-            # servicesテーブル（サービス管理）
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS services (
-                    id SERIAL PRIMARY KEY,
-                    service_name VARCHAR(100) NOT NULL,
-                    description TEXT,
-                    intro_text TEXT,
-                    price DECIMAL(10, 2) NOT NULL,
-                    campaign_price DECIMAL(10, 2),
-                    duration VARCHAR(20),
-                    icon VARCHAR(10) DEFAULT '💆',
-                    image_data TEXT,
-                    is_popular BOOLEAN DEFAULT FALSE,
-                    is_campaign BOOLEAN DEFAULT FALSE,
-                    show_in_booking BOOLEAN DEFAULT TRUE,
-                    show_in_intro BOOLEAN DEFAULT FALSE,
-                    display_order INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
-                    updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
-                )
-            """)
-            
-            # 既存テーブルにカラム追加
+# 管理画面へリアルタイムに知らせる変更（トリガーは migrations/0007_admin_events.sql）
+ADMIN_EVENTS_CHANNEL = "admin_changes"
+
+# 差分同期（/admin/changes）のために変更を記録するテーブル
+# （トリガーは migrations/0008_change_log.sql、コミット順の読み取りは migrations/0011_change_log_txid.sql）
+CHANGE_LOG_TABLES = ('bookings', 'products', 'services', 'available_slots', 'business_hours', 'slot_availability')
+CHANGE_LOG_RETENTION_DAYS = 7
+
+# 商品検索の対象テキスト（インデックスと検索クエリで同じ式を使う、migrations/0004_product_search.sql）
+PRODUCT_SEARCH_DOCUMENT = "lower(product_name::text || ' ' || COALESCE(brand::text, '') || ' ' || COALESCE(description, ''))"
+
+# ========== マイグレーション ==========
+
+# migrations/NNNN_名前.sql を番号順に1回ずつ適用し、適用済みの番号をschema_versionに記録する
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d{4})_(\w+)\.sql$")
+MIGRATION_LOCK_ID = 72030001  # 複数ワーカーが同時に起動しても1プロセスだけが適用する
+
+def load_migrations() -> list:
+    """マイグレーションファイルを (番号, 名前, パス) の番号順リストで返す"""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_PATTERN.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError("マイグレーションの番号が重複しています")
+    return migrations
+
+def current_schema_version(c) -> int:
+    """適用済みの最新番号（schema_versionテーブルがなければ0）"""
+    c.execute("SAVEPOINT schema_version_check")
+    try:
+        c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except psycopg2.ProgrammingError:
+        c.execute("ROLLBACK TO SAVEPOINT schema_version_check")
+        return 0
+    return c.fetchone()[0]
+
+def run_migrations():
+    """
+    未適用のマイグレーションを適用
+    - スキーマが最新なら1回のバージョン確認だけで終わる
+    - 適用するときはアドバイザリーロックを取り、他のプロセスの適用完了を待ってから読み直す
+    """
+    migrations = load_migrations()
+    latest = migrations[-1][0] if migrations else 0
+
+    with get_db_connection(reuse_shared=False) as conn:
+        with conn.cursor() as c:
+            version = current_schema_version(c)
+            conn.rollback()
+            if version >= latest:
+                logger.info(f"✅ スキーマは最新です (version {version})")
+                return
+
+            c.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
             try:
-                c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS image_data TEXT")
-                c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS original_price DECIMAL(10, 2)")
-                c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS brand VARCHAR(100)")
-                c.execute("ALTER TABLE services ADD COLUMN IF NOT EXISTS intro_text TEXT")
-                c.execute("ALTER TABLE services ADD COLUMN IF NOT EXISTS image_data TEXT")
-                c.execute("ALTER TABLE services ADD COLUMN IF NOT EXISTS show_in_booking BOOLEAN DEFAULT TRUE")
-                c.execute("ALTER TABLE services ADD COLUMN IF NOT EXISTS show_in_intro BOOLEAN DEFAULT FALSE")
-                print("✅ servicesテーブルに新しいカラムを追加しました")
-            except Exception as e:
-                print(f"カラム追加スキップ: {e}")
-                            
-            # デフォルトカテゴリーを追加
-            default_categories = ['スキンケア']
-            for idx, cat in enumerate(default_categories):
-                try:
-                    c.execute("""
-                        INSERT INTO categories (category_name, display_order)
-                        VALUES (%s, %s)
-                        ON CONFLICT (category_name) DO NOTHING
-                    """, (cat, idx))
-                except Exception as e:
-                    print(f"デフォルトカテゴリー追加エラー: {e}")
-               
-            # デフォルト予約時間枠を追加
-            default_slots = [
-                ('10:00:00', '10:00', 0),
-                ('14:00:00', '14:00', 1),
-                ('17:00:00', '17:00', 2)
-            ]
-            for slot_time, slot_label, order in default_slots:
-                try:
-                    c.execute("""
-                        INSERT INTO available_slots (slot_time, slot_label, is_active, display_order)
-                        VALUES (%s, %s, TRUE, %s)
-                        ON CONFLICT (slot_time) DO NOTHING
-                    """, (slot_time, slot_label, order))
-                except Exception as e:
-                    print(f"デフォルト時間枠追加エラー: {e}")
-            
-            # デフォルトサービスを追加
-            c.execute("SELECT COUNT(*) FROM services")
-            if c.fetchone()[0] == 0:
-                default_services = [
-                    ('シミケア', 'お肌のシミを集中ケア。美白効果の高いトリートメントで透明感のある肌へ。', 8000, '60分', '✨', True, 1),
-                    ('フェイシャルWAX', '顔の産毛を丁寧に除去。ワントーン明るい透明肌に仕上げます。', 5000, '40分', '💆', False, 2),
-                    ('脳洗浄', 'ヘッドスパで頭皮と心をリフレッシュ。深いリラクゼーションを体験。', 7000, '50分', '🧘', True, 3),
-                    ('ピーリング', '古い角質を優しく除去し、つるんとしたなめらか肌へ導きます。', 6000, '45分', '🌟', False, 4),
-                    ('ハーブサウナ', '天然ハーブの蒸気で全身デトックス。代謝アップと美肌効果。', 9000, '70分', '🌿', False, 5)
-                ]
-                
-                for service in default_services:
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        name VARCHAR(200) NOT NULL,
+                        checksum CHAR(64) NOT NULL,
+                        applied_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+                    )
+                """)
+                conn.commit()
+                version = current_schema_version(c)
+                conn.commit()
+
+                for number, name, path in migrations:
+                    if number <= version:
+                        continue
+                    with open(path, encoding="utf-8") as f:
+                        sql = f.read()
+                    started = time.perf_counter()
+                    # 1ファイル1トランザクション（途中で失敗したらそのファイルの変更はすべて取り消す）
+                    c.execute(sql)
                     c.execute("""
-                        INSERT INTO services (service_name, description, price, duration, icon, is_popular, display_order)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    """, service)
-            
-            # インデックス作成
-            c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings(booking_date)")
-            c.execute("CREATE INDEX IF NOT EXISTS idx_reminders_date ON reminders(booking_date)")
-            c.execute("CREATE INDEX IF NOT EXISTS idx_page_views_date ON page_views(view_date)")
-            c.execute("CREATE INDEX IF NOT EXISTS idx_slot_availability_date ON slot_availability(date)")
-            try:
-                c.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)")
-                c.execute("CREATE INDEX IF NOT EXISTS idx_services_active ON services(is_active)")
-                c.execute("CREATE INDEX IF NOT EXISTS idx_services_order ON services(display_order)")
-            except:
-                pass
-            
-            conn.commit()
+                        INSERT INTO schema_version (version, name, checksum) VALUES (%s, %s, %s)
+                    """, (number, name, hashlib.sha256(sql.encode("utf-8")).hexdigest()))
+                    conn.commit()
+                    logger.info(f"🔧 マイグレーション適用: {number:04d}_{name} ({(time.perf_counter() - started) * 1000:.0f}ms)")
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                c.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+                conn.commit()
 
 def send_reminders():
     """前日のリマインダーを送信"""
     try:
         tomorrow = (datetime.now() + timedelta(days=1)).date()
-        print(f"リマインダーチェック: {tomorrow}")
+        logger.info(f"リマインダーチェック: {tomorrow}")
         
         with get_db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as c:
@@ -849,32 +1724,121 @@ def send_reminders():
                 """, (tomorrow,))
                 reminders = c.fetchall()
                 
-                print(f"送信するリマインダー数: {len(reminders)}")
+                logger.info(f"送信するリマインダー数: {len(reminders)}")
                 
                 for reminder in reminders:
                     try:
                         if send_reminder_email(reminder):
                             c.execute("UPDATE reminders SET sent = TRUE WHERE id = %s", (reminder['id'],))
                             conn.commit()
-                            print(f"リマインダー送信完了: ID {reminder['id']}")
+                            logger.info("リマインダー送信完了: ID %s", reminder['id'], extra=SAMPLED)
                     except Exception as e:
-                        print(f"リマインダー送信エラー (ID: {reminder['id']}): {e}")
+                        logger.error(f"リマインダー送信エラー (ID: {reminder['id']}): {e}")
     except Exception as e:
-        print(f"リマインダーチェックエラー: {e}")
-        import traceback
-        traceback.print_exc()
-
-def run_scheduler():
-    """バックグラウンドでスケジュール実行"""
-    schedule.every().day.at("09:00").do(send_reminders)
-    print("スケジューラー起動: 毎日9:00にリマインダーチェック")
-    
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+        logger.exception(f"リマインダーチェックエラー: {e}")
+
+def prune_change_log():
+    """古い変更履歴を削除（削除したトランザクションIDの上限はtable_versionsのchange_log行に記録）"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                c.execute("""
+                    WITH pruned AS (
+                        DELETE FROM change_log
+                        WHERE changed_at < (NOW() AT TIME ZONE 'Asia/Tokyo') - make_interval(days => %s)
+                        RETURNING txid
+                    )
+                    UPDATE table_versions
+                    SET version = GREATEST(version, (SELECT MAX(txid)::text::bigint FROM pruned)),
+                        updated_at = (NOW() AT TIME ZONE 'Asia/Tokyo')
+                    WHERE table_name = 'change_log' AND EXISTS (SELECT 1 FROM pruned)
+                """, (CHANGE_LOG_RETENTION_DAYS,))
+                conn.commit()
+    except Exception as e:
+        logger.error(f"変更履歴の削除エラー: {e}")
+
+# ========== バックグラウンドサービス ==========
+
+# スケジューラーはデプロイ全体で1つだけ動かす（アドバイザリーロックを取れたワーカーがリーダー）
+LEADER_LOCK_ID = 72030002
+LEADER_RETRY_SECONDS = 30
+SCHEDULER_TICK_SECONDS = 30
+BACKGROUND_SHUTDOWN_TIMEOUT = 10
 
-# データベース初期化
-init_db()
+_background_stop = threading.Event()
+_background_threads = []
+_leader_state = {"is_leader": False}
+
+def run_job(job):
+    """スケジュールされたジョブを実行（リクエストと同じようにSQLの集計とトレースを行う）"""
+    span = start_trace(f"job:{job.__name__}", kind=SPAN_KIND_INTERNAL)
+    token = _current_span.set(span)
+    try:
+        with track_queries(f"job:{job.__name__}"):
+            return job()
+    finally:
+        _current_span.reset(token)
+        if span is not None:
+            span.finish()
+
+def run_scheduler(lock_conn):
+    """リーダーの間だけスケジュールを実行（ロック用の接続が切れたら抜けて他のワーカーに譲る）"""
+    schedule.every().day.at("09:00").do(run_job, send_reminders)
+    schedule.every().day.at("04:00").do(run_job, prune_change_log)
+    schedule.every(10).minutes.do(run_job, sweep_sessions)
+    schedule.every().hour.do(run_job, prune_rate_limits)
+    logger.info("スケジューラー起動: 毎日9:00にリマインダーチェック")
+
+    try:
+        while not _background_stop.wait(SCHEDULER_TICK_SECONDS):
+            # ロックを持つ接続が生きているか確認（切れていればロックも外れている）
+            with lock_conn.cursor() as c:
+                c.execute("SELECT 1")
+            schedule.run_pending()
+    finally:
+        schedule.clear()
+
+def run_leader_election():
+    """リーダーになれるまで定期的にロックを試す（リーダーのプロセスが落ちると接続ごとロックが外れる）"""
+    while not _background_stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as c:
+                c.execute("SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK_ID,))
+                acquired = c.fetchone()[0]
+            if acquired:
+                _leader_state["is_leader"] = True
+                logger.info(f"👑 このワーカー (pid {os.getpid()}) がバックグラウンドジョブのリーダーになりました")
+                run_scheduler(conn)
+        except Exception as e:
+            logger.error(f"リーダー選出エラー: {e}")
+        finally:
+            _leader_state["is_leader"] = False
+            if conn is not None:
+                conn.close()
+        _background_stop.wait(LEADER_RETRY_SECONDS)
+
+def start_background_services():
+    """ワーカーごとのサービス（カタログ更新の受信）と、リーダー選出を開始"""
+    _background_stop.clear()
+    span_exporter.start()
+    for target in (listen_catalog_changes, run_leader_election):
+        thread = threading.Thread(target=target, name=target.__name__, daemon=True)
+        thread.start()
+        _background_threads.append(thread)
+
+def stop_background_services():
+    """停止を知らせ、実行中のジョブが終わるまで待つ（上限BACKGROUND_SHUTDOWN_TIMEOUT秒）"""
+    _background_stop.set()
+    deadline = time.monotonic() + BACKGROUND_SHUTDOWN_TIMEOUT
+    for thread in _background_threads:
+        thread.join(max(0, deadline - time.monotonic()))
+        if thread.is_alive():
+            logger.warning(f"⚠️  {thread.name} が時間内に終了しませんでした")
+    _background_threads.clear()
+    span_exporter.stop()
 
 def migrate_to_jst():
     """既存のテーブルのタイムスタンプを日本時間に移行"""
@@ -912,18 +1876,310 @@ def migrate_to_jst():
     
     print("✅ 移行完了！")
 
-# スケジューラーをバックグラウンドで起動
-threading.Thread(target=run_scheduler, daemon=True).start()
+# ========== JSONレスポンス ==========
+
+# 一覧系APIはPostgresがrow_to_jsonで作ったJSON文字列をそのまま連結して返す
+# （行ごとの辞書生成・jsonable_encoder・再シリアライズを省く）
+STREAM_BATCH_SIZE = 500
+
+# ?fields= で指定できる列
+LIST_FIELDS = {
+    'products': ('id', 'sku', 'product_name', 'description', 'price', 'original_price', 'brand', 'category',
+                 'stock_quantity', 'image_data', 'is_active', 'created_at', 'updated_at'),
+    'services': ('id', 'service_name', 'description', 'intro_text', 'price', 'campaign_price', 'duration',
+                 'icon', 'image_data', 'is_popular', 'is_campaign', 'show_in_booking', 'show_in_intro',
+                 'display_order', 'is_active', 'created_at', 'updated_at'),
+    'bookings': ('id', 'customer_name', 'phone_number', 'service_name', 'booking_date', 'booking_time',
+                 'notes', 'created_at'),
+    'categories': ('id', 'category_name', 'display_order', 'created_at'),
+    'brands': ('id', 'brand_name', 'created_at'),
+}
+
+def parse_fields(table: str, fields: str):
+    """?fields=id,name を列名のリストに変換（未指定ならNone、不正な列はValueError）"""
+    if not fields:
+        return None
+    allowed = LIST_FIELDS[table]
+    selected = []
+    for field in fields.split(','):
+        field = field.strip()
+        if not field or field in selected:
+            continue
+        if field not in allowed:
+            raise ValueError(f"不正なフィールドです: {field}")
+        selected.append(field)
+    return selected or None
+
+def json_projection(fields) -> str:
+    """指定列だけのJSONを作るSQL式（列名はLIST_FIELDSで検証済みのもの）"""
+    pairs = ", ".join(f"'{field}', {field}" for field in fields)
+    return f"json_build_object({pairs})::text"
+
+def render_json_list(key: str, rows_json, extra: dict = None) -> bytes:
+    """JSON文字列の行から {"key": [...], ...} を組み立てる"""
+    parts = ['{', json.dumps(key), ':[', ','.join(rows_json), ']']
+    for extra_key, value in (extra or {}).items():
+        parts += [',', json.dumps(extra_key), ':', json.dumps(value, default=str, ensure_ascii=False)]
+    parts.append('}')
+    return ''.join(parts).encode('utf-8')
+
+def json_list_response(key: str, rows_json, extra: dict = None, headers: dict = None) -> Response:
+    """JSON文字列の行からレスポンスを生成"""
+    return Response(content=render_json_list(key, rows_json, extra), media_type="application/json", headers=headers)
+
+def stream_json_query(key: str, query: str, params=None, headers: dict = None) -> StreamingResponse:
+    """
+    1列目にJSON文字列を返すクエリをサーバーサイドカーソルで読みながら {"key": [...]} として送る
+    - 件数に関係なくメモリ使用量はSTREAM_BATCH_SIZE行分で一定
+    """
+    def generate():
+        with get_db_connection() as conn:
+            with conn.cursor(name=f"stream_{key}") as c:
+                c.itersize = STREAM_BATCH_SIZE
+                c.execute(query, params)
+                yield ('{' + json.dumps(key) + ':[').encode('utf-8')
+                separator = ''
+                while True:
+                    rows = c.fetchmany(STREAM_BATCH_SIZE)
+                    if not rows:
+                        break
+                    yield (separator + ','.join(row[0] for row in rows)).encode('utf-8')
+                    separator = ','
+                yield b']}'
+
+    body = generate()
+    # 接続・クエリのエラーはレスポンス開始前に500として返せるよう、先頭だけここで実行する
+    first_chunk = next(body)
+
+    def chained():
+        yield first_chunk
+        yield from body
+
+    return StreamingResponse(chained(), media_type="application/json", headers=headers)
+
+# ========== カタログスナップショット ==========
+
+# 公開APIが読むカタログをメモリ上に不変のスナップショットとして保持する
+# 更新時は丸ごと作り直して参照を差し替えるだけなので、読み取り側にロックは不要
+CatalogSnapshot = namedtuple('CatalogSnapshot', [
+    'services', 'categories', 'brands', 'products', 'available_slots', 'versions', 'projections', 'loaded_at'
+])
+
+# 一覧をJSONで保持するテーブルの (絞り込みに使う列, 並び順)
+CATALOG_LISTS = {
+    'services': ("is_active, show_in_booking, show_in_intro", "display_order, service_name"),
+    'categories': ("id", "display_order, category_name"),
+    'brands': ("id", "brand_name"),
+    'products': ("is_active, category, brand", "COALESCE(category, ''), COALESCE(brand, ''), product_name, id"),
+}
+
+# ?fields= で絞った一覧をスナップショットごとに保持する上限（組み合わせ数）
+CATALOG_MAX_PROJECTIONS = 32
+
+# ブラウザには毎回再検証させ、変更がなければ304で済ませる
+CATALOG_CACHE_CONTROL = "public, no-cache"
+
+# 通知を取りこぼした場合の保険として、これより古いスナップショットは読み直す（秒）
+CATALOG_MAX_AGE = 300
+
+_catalog_snapshot = None
+_catalog_lock = threading.Lock()
+# 管理画面での更新ごとに進める世代（読み込み中に更新があったスナップショットは差し替えに使わない）
+_catalog_generation = 0
+_catalog_state_lock = threading.Lock()
+# 更新後の作り直しはリクエストの外（1スレッド）で行う
+catalog_rebuild_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog")
+# ?fields= で要求された射影（スナップショットを作るときに同じトランザクションで読み込む、古いものから捨てる）
+_catalog_projection_keys = []
+
+def load_catalog_rows(c, table: str, fields=None) -> tuple:
+    """一覧をレスポンス用のJSON文字列（Postgres側で生成）と絞り込み用の列で読み込む"""
+    filter_columns, order_by = CATALOG_LISTS[table]
+    projection = json_projection(fields) if fields else f"row_to_json({table})::text"
+    c.execute(f"SELECT {filter_columns}, {projection} AS json FROM {table} ORDER BY {order_by}")
+    return tuple(c.fetchall())
+
+def load_catalog_snapshot() -> CatalogSnapshot:
+    """カタログをDBから読み込む（要求されたことのある射影も同じ時点で読む）"""
+    projection_keys = list(_catalog_projection_keys)
+    # 独自のトランザクション設定を使うため、バッチの共有接続は使わない
+    with get_db_connection(reuse_shared=False) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as c:
+            # 全テーブルと変更カウンターを同じ時点の状態で読む
+            c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            c.execute("SELECT table_name, version FROM table_versions")
+            versions = MappingProxyType({row['table_name']: row['version'] for row in c.fetchall()})
+            lists = {table: load_catalog_rows(c, table) for table in CATALOG_LISTS}
+            projections = {key: load_catalog_rows(c, key[0], list(key[1])) for key in projection_keys}
+            c.execute("""
+                SELECT * FROM available_slots
+                WHERE is_active = TRUE
+                ORDER BY display_order, slot_time
+            """)
+            available_slots = tuple(c.fetchall())
+    return CatalogSnapshot(
+        lists['services'], lists['categories'], lists['brands'], lists['products'],
+        available_slots, versions, projections, time.monotonic()
+    )
+
+def catalog_snapshot_fresh(snapshot) -> bool:
+    return snapshot is not None and time.monotonic() - snapshot.loaded_at <= CATALOG_MAX_AGE
+
+def refresh_catalog_snapshot(seen=False) -> CatalogSnapshot:
+    """
+    スナップショットを作り直して差し替え
+    - seen: 呼び出し側が古いと判断したスナップショット。ロック待ちの間に他のスレッドが
+      読み直していれば、それをそのまま使う（同時に来たリクエストが順番に全件読み直さないように）
+    - 省略時（更新通知を受けたとき）は必ず読み直す
+    - 読み込み中に invalidate_catalog() された場合は、その更新を含まない可能性があるので差し替えない
+    """
+    global _catalog_snapshot
+    with _catalog_lock:
+        current = _catalog_snapshot
+        if seen is not False and current is not seen and catalog_snapshot_fresh(current):
+            return current
+        generation = _catalog_generation
+        snapshot = load_catalog_snapshot()
+        with _catalog_state_lock:
+            if _catalog_generation == generation:
+                _catalog_snapshot = snapshot
+    return snapshot
+
+def get_catalog_snapshot() -> CatalogSnapshot:
+    """現在のスナップショットを取得（未読み込み・期限切れなら読み直す）"""
+    snapshot = _catalog_snapshot
+    if not catalog_snapshot_fresh(snapshot):
+        CACHE_REQUESTS.inc("catalog", "miss")
+        snapshot = refresh_catalog_snapshot(seen=snapshot)
+    else:
+        CACHE_REQUESTS.inc("catalog", "hit")
+    return snapshot
+
+def remember_catalog_projection(key):
+    """射影を次のスナップショットから一緒に読み込むよう登録（上限を超えたら古いものから外す）"""
+    with _catalog_state_lock:
+        if key in _catalog_projection_keys:
+            return
+        _catalog_projection_keys.append(key)
+        del _catalog_projection_keys[:-CATALOG_MAX_PROJECTIONS]
+
+def get_catalog_rows(snapshot: CatalogSnapshot, table: str, fields=None) -> tuple:
+    """
+    スナップショットから一覧を取得し、(行, スナップショット) を返す（ETagは返されたスナップショットから作る）
+    - fieldsを指定した場合は、その列だけをSQLで射影した一覧を使う
+    - 初めての射影は変更カウンターを同じトランザクションで読み、スナップショットと同じ時点ならそのまま保持する
+      DBが先に進んでいれば、射影も含めてスナップショットを1つのトランザクションで読み直す
+    """
+    if not fields:
+        return getattr(snapshot, table), snapshot
+
+    key = (table, tuple(fields))
+    rows = snapshot.projections.get(key)
+    CACHE_REQUESTS.inc("catalog_projection", "miss" if rows is None else "hit")
+    if rows is not None:
+        return rows, snapshot
+
+    remember_catalog_projection(key)
+    with get_db_connection(reuse_shared=False) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as c:
+            c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            c.execute("SELECT version FROM table_versions WHERE table_name = %s", (table,))
+            row = c.fetchone()
+            version = row['version'] if row else 0
+            rows = load_catalog_rows(c, table, fields)
+    if version == snapshot.versions.get(table, 0):
+        # 同じ変更カウンター = 同じ内容。スナップショットが差し替わればこのキャッシュも一緒に捨てられる
+        if len(snapshot.projections) < CATALOG_MAX_PROJECTIONS:
+            snapshot.projections[key] = rows
+        return rows, snapshot
+
+    refreshed = refresh_catalog_snapshot(seen=snapshot)
+    if key in refreshed.projections:
+        return refreshed.projections[key], refreshed
+    # 読み直しの間に他の射影に押し出された場合だけ、読み込んだ行をその時点の世代で返す
+    return rows, snapshot._replace(versions=MappingProxyType({**snapshot.versions, table: version}))
+
+def catalog_etag(snapshot: CatalogSnapshot, *tables) -> str:
+    """テーブルの変更カウンターから強いETagを生成"""
+    versions = snapshot.versions
+    return '"' + "-".join(f"{table}.{versions.get(table, 0)}" for table in tables) + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Matchが現在のETagと一致するか"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        matched = True
+    else:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        matched = any(tag.removeprefix("W/") == etag for tag in candidates)
+    # 条件付きリクエストだけを数える（304で返せた割合）
+    CACHE_REQUESTS.inc("http_etag", "hit" if matched else "miss")
+    return matched
+
+def catalog_cache_headers(snapshot: CatalogSnapshot, *tables) -> dict:
+    """カタログ系APIのETag・Cache-Controlヘッダー（一致すれば呼び出し側で304を返す）"""
+    return {"ETag": catalog_etag(snapshot, *tables), "Cache-Control": CATALOG_CACHE_CONTROL}
+
+def invalidate_catalog():
+    """
+    管理画面での更新（コミット後）に呼ぶ
+    - 古いスナップショットはすぐに使われなくし、作り直しは専用スレッドで始める（呼び出し側は待たない）
+    - その間に来た読み取りは、始まっている作り直しの完了を待って同じスナップショットを使う
+    - async defのハンドラーから呼んでもイベントループを止めない
+    """
+    global _catalog_snapshot, _catalog_generation
+    with _catalog_state_lock:
+        _catalog_generation += 1
+        _catalog_snapshot = None
+    catalog_rebuild_executor.submit(rebuild_catalog_snapshot)
+
+def rebuild_catalog_snapshot():
+    try:
+        # 続けて更新された場合、前の作り直しが済んでいれば読み直さずに終わる
+        refresh_catalog_snapshot(seen=None)
+    except Exception as e:
+        logger.error(f"カタログの作り直しエラー: {e}")
+
+def listen_catalog_changes():
+    """LISTEN/NOTIFYで他ワーカーからのカタログ更新を受け取る"""
+    while not _background_stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as c:
+                c.execute(f"LISTEN {CATALOG_CHANNEL}")
+            # LISTEN開始前の更新を取りこぼさないよう、接続のたびに読み直す
+            refresh_catalog_snapshot()
+            logger.info("カタログ更新通知の受信を開始")
+
+            while not _background_stop.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    # まとめて届いた通知は1回の読み直しで済ませる
+                    conn.notifies.clear()
+                    refresh_catalog_snapshot()
+        except Exception as e:
+            logger.error(f"カタログ更新通知の受信エラー: {e}")
+            _background_stop.wait(5)
+        finally:
+            if conn is not None:
+                conn.close()
 
 # ========== 認証エンドポイント ==========
 
-@app.get("/admin/login", response_class=HTMLResponse)
+@router.get("/admin/login", response_class=HTMLResponse)
 @limiter.limit("20/minute")  # 1分間に20回まで
 def admin_login_page(request: Request):
     """管理画面ログインページ"""
     return templates.TemplateResponse("admin_login.html", {"request": request})
 
-@app.post("/admin/login")
+@router.post("/admin/login")
+@limit_off_loop
 @limiter.limit("5/minute")  # 1分間に5回まで（ブルートフォース対策）
 async def admin_login(
     request: Request,
@@ -933,12 +2189,12 @@ async def admin_login(
 ):
     
     """管理画面ログイン処理"""
-    if username == ADMIN_USERNAME and verify_password(password, username):
+    password_ok = await asyncio.get_running_loop().run_in_executor(
+        password_executor, verify_password, password, username
+    )
+    if username == ADMIN_USERNAME and password_ok:
         session_token = create_session_token()
-        active_sessions[session_token] = {
-            'username': username,
-            'login_time': datetime.now()
-        }
+        await run_in_threadpool(session_store.create, session_token, username)
         
         redirect_response = RedirectResponse(url="/admin", status_code=303)
         redirect_response.set_cookie(
@@ -947,18 +2203,21 @@ async def admin_login(
             httponly=True,
             secure=IS_PRODUCTION,
             samesite="lax",
-            max_age=86400,
+            max_age=SESSION_MAX_AGE,
             path="/"
         )
         return redirect_response
     else:
         return RedirectResponse(url="/admin/login?error=invalid", status_code=303)
 
-@app.get("/admin/logout")
+@router.get("/admin/logout")
 async def admin_logout(response: Response, session_token: str = Cookie(None)):
     """ログアウト処理"""
-    if session_token and session_token in active_sessions:
-        del active_sessions[session_token]
+    if session_token:
+        try:
+            await run_in_threadpool(session_store.revoke, session_token)
+        except Exception as e:
+            logger.error(f"ログアウトエラー: {e}")
     
     redirect_response = RedirectResponse(url="/admin/login", status_code=303)
     # Cookieを完全に削除
@@ -972,25 +2231,25 @@ async def admin_logout(response: Response, session_token: str = Cookie(None)):
 
 # ========== ページ表示のエンドポイント ==========
 
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 def home_page(request: Request):
     """ホームページを表示（トップページ）"""
     track_page_view('home')
     return templates.TemplateResponse("home.html", {"request": request})
 
-@app.get("/home", response_class=HTMLResponse)
+@router.get("/home", response_class=HTMLResponse)
 def home_page_redirect(request: Request):
     """/home でもホームページを表示"""
     track_page_view('home')
     return templates.TemplateResponse("home.html", {"request": request})
     
-@app.get("/shop", response_class=HTMLResponse)
+@router.get("/shop", response_class=HTMLResponse)
 def shop_page(request: Request):
     """商品一覧ページを表示"""
     track_page_view('shop')
     return templates.TemplateResponse("shop.html", {"request": request})
 
-@app.get("/admin", response_class=HTMLResponse)
+@router.get("/admin", response_class=HTMLResponse)
 async def admin_page(request: Request, session_token: str = Cookie(None)):
     """管理画面 - 予約管理を表示"""
     if not verify_admin_session(session_token):
@@ -1002,28 +2261,28 @@ async def admin_page(request: Request, session_token: str = Cookie(None)):
         "stats": stats
     })
 
-@app.get("/admin/products", response_class=HTMLResponse)
+@router.get("/admin/products", response_class=HTMLResponse)
 async def admin_products_page(request: Request, session_token: str = Cookie(None)):
     """管理画面 - 商品登録ページを表示"""
     if not verify_admin_session(session_token):
         return RedirectResponse(url="/admin/login", status_code=303)
     return templates.TemplateResponse("admin_products.html", {"request": request})
 
-@app.get("/admin/products/list", response_class=HTMLResponse)
+@router.get("/admin/products/list", response_class=HTMLResponse)
 async def admin_products_list_page(request: Request, session_token: str = Cookie(None)):
     """管理画面 - 商品一覧管理ページを表示"""
     if not verify_admin_session(session_token):
         return RedirectResponse(url="/admin/login", status_code=303)
     return templates.TemplateResponse("admin_products_list.html", {"request": request})
 
-@app.get("/admin/calendar", response_class=HTMLResponse)
+@router.get("/admin/calendar", response_class=HTMLResponse)
 async def admin_calendar_page(request: Request, session_token: str = Cookie(None)):
     """管理画面 - 予約カレンダー管理ページを表示"""
     if not verify_admin_session(session_token):
         return RedirectResponse(url="/admin/login", status_code=303)
     return templates.TemplateResponse("admin_calendar.html", {"request": request})
 
-@app.get("/services-page", response_class=HTMLResponse)
+@router.get("/services-page", response_class=HTMLResponse)
 def services_intro_page(request: Request):
     """サービス紹介ページを表示"""
     track_page_view('services_intro')
@@ -1031,14 +2290,14 @@ def services_intro_page(request: Request):
 
 # ========== ページ表示のエンドポイント ========== のセクションに追加
 
-@app.get("/admin/schedule", response_class=HTMLResponse)
+@router.get("/admin/schedule", response_class=HTMLResponse)
 async def admin_schedule_page(request: Request, session_token: str = Cookie(None)):
     """管理画面 - スケジュールカレンダーを表示"""
     if not verify_admin_session(session_token):
         return RedirectResponse(url="/admin/login", status_code=303)
     return templates.TemplateResponse("admin_schedule.html", {"request": request})
     
-@app.get("/complete", response_class=HTMLResponse)
+@router.get("/complete", response_class=HTMLResponse)
 def complete_page(request: Request, customer_name: str = "", phone_number: str = "",
                   service_name: str = "", booking_date: str = "", booking_time: str = "", notes: str = ""):
     """予約完了ページを表示"""
@@ -1053,7 +2312,7 @@ def complete_page(request: Request, customer_name: str = "", phone_number: str =
         "notes": notes
     })
 
-@app.get("/booking", response_class=HTMLResponse)
+@router.get("/booking", response_class=HTMLResponse)
 def read_form(request: Request):
     """予約フォームを表示（/booking に移動）"""
     track_page_view('booking_form')
@@ -1084,24 +2343,9 @@ def read_form(request: Request):
                     ORDER BY date, slot_time
                 """, (today, three_months_later))
                 slot_availability_data = c.fetchall()
-                
-                # 予約可能時間枠を取得
-                c.execute("""
-                    SELECT slot_time, slot_label, display_order
-                    FROM available_slots 
-                    WHERE is_active = TRUE
-                    ORDER BY display_order, slot_time
-                """)
-                available_slots = c.fetchall()
-                
-                # サービス一覧を取得
-                c.execute("""
-                    SELECT id, service_name, description, price, duration, icon, is_popular
-                    FROM services
-                    WHERE is_active = TRUE
-                    ORDER BY display_order, service_name
-                """)
-                services = c.fetchall()
+        
+        # 予約可能時間枠はスナップショットから取得（サービス一覧は画面側で/servicesから取得）
+        available_slots = get_catalog_snapshot().available_slots
         
         # 予約済み時間を辞書形式に変換
         booked_dict = {}
@@ -1141,13 +2385,10 @@ def read_form(request: Request):
             "booked": booked_dict,
             "closed_dates": closed_dates,
             "disabled_slots": disabled_slots,
-            "time_slots": time_slots,
-            "services": services
+            "time_slots": time_slots
         })
     except Exception as e:
-        print(f"予約フォーム表示エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"予約フォーム表示エラー: {e}")
         # エラー時は空のデータで表示
         return templates.TemplateResponse("index.html", {
             "request": request, 
@@ -1158,11 +2399,10 @@ def read_form(request: Request):
                 {"value": "10:00", "label": "10:00"},
                 {"value": "14:00", "label": "14:00"},
                 {"value": "17:00", "label": "17:00"}
-            ],
-            "services": []
+            ]
         })
 
-@app.get("/admin/services", response_class=HTMLResponse)
+@router.get("/admin/services", response_class=HTMLResponse)
 async def admin_services_page(request: Request, session_token: str = Cookie(None)):
     """管理画面 - サービス管理ページを表示"""
     if not verify_admin_session(session_token):
@@ -1171,20 +2411,17 @@ async def admin_services_page(request: Request, session_token: str = Cookie(None
     
 # ========== 予約時間枠管理API ==========
 
-@app.get("/available-slots")
-def get_available_slots():
+@router.get("/available-slots")
+def get_available_slots(request: Request, response: Response):
     """予約可能時間枠を取得"""
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as c:
-            c.execute("""
-                SELECT * FROM available_slots 
-                WHERE is_active = TRUE
-                ORDER BY display_order, slot_time
-            """)
-            slots = c.fetchall()
-    return {"slots": slots}
+    snapshot = get_catalog_snapshot()
+    headers = catalog_cache_headers(snapshot, 'available_slots')
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {"slots": list(snapshot.available_slots)}
 
-@app.get("/business-hours/{year}/{month}")
+@router.get("/business-hours/{year}/{month}")
 async def get_business_hours(year: int, month: int, session_token: str = Cookie(None)):
     """指定月の営業日情報を取得"""
     if not verify_admin_session(session_token):
@@ -1218,10 +2455,147 @@ async def get_business_hours(year: int, month: int, session_token: str = Cookie(
             "slot_availability": slot_data
         }
     except Exception as e:
-        print(f"営業日取得エラー: {e}")
+        logger.error(f"営業日取得エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.post("/admin/business-hours")
+# ========== スケジュール一括編集 ==========
+
+# 曜日はPostgresのEXTRACT(DOW)・JavaScriptのgetDay()と同じく 0=日曜 〜 6=土曜
+ALL_WEEKDAYS = [0, 1, 2, 3, 4, 5, 6]
+SCHEDULE_MAX_DAYS = 366
+
+def parse_schedule_range(start_date: str, end_date: str, weekdays=None):
+    """期間と曜日を検証して (開始日, 終了日, 曜日リスト) を返す"""
+    try:
+        start = date.fromisoformat(str(start_date))
+        end = date.fromisoformat(str(end_date))
+    except ValueError:
+        raise ValueError("日付の形式が正しくありません（YYYY-MM-DD）")
+    if end < start:
+        raise ValueError("終了日は開始日以降を指定してください")
+    if (end - start).days >= SCHEDULE_MAX_DAYS:
+        raise ValueError(f"一度に変更できるのは{SCHEDULE_MAX_DAYS}日までです")
+
+    if weekdays is None:
+        weekdays = ALL_WEEKDAYS
+    if not weekdays or any(not isinstance(w, int) or w < 0 or w > 6 for w in weekdays):
+        raise ValueError("曜日は0（日曜）〜6（土曜）で指定してください")
+    return start, end, sorted(set(weekdays))
+
+def apply_schedule(c, start, end, weekdays, is_open=None, time_slots=None) -> dict:
+    """
+    期間内の指定曜日に営業/休業と時間枠の有効/無効を1文でまとめて反映
+    - is_open: Noneなら営業日情報は変更しない
+    - time_slots: {slot_time: is_available}、空なら時間枠は変更しない
+    """
+    time_slots = time_slots or {}
+    ctes = ["""
+        days AS (
+            SELECT d::date AS date
+            FROM generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS d
+            WHERE EXTRACT(DOW FROM d)::int = ANY(%(weekdays)s)
+        )
+    """]
+    if is_open is not None:
+        ctes.append("""
+        bh AS (
+            INSERT INTO business_hours (date, is_open)
+            SELECT date, %(is_open)s FROM days
+            ON CONFLICT (date) DO UPDATE SET is_open = EXCLUDED.is_open
+            RETURNING 1
+        )
+        """)
+    if time_slots:
+        ctes.append("""
+        sa AS (
+            INSERT INTO slot_availability (date, slot_time, is_available, updated_at)
+            SELECT days.date, s.slot_time, s.is_available, CURRENT_TIMESTAMP
+            FROM days
+            CROSS JOIN UNNEST(%(slot_times)s::time[], %(slot_values)s::boolean[]) AS s(slot_time, is_available)
+            ON CONFLICT (date, slot_time)
+            DO UPDATE SET is_available = EXCLUDED.is_available, updated_at = CURRENT_TIMESTAMP
+            RETURNING 1
+        )
+        """)
+
+    c.execute(f"""
+        WITH {','.join(ctes)}
+        SELECT (SELECT COUNT(*) FROM days) AS days,
+               {'(SELECT COUNT(*) FROM bh)' if is_open is not None else '0'} AS business_hours,
+               {'(SELECT COUNT(*) FROM sa)' if time_slots else '0'} AS slots
+    """, {
+        "start": start,
+        "end": end,
+        "weekdays": list(weekdays),
+        "is_open": is_open,
+        "slot_times": list(time_slots.keys()),
+        "slot_values": [bool(v) for v in time_slots.values()],
+    })
+    days, business_hours, slots = c.fetchone()
+    return {"days": days, "business_hours": business_hours, "slots": slots}
+
+def copy_schedule_week(c, source_week_start, start, end, weekdays) -> dict:
+    """
+    source_week_startから7日間の営業/休業・時間枠のパターンを期間内の同じ曜日へ1文でコピー
+    - コピー元に記録のない時間枠はコピー先でも記録なし（＝受付可）に戻す
+    """
+    c.execute("""
+        WITH source AS (
+            SELECT d::date AS date, EXTRACT(DOW FROM d)::int AS dow
+            FROM generate_series(%(source)s::date, %(source)s::date + 6, interval '1 day') AS d
+        ),
+        targets AS (
+            SELECT d::date AS date, EXTRACT(DOW FROM d)::int AS dow
+            FROM generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS d
+            WHERE EXTRACT(DOW FROM d)::int = ANY(%(weekdays)s)
+        ),
+        bh AS (
+            INSERT INTO business_hours (date, is_open)
+            SELECT t.date, COALESCE(b.is_open, TRUE)
+            FROM targets t
+            JOIN source s ON s.dow = t.dow
+            LEFT JOIN business_hours b ON b.date = s.date
+            ON CONFLICT (date) DO UPDATE SET is_open = EXCLUDED.is_open
+            RETURNING 1
+        ),
+        source_slots AS (
+            SELECT s.dow, a.slot_time, a.is_available
+            FROM source s
+            JOIN slot_availability a ON a.date = s.date
+        ),
+        sa AS (
+            INSERT INTO slot_availability (date, slot_time, is_available, updated_at)
+            SELECT t.date, ss.slot_time, ss.is_available, CURRENT_TIMESTAMP
+            FROM targets t
+            JOIN source_slots ss ON ss.dow = t.dow
+            ON CONFLICT (date, slot_time)
+            DO UPDATE SET is_available = EXCLUDED.is_available, updated_at = CURRENT_TIMESTAMP
+            RETURNING 1
+        ),
+        cleared AS (
+            DELETE FROM slot_availability a
+            USING targets t
+            WHERE a.date = t.date
+            AND NOT EXISTS (
+                SELECT 1 FROM source_slots ss
+                WHERE ss.dow = t.dow AND ss.slot_time = a.slot_time
+            )
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM targets) AS days,
+               (SELECT COUNT(*) FROM bh) AS business_hours,
+               (SELECT COUNT(*) FROM sa) AS slots,
+               (SELECT COUNT(*) FROM cleared) AS cleared_slots
+    """, {
+        "source": source_week_start,
+        "start": start,
+        "end": end,
+        "weekdays": list(weekdays),
+    })
+    days, business_hours, slots, cleared_slots = c.fetchone()
+    return {"days": days, "business_hours": business_hours, "slots": slots, "cleared_slots": cleared_slots}
+
+@router.post("/admin/business-hours")
 async def update_business_hours(request: Request, session_token: str = Cookie(None)):
     """営業日を更新"""
     if not verify_admin_session(session_token):
@@ -1235,33 +2609,56 @@ async def update_business_hours(request: Request, session_token: str = Cookie(No
         
         with get_db_connection() as conn:
             with conn.cursor() as c:
-                # 営業日情報を更新
-                c.execute("""
-                    INSERT INTO business_hours (date, is_open)
-                    VALUES (%s, %s)
-                    ON CONFLICT (date) 
-                    DO UPDATE SET is_open = EXCLUDED.is_open
-                """, (date, is_open))
-                
-                # 時間枠ごとの有効/無効を更新
-                for slot_time, is_available in time_slots.items():
-                    c.execute("""
-                        INSERT INTO slot_availability (date, slot_time, is_available, updated_at)
-                        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                        ON CONFLICT (date, slot_time)
-                        DO UPDATE SET is_available = EXCLUDED.is_available, updated_at = CURRENT_TIMESTAMP
-                    """, (date, slot_time, is_available))
-                
+                # 営業日情報と時間枠ごとの有効/無効を1文で更新
+                apply_schedule(c, date, date, ALL_WEEKDAYS, is_open, time_slots)
                 conn.commit()
         
         return {"success": True, "message": "営業日を更新しました"}
     except Exception as e:
-        print(f"営業日更新エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"営業日更新エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@router.post("/admin/business-hours/bulk")
+async def bulk_update_business_hours(request: Request, session_token: str = Cookie(None)):
+    """
+    営業日・時間枠を期間と曜日でまとめて更新（管理者用）
+    - {"operation": "apply", "start_date", "end_date", "weekdays": [0-6], "is_open": bool, "time_slots": {"10:00": false}}
+    - {"operation": "copy_week", "source_week_start", "start_date", "end_date", "weekdays": [0-6]}
+    """
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    try:
+        data = await request.json()
+        operation = data.get('operation', 'apply')
+        start, end, weekdays = parse_schedule_range(data.get('start_date'), data.get('end_date'), data.get('weekdays'))
+
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                if operation == 'apply':
+                    is_open = data.get('is_open')
+                    time_slots = data.get('time_slots') or {}
+                    if is_open is None and not time_slots:
+                        return JSONResponse(status_code=400, content={"error": "is_openまたはtime_slotsを指定してください"})
+                    result = apply_schedule(c, start, end, weekdays, is_open, time_slots)
+                elif operation == 'copy_week':
+                    try:
+                        source_week_start = date.fromisoformat(str(data.get('source_week_start')))
+                    except ValueError:
+                        return JSONResponse(status_code=400, content={"error": "source_week_startの形式が正しくありません（YYYY-MM-DD）"})
+                    result = copy_schedule_week(c, source_week_start, start, end, weekdays)
+                else:
+                    return JSONResponse(status_code=400, content={"error": f"不正な操作です: {operation}"})
+                conn.commit()
+
+        return {"success": True, "message": "営業日をまとめて更新しました", **result}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        logger.exception(f"営業日一括更新エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.post("/admin/available-slots")
+@router.post("/admin/available-slots")
 async def create_time_slot(request: Request, session_token: str = Cookie(None)):
     """予約時間枠を追加"""
     if not verify_admin_session(session_token):
@@ -1279,12 +2676,13 @@ async def create_time_slot(request: Request, session_token: str = Cookie(None)):
                 slot_id = c.fetchone()[0]
                 conn.commit()
         
+        invalidate_catalog()
         return {"success": True, "id": slot_id, "message": "時間枠を追加しました"}
     except Exception as e:
-        print(f"時間枠追加エラー: {e}")
+        logger.error(f"時間枠追加エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.delete("/admin/available-slots/{slot_id}")
+@router.delete("/admin/available-slots/{slot_id}")
 async def delete_time_slot(slot_id: int, session_token: str = Cookie(None)):
     """予約時間枠を削除"""
     if not verify_admin_session(session_token):
@@ -1296,16 +2694,17 @@ async def delete_time_slot(slot_id: int, session_token: str = Cookie(None)):
                 c.execute("DELETE FROM available_slots WHERE id = %s", (slot_id,))
                 conn.commit()
         
+        invalidate_catalog()
         return {"success": True, "message": "時間枠を削除しました"}
     except Exception as e:
-        print(f"時間枠削除エラー: {e}")
+        logger.error(f"時間枠削除エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 # ========== 予約API（ユーザー用） ==========
 
 # ========== /book エンドポイントの修正版 ==========
 
-@app.post("/book")
+@router.post("/book")
 @limiter.limit("10/minute")  # 1分間に10回まで
 def book_service(
     request: Request,
@@ -1348,38 +2747,40 @@ def book_service(
         try:
             send_gmail_notification(booking_data)
         except Exception as e:
-            print(f"Gmail通知エラー（無視）: {e}")
+            logger.error(f"Gmail通知エラー（無視）: {e}")
         
         try:
             send_line_notification(booking_data)
         except Exception as e:
-            print(f"LINE通知エラー（無視）: {e}")
+            logger.error(f"LINE通知エラー（無視）: {e}")
         
         params = urlencode({'customer_name': customer_name, 'phone_number': phone_number,
                            'service_name': service_name, 'booking_date': booking_date,
                            'booking_time': booking_time, 'notes': notes or ''})
         return RedirectResponse(f"/complete?{params}", status_code=303)
     except Exception as e:
-        print(f"予約エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"予約エラー: {e}")
         return RedirectResponse("/booking?error=system", status_code=303)
 
-@app.get("/bookings")
+@router.get("/bookings")
 @limiter.limit("60/minute")
-def get_bookings(request: Request):
-    """予約一覧を取得"""
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as c:
-            c.execute("""SELECT id, customer_name, phone_number, service_name, 
-                       booking_date, booking_time, notes, created_at FROM bookings 
-                       ORDER BY booking_date DESC, booking_time DESC""")
-            bookings = c.fetchall()
-    return {"bookings": bookings}
+def get_bookings(request: Request, fields: str = None):
+    """予約一覧を取得（fields: 返す列をカンマ区切りで指定）"""
+    try:
+        selected_fields = parse_fields('bookings', fields) or LIST_FIELDS['bookings']
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    return stream_json_query("bookings", f"""
+        SELECT {json_projection(selected_fields)}
+        FROM bookings
+        ORDER BY booking_date DESC, booking_time DESC
+    """)
 
 # ========== 予約管理API（管理者用） ==========
 
-@app.post("/admin/bookings")
+@router.post("/admin/bookings")
+@limit_off_loop
 @limiter.limit("30/minute")
 async def create_booking_admin(request: Request, session_token: str = Cookie(None)):
     """予約を追加（管理者用）"""
@@ -1401,10 +2802,10 @@ async def create_booking_admin(request: Request, session_token: str = Cookie(Non
                 conn.commit()
         return {"success": True, "message": "予約を追加しました"}
     except Exception as e:
-        print(f"予約追加エラー: {e}")
+        logger.error(f"予約追加エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
     
-@app.put("/admin/bookings/{booking_id}")
+@router.put("/admin/bookings/{booking_id}")
 async def update_booking_admin(booking_id: int, request: Request, session_token: str = Cookie(None)):
     """予約を更新（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1421,10 +2822,10 @@ async def update_booking_admin(booking_id: int, request: Request, session_token:
                 conn.commit()
         return {"success": True, "message": "予約を更新しました"}
     except Exception as e:
-        print(f"予約更新エラー: {e}")
+        logger.error(f"予約更新エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.delete("/admin/bookings/{booking_id}")
+@router.delete("/admin/bookings/{booking_id}")
 async def delete_booking_admin(booking_id: int, session_token: str = Cookie(None)):
     """予約を削除（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1437,48 +2838,1158 @@ async def delete_booking_admin(booking_id: int, session_token: str = Cookie(None
                 conn.commit()
         return {"success": True, "message": "予約を削除しました"}
     except Exception as e:
-        print(f"予約削除エラー: {e}")
+        logger.error(f"予約削除エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
     
-# ========== 商品API ==========
+# ========== 予約の一括操作 ==========
 
-@app.get("/products")
-def get_products(category: str = None, brand: str = None, active_only: bool = True):
-    """商品一覧を取得"""
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as c:
-            query = "SELECT * FROM products WHERE 1=1"
-            params = []
-            if active_only:
-                query += " AND is_active = %s"
-                params.append(True)
-            if category:
-                query += " AND category = %s"
-                params.append(category)
-            if brand:
-                query += " AND brand = %s"
-                params.append(brand)
-            query += " ORDER BY category, brand, product_name"
-            c.execute(query, params)
-            products = c.fetchall()
-    return {"products": products}
+BOOKING_BATCH_MAX = 500
+BOOKING_BATCH_FIELDS = ('customer_name', 'phone_number', 'service_name', 'booking_date', 'booking_time', 'notes')
+BOOKING_BATCH_REQUIRED = ('customer_name', 'phone_number', 'service_name', 'booking_date', 'booking_time')
 
-# カテゴリー管理API
-@app.get("/categories")
-def get_categories():
-    """カテゴリー一覧を取得"""
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as c:
-            c.execute("SELECT * FROM categories ORDER BY display_order, category_name")
-            categories = c.fetchall()
-    return {"categories": categories}
+def parse_booking_operations(operations) -> tuple:
+    """
+    一括操作の入力を検証して (有効な操作, 結果リスト) を返す
+    - 不正な操作は結果に invalid として記録し、有効な操作だけを返す
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("操作が指定されていません")
+    if len(operations) > BOOKING_BATCH_MAX:
+        raise ValueError(f"一度に操作できるのは{BOOKING_BATCH_MAX}件までです")
 
-@app.post("/admin/categories")
-async def create_category(request: Request, session_token: str = Cookie(None)):
-    """カテゴリーを追加（管理者用）"""
+    valid = []
+    results = []
+    for index, item in enumerate(operations):
+        op = item.get('op') if isinstance(item, dict) else None
+        result = {"index": index, "op": op, "id": item.get('id') if isinstance(item, dict) else None}
+        results.append(result)
+        try:
+            if op not in ('create', 'update', 'delete'):
+                raise ValueError("opはcreate / update / deleteのいずれかを指定してください")
+            values = {field: item.get(field) for field in BOOKING_BATCH_FIELDS}
+            if op == 'create':
+                missing = [field for field in BOOKING_BATCH_REQUIRED if not values[field]]
+                if missing:
+                    raise ValueError(f"必須項目がありません: {', '.join(missing)}")
+                booking_id = None
+            else:
+                try:
+                    booking_id = int(item['id'])
+                except (KeyError, TypeError, ValueError):
+                    raise ValueError("idを指定してください")
+            if values['booking_date']:
+                values['booking_date'] = datetime.strptime(str(values['booking_date']), '%Y-%m-%d').date()
+            if values['booking_time']:
+                time_text = str(values['booking_time'])
+                values['booking_time'] = datetime.strptime(time_text, '%H:%M:%S' if time_text.count(':') == 2 else '%H:%M').time()
+            if op == 'update' and bool(values['booking_date']) != bool(values['booking_time']):
+                # 日時は片方だけ変えると衝突判定ができないため両方を必須にする
+                raise ValueError("日時を変更する場合はbooking_dateとbooking_timeの両方を指定してください")
+        except ValueError as e:
+            result.update(status="invalid", error=str(e))
+            continue
+        valid.append({"index": index, "op": op, "id": booking_id, **values})
+    return valid, results
+
+def load_booking_batch(c, operations):
+    """有効な操作を一時テーブルに展開（以降の処理はすべてこのテーブルとの集合演算）"""
+    c.execute("""
+        CREATE TEMP TABLE booking_batch (
+            idx INT PRIMARY KEY,
+            op TEXT NOT NULL,
+            id INT,
+            customer_name TEXT,
+            phone_number TEXT,
+            service_name TEXT,
+            booking_date DATE,
+            booking_time TIME,
+            notes TEXT,
+            error TEXT
+        ) ON COMMIT DROP
+    """)
+    c.execute(f"""
+        INSERT INTO booking_batch (idx, op, id, {', '.join(BOOKING_BATCH_FIELDS)})
+        SELECT * FROM UNNEST(%s::int[], %s::text[], %s::int[], %s::text[], %s::text[], %s::text[],
+                             %s::date[], %s::time[], %s::text[])
+    """, [[operation['index'] for operation in operations],
+          [operation['op'] for operation in operations],
+          [operation['id'] for operation in operations]] +
+         [[operation[field] for operation in operations] for field in BOOKING_BATCH_FIELDS])
+
+def check_booking_batch(c):
+    """存在しないid・同じ予約への重複操作・日時の衝突をまとめて判定してerrorに記録"""
+    c.execute("""
+        UPDATE booking_batch AS t
+        SET error = v.error
+        FROM (
+            SELECT o.idx,
+                   CASE
+                       WHEN o.op <> 'create' AND NOT EXISTS (SELECT 1 FROM bookings b WHERE b.id = o.id)
+                           THEN 'not_found'
+                       WHEN o.op <> 'create' AND COUNT(*) OVER (PARTITION BY o.id) > 1
+                           THEN 'duplicate'
+                   END AS error
+            FROM booking_batch o
+        ) AS v
+        WHERE t.idx = v.idx AND v.error IS NOT NULL
+    """)
+    # 更新で日時を省略した操作は、今の日時に留まるものとして埋めておく（以降は全操作の移動先が揃う）
+    c.execute("""
+        UPDATE booking_batch AS o
+        SET booking_date = b.booking_date, booking_time = b.booking_time
+        FROM bookings AS b
+        WHERE o.error IS NULL AND o.op = 'update' AND b.id = o.id AND o.booking_date IS NULL
+    """)
+    # 操作後の日時で衝突を判定（削除・移動される予約の枠は空くものとして扱う）
+    # - 今の枠に留まる更新は衝突にせず、その枠を取ろうとした操作だけを衝突にする
+    # - 衝突にした更新は元の枠を空けないので、新しい衝突がなくなるまで繰り返す
+    while True:
+        c.execute("""
+            WITH targets AS (
+                SELECT o.idx, o.booking_date, o.booking_time,
+                       (b.booking_date, b.booking_time) IS NOT DISTINCT FROM (o.booking_date, o.booking_time) AS stays
+                FROM booking_batch o
+                LEFT JOIN bookings b ON o.op = 'update' AND b.id = o.id
+                WHERE o.error IS NULL AND o.op IN ('create', 'update')
+            ),
+            released AS (
+                SELECT id FROM booking_batch WHERE error IS NULL AND op IN ('delete', 'update')
+            ),
+            conflicts AS (
+                SELECT t.idx
+                FROM targets t
+                WHERE NOT t.stays AND (
+                    EXISTS (
+                        SELECT 1 FROM targets o
+                        WHERE o.booking_date = t.booking_date AND o.booking_time = t.booking_time AND o.idx <> t.idx
+                    ) OR EXISTS (
+                        SELECT 1 FROM bookings b
+                        WHERE b.booking_date = t.booking_date AND b.booking_time = t.booking_time
+                          AND b.id NOT IN (SELECT id FROM released)
+                    )
+                )
+            )
+            UPDATE booking_batch AS t
+            SET error = 'conflict'
+            FROM conflicts
+            WHERE t.idx = conflicts.idx
+        """)
+        if c.rowcount == 0:
+            break
+
+def apply_booking_batch(c, created_at):
+    """
+    エラーのない操作を 削除 → 更新 → 追加 の順にそれぞれ1文で反映し、{idx: id} を返す
+    - 一意制約は行ごとに判定されるため、予約同士の入れ替えのように移動先が他の移動元と重なる場合は、
+      移動する予約をいったん使われない日付（0001-01-01 + idx）へ退避してから移動先へ書き込む
+    """
+    applied = {}
+    c.execute("""
+        DELETE FROM bookings AS b
+        USING booking_batch AS o
+        WHERE o.error IS NULL AND o.op = 'delete' AND b.id = o.id
+        RETURNING o.idx, b.id
+    """)
+    applied.update(c.fetchall())
+
+    c.execute("""
+        WITH movers AS (
+            SELECT o.idx, o.id, o.booking_date, o.booking_time
+            FROM booking_batch o
+            JOIN bookings b ON b.id = o.id
+            WHERE o.error IS NULL AND o.op = 'update'
+              AND (b.booking_date, b.booking_time) <> (o.booking_date, o.booking_time)
+        )
+        UPDATE bookings AS b
+        SET booking_date = DATE '0001-01-01' + m.idx
+        FROM movers m
+        WHERE b.id = m.id AND EXISTS (
+            SELECT 1 FROM movers t
+            JOIN bookings x ON x.booking_date = t.booking_date AND x.booking_time = t.booking_time
+            WHERE x.id IN (SELECT id FROM movers)
+        )
+    """)
+
+    c.execute("""
+        UPDATE bookings AS b
+        SET customer_name = COALESCE(o.customer_name, b.customer_name),
+            phone_number = COALESCE(o.phone_number, b.phone_number),
+            service_name = COALESCE(o.service_name, b.service_name),
+            booking_date = o.booking_date,
+            booking_time = o.booking_time,
+            notes = COALESCE(o.notes, b.notes)
+        FROM booking_batch AS o
+        WHERE o.error IS NULL AND o.op = 'update' AND b.id = o.id
+        RETURNING o.idx, b.id
+    """)
+    applied.update(c.fetchall())
+
+    # 他の接続が同時に同じ枠を予約した場合はON CONFLICTで衝突として扱う
+    c.execute("""
+        WITH inserted AS (
+            INSERT INTO bookings
+            (customer_name, phone_number, service_name, booking_date, booking_time, notes, created_at)
+            SELECT customer_name, phone_number, service_name, booking_date, booking_time, COALESCE(notes, ''), %s
+            FROM booking_batch
+            WHERE error IS NULL AND op = 'create'
+            ORDER BY idx
+            ON CONFLICT (booking_date, booking_time) DO NOTHING
+            RETURNING id, booking_date, booking_time
+        )
+        SELECT o.idx, i.id
+        FROM inserted i
+        JOIN booking_batch o
+          ON o.op = 'create' AND o.error IS NULL
+         AND o.booking_date = i.booking_date AND o.booking_time = i.booking_time
+    """, (created_at,))
+    applied.update(c.fetchall())
+    c.execute("""
+        UPDATE booking_batch SET error = 'conflict'
+        WHERE error IS NULL AND op = 'create' AND NOT (idx = ANY(%s))
+    """, (list(applied),))
+    return applied
+
+# 判定後に他の接続と衝突した場合に判定し直して反映を試みる回数
+BOOKING_BATCH_APPLY_ATTEMPTS = 3
+
+BOOKING_BATCH_ERRORS = {
+    'not_found': "予約が見つかりません",
+    'duplicate': "同じ予約に対する操作が重複しています",
+    'conflict': "指定した日時はすでに予約されています",
+}
+
+@router.post("/admin/bookings/batch")
+@limit_off_loop
+@limiter.limit("30/minute")
+async def batch_bookings_admin(request: Request, session_token: str = Cookie(None)):
+    """
+    予約の追加・更新・削除を1トランザクションでまとめて処理（管理者用）
+    - {"mode": "atomic" | "best_effort", "operations": [{"op": "create", ...}, {"op": "update", "id": 1, ...}, {"op": "delete", "id": 2}]}
+    - atomic: 1件でも失敗があればすべて取り消す（既定）
+    - best_effort: 失敗した操作だけを除いて反映する
+    """
     if not verify_admin_session(session_token):
         return JSONResponse(status_code=401, content={"error": "認証が必要です"})
-    
+
+    try:
+        data = await request.json()
+        mode = data.get('mode', 'atomic') if isinstance(data, dict) else 'atomic'
+        if mode not in ('atomic', 'best_effort'):
+            raise ValueError("modeはatomicまたはbest_effortを指定してください")
+        operations, results = parse_booking_operations(data.get('operations') if isinstance(data, dict) else data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    def run_batch():
+        applied = {}
+        errors = {}
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                if operations:
+                    load_booking_batch(c, operations)
+                    check_booking_batch(c)
+                    for attempt in range(1, BOOKING_BATCH_APPLY_ATTEMPTS + 1):
+                        c.execute("SELECT EXISTS (SELECT 1 FROM booking_batch WHERE error IS NOT NULL)")
+                        if c.fetchone()[0] and mode == 'atomic':
+                            break
+                        c.execute("SAVEPOINT booking_batch_apply")
+                        try:
+                            applied = apply_booking_batch(c, get_jst_now())
+                            break
+                        except psycopg2.IntegrityError:
+                            # 判定の後に他の接続が同じ枠を予約した場合は、その予約も含めて衝突を判定し直す
+                            c.execute("ROLLBACK TO SAVEPOINT booking_batch_apply")
+                            if attempt == BOOKING_BATCH_APPLY_ATTEMPTS:
+                                raise
+                            check_booking_batch(c)
+                    c.execute("SELECT idx, error FROM booking_batch WHERE error IS NOT NULL")
+                    errors = dict(c.fetchall())
+                if mode == 'atomic' and (errors or any(r.get('status') == 'invalid' for r in results)):
+                    conn.rollback()
+                    return {}, errors, False
+                conn.commit()
+        return applied, errors, True
+
+    try:
+        applied, errors, committed = await run_in_threadpool(run_batch)
+    except Exception as e:
+        logger.exception(f"予約一括操作エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    for result in results:
+        index = result['index']
+        if result.get('status') == 'invalid':
+            continue
+        if index in errors:
+            result.update(status=errors[index], error=BOOKING_BATCH_ERRORS.get(errors[index], errors[index]))
+        elif index in applied:
+            result.update(status="ok" if committed else "rolled_back", id=applied[index])
+        else:
+            result['status'] = "rolled_back" if not committed else "skipped"
+
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    logger.info(f"📦 予約一括操作: {succeeded}/{len(results)}件を反映 (mode={mode})")
+    return JSONResponse(status_code=200 if committed else 409, content={
+        "success": committed,
+        "mode": mode,
+        "succeeded": succeeded,
+        "failed": sum(1 for result in results if result['status'] not in ('ok', 'rolled_back', 'skipped')),
+        "results": results,
+    })
+
+# ========== エクスポート ==========
+
+# エクスポートできるテーブルの (列, 日付で絞り込む列, 並び順)
+EXPORT_TABLES = {
+    'bookings': (('id', 'customer_name', 'phone_number', 'service_name', 'booking_date', 'booking_time',
+                  'notes', 'created_at'), 'booking_date', 'booking_date, booking_time, id'),
+    'reminders': (('id', 'email', 'customer_name', 'service_name', 'booking_date', 'booking_time',
+                   'sent', 'created_at'), 'booking_date', 'booking_date, booking_time, id'),
+}
+EXPORT_FORMATS = {
+    'csv': ("text/csv; charset=utf-8", "csv"),
+    'ndjson': ("application/x-ndjson", "ndjson"),
+}
+
+def export_chunks(table: str, file_format: str, date_from, date_to):
+    """
+    サーバーサイドカーソルで読みながら1バッチずつCSV / NDJSONのバイト列にして返す
+    - 件数に関係なくメモリ使用量はSTREAM_BATCH_SIZE行分で一定
+    """
+    columns, date_column, order = EXPORT_TABLES[table]
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append(f"{date_column} >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{date_column} <= %s")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    if file_format == 'ndjson':
+        select_list = f"{json_projection(columns)}"
+    else:
+        select_list = ", ".join(columns)
+
+    with get_db_connection(reuse_shared=False) as conn:
+        with conn.cursor(name=f"export_{table}") as c:
+            c.itersize = STREAM_BATCH_SIZE
+            c.execute(f"SELECT {select_list} FROM {table} {where} ORDER BY {order}", params)
+            buffer = io.StringIO()
+            if file_format == 'csv':
+                # Excelで文字化けしないようBOM付きにする
+                buffer.write('\ufeff')
+                writer = csv.writer(buffer, lineterminator='\r\n')
+                writer.writerow(columns)
+            yield buffer.getvalue().encode('utf-8')
+            while True:
+                rows = c.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+                buffer.seek(0)
+                buffer.truncate()
+                if file_format == 'csv':
+                    writer.writerows(rows)
+                else:
+                    buffer.write(''.join(row[0] + '\n' for row in rows))
+                yield buffer.getvalue().encode('utf-8')
+
+def gzip_chunks(chunks):
+    """チャンクをgzipで逐次圧縮（全体をメモリに載せない）"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@router.get("/admin/export/{table}")
+def export_admin(table: str, format: str = "csv", date_from: str = None, date_to: str = None,
+                 compress: str = None, session_token: str = Cookie(None)):
+    """
+    予約・リマインダーをCSV / NDJSONでダウンロード（管理者用）
+    - date_from / date_to: booking_dateで絞り込み（YYYY-MM-DD）
+    - compress=gzip: gzip圧縮して返す
+    """
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+    if table not in EXPORT_TABLES:
+        return JSONResponse(status_code=404, content={"error": "エクスポートできない対象です"})
+    if format not in EXPORT_FORMATS:
+        return JSONResponse(status_code=400, content={"error": "formatはcsvまたはndjsonを指定してください"})
+    if compress not in (None, '', 'gzip'):
+        return JSONResponse(status_code=400, content={"error": "compressはgzipのみ指定できます"})
+    try:
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "日付はYYYY-MM-DD形式で指定してください"})
+
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"{table}_{get_jst_now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    body = export_chunks(table, format, date_from, date_to)
+    # 接続・クエリのエラーはレスポンス開始前に500として返せるよう、先頭だけここで実行する
+    try:
+        first_chunk = next(body)
+    except Exception as e:
+        logger.error(f"エクスポートエラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    def chained():
+        yield first_chunk
+        yield from body
+
+    chunks = chained()
+    if compress == 'gzip':
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    logger.info(f"📤 エクスポート開始: {filename}")
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "no-store",
+    })
+
+# ========== カレンダー配信（iCalendar） ==========
+
+# オーナー用の購読URL: /calendar/{ICS_FEED_TOKEN}/bookings.ics（未設定なら無効）
+ICS_FEED_TOKEN = os.getenv("ICS_FEED_TOKEN")
+ICS_FEED_DAYS = int(os.getenv("ICS_FEED_DAYS", "90"))
+ICS_EVENT_MINUTES = 60
+ICS_CACHE_CONTROL = "private, no-cache"
+
+# 配信中のドキュメントと予約ごとのVEVENT（変更された予約だけを作り直す）
+_ics_lock = threading.Lock()
+_ics_cache = {"key": None, "events": {}, "feed": None}
+
+def ics_escape(text) -> str:
+    """TEXT値のエスケープ（RFC 5545）"""
+    return (str(text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def ics_fold(line: str) -> str:
+    """1行75オクテットで折り返す（マルチバイト文字の途中では切らない）"""
+    parts = []
+    current = ''
+    limit = 75
+    for char in line:
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = ' '
+            limit = 75
+        current += char
+    parts.append(current)
+    return '\r\n'.join(parts)
+
+def ics_utc(local_date, local_time) -> datetime:
+    return JST.localize(datetime.combine(local_date, local_time)).astimezone(pytz.utc)
+
+def build_ics_event(booking) -> str:
+    start = ics_utc(booking['booking_date'], booking['booking_time'])
+    end = start + timedelta(minutes=ICS_EVENT_MINUTES)
+    created = JST.localize(booking['created_at']).astimezone(pytz.utc) if booking['created_at'] else start
+    description = f"サービス: {booking['service_name']}\nお名前: {booking['customer_name']}\n電話番号: {booking['phone_number']}"
+    if booking['notes']:
+        description += f"\n備考: {booking['notes']}"
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:booking-{booking['id']}@saloncoeur.com",
+        f"DTSTAMP:{created.strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART:{start.strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTEND:{end.strftime('%Y%m%dT%H%M%SZ')}",
+        f"SUMMARY:{ics_escape(booking['customer_name'] + '様 - ' + booking['service_name'])}",
+        f"DESCRIPTION:{ics_escape(description)}",
+        'LOCATION:Salon Coeur',
+        'STATUS:CONFIRMED',
+        'END:VEVENT',
+    ]
+    return '\r\n'.join(ics_fold(line) for line in lines)
+
+def refresh_ics_feed():
+    """
+    予約の変更カウンターと表示期間が変わったときだけ作り直す
+    - 期間内の (id, xmin) を比べ、追加・更新された予約だけを読み直してVEVENTを作る
+    """
+    today = get_jst_now().date()
+    window_end = today + timedelta(days=ICS_FEED_DAYS)
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as c:
+            c.execute("SELECT version, updated_at FROM table_versions WHERE table_name = 'bookings'")
+            row = c.fetchone()
+            version, updated_at = (row['version'], row['updated_at']) if row else (0, None)
+            key = (version, today, ICS_FEED_DAYS)
+            if _ics_cache["key"] == key:
+                CACHE_REQUESTS.inc("ics_feed", "hit")
+                return _ics_cache["feed"]
+            CACHE_REQUESTS.inc("ics_feed", "miss")
+
+            with _ics_lock:
+                if _ics_cache["key"] == key:
+                    return _ics_cache["feed"]
+                c.execute("""
+                    SELECT id, xmin::text AS row_version FROM bookings
+                    WHERE booking_date BETWEEN %s AND %s
+                """, (today, window_end))
+                current = {r['id']: r['row_version'] for r in c.fetchall()}
+                cached = _ics_cache["events"]
+                changed = [booking_id for booking_id, row_version in current.items()
+                           if cached.get(booking_id, (None,))[0] != row_version]
+                events = {booking_id: cached[booking_id] for booking_id in current if booking_id not in changed}
+                if changed:
+                    c.execute("""
+                        SELECT id, xmin::text AS row_version, customer_name, phone_number, service_name,
+                               booking_date, booking_time, notes, created_at
+                        FROM bookings WHERE id = ANY(%s)
+                    """, (changed,))
+                    for booking in c.fetchall():
+                        events[booking['id']] = (booking['row_version'],
+                                                 (booking['booking_date'], booking['booking_time']),
+                                                 build_ics_event(booking))
+
+                body = '\r\n'.join([
+                    'BEGIN:VCALENDAR',
+                    'VERSION:2.0',
+                    'PRODID:-//Salon Coeur//Booking//JP',
+                    'CALSCALE:GREGORIAN',
+                    'METHOD:PUBLISH',
+                    'X-WR-CALNAME:Salon Coeur 予約',
+                    'X-WR-TIMEZONE:Asia/Tokyo',
+                    'REFRESH-INTERVAL;VALUE=DURATION:PT5M',
+                    *(event for _, _, event in sorted(events.values(), key=lambda e: e[1])),
+                    'END:VCALENDAR',
+                ]).encode('utf-8') + b'\r\n'
+                # format_datetime(usegmt=True) は datetime.timezone.utc 以外のtzinfoを受け付けない（pytz.utcも不可）
+                last_modified = (JST.localize(updated_at) if updated_at else datetime.now(JST)).astimezone(timezone.utc)
+                last_modified = last_modified.replace(microsecond=0)
+
+                # (本文, ETag, Last-Modified, Last-Modifiedヘッダー) を1つのタプルで差し替え、
+                # 読み取り側に組み合わせの不整合を見せない（ヘッダーの文字列もここで1回だけ作る）
+                _ics_cache["feed"] = (body, '"ics-' + hashlib.sha1(body).hexdigest()[:16] + '"',
+                                      last_modified, format_datetime(last_modified, usegmt=True))
+                _ics_cache["events"] = events
+                _ics_cache["key"] = key
+                logger.info(f"📅 カレンダー配信を更新: {len(events)}件（再生成 {len(changed)}件）")
+    return _ics_cache["feed"]
+
+def not_modified_since(request: Request, last_modified: datetime) -> bool:
+    """If-Modified-Since以降に変更がないか（If-None-Matchがある場合はそちらを優先）"""
+    if request.headers.get("if-none-match") or not last_modified:
+        return False
+    try:
+        since = parsedate_to_datetime(request.headers.get("if-modified-since", ""))
+    except (TypeError, ValueError):
+        return False
+    return since is not None and since.tzinfo is not None and last_modified <= since
+
+@router.get("/calendar/{token}/bookings.ics")
+def bookings_ics_feed(token: str, request: Request):
+    """オーナー用の予約カレンダー（購読用URL、ICS_FEED_TOKENで保護）"""
+    if not ICS_FEED_TOKEN or not secrets.compare_digest(token, ICS_FEED_TOKEN):
+        return JSONResponse(status_code=404, content={"error": "Not Found"})
+
+    try:
+        body, etag, last_modified, last_modified_header = refresh_ics_feed()
+    except Exception as e:
+        logger.error(f"カレンダー配信エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified_header,
+        "Cache-Control": ICS_CACHE_CONTROL,
+    }
+    if etag_matches(request, etag) or not_modified_since(request, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+# ========== 管理画面へのリアルタイム通知（Server-Sent Events） ==========
+
+ADMIN_EVENT_HEARTBEAT = 15       # 秒（プロキシに接続を切られないよう定期的にコメントを送る）
+ADMIN_EVENT_QUEUE_SIZE = 100     # 接続ごとに溜められる未送信イベント数
+ADMIN_EVENT_RETRY_MS = 3000
+ADMIN_EVENT_MAX_AGE = 300        # 秒（接続を定期的に張り直させ、再起動時に開きっぱなしの接続が終了を妨げないようにする）
+
+# ワーカーごとにLISTEN接続は1本だけ持ち、イベントループ上で接続中の画面へ配る
+_admin_subscribers = set()
+_admin_listener = {"conn": None, "loop": None, "connecting": None}
+
+def publish_admin_event(payload: str):
+    """全接続のキューへ配る（詰まっている接続はイベントを捨てて再読み込みを指示する）"""
+    for subscriber in list(_admin_subscribers):
+        try:
+            subscriber.put_nowait(payload)
+        except asyncio.QueueFull:
+            # 送信が追いつかない接続のせいで他の接続やメモリを圧迫しないよう、溜まった分を捨てる
+            while not subscriber.empty():
+                subscriber.get_nowait()
+            subscriber.put_nowait(None)
+
+def on_admin_notify():
+    conn = _admin_listener["conn"]
+    try:
+        conn.poll()
+    except Exception as e:
+        logger.error(f"管理画面通知の受信エラー: {e}")
+        stop_admin_listener()
+        _admin_listener["loop"].call_later(5, start_admin_listener, _admin_listener["loop"])
+        return
+    while conn.notifies:
+        publish_admin_event(conn.notifies.pop(0).payload)
+
+def open_admin_listener_connection():
+    """LISTENを済ませた接続を開く（ブロックするのでイベントループの外で呼ぶ）"""
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as c:
+            c.execute(f"LISTEN {ADMIN_EVENTS_CHANNEL}")
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+def start_admin_listener(loop):
+    """LISTEN接続をイベントループのreaderとして登録（接続はスレッドプールで開き、受信にスレッドは使わない）"""
+    if _admin_listener["conn"] is not None or _admin_listener["connecting"] is not None:
+        return
+    _admin_listener["loop"] = loop
+    _admin_listener["connecting"] = loop.create_task(connect_admin_listener(loop))
+
+async def connect_admin_listener(loop):
+    try:
+        conn = await loop.run_in_executor(None, open_admin_listener_connection)
+    except Exception as e:
+        logger.error(f"管理画面通知の受信開始エラー: {e}")
+        loop.call_later(5, start_admin_listener, loop)
+        return
+    finally:
+        _admin_listener["connecting"] = None
+    _admin_listener["conn"] = conn
+    loop.add_reader(conn.fileno(), on_admin_notify)
+    # 再接続までの間に起きた変更を取りこぼした可能性があるので、接続中の画面には読み直させる
+    publish_admin_event(None)
+    logger.info("管理画面通知の受信を開始")
+
+def stop_admin_listener():
+    connecting = _admin_listener["connecting"]
+    if connecting is not None:
+        connecting.cancel()
+    conn = _admin_listener["conn"]
+    _admin_listener["conn"] = None
+    if conn is not None:
+        try:
+            _admin_listener["loop"].remove_reader(conn.fileno())
+        except Exception:
+            pass
+        conn.close()
+
+@router.get("/admin/events")
+async def admin_events(request: Request, session_token: str = Cookie(None)):
+    """
+    予約・営業日・時間枠の変更をSSEで送る（管理者用）
+    - event: change  data: {"table": "bookings", "op": "insert", "dates": ["2025-11-20"]}
+    - event: resync  取りこぼしがあり得るので画面側で読み直す
+    """
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    start_admin_listener(asyncio.get_running_loop())
+    subscriber = asyncio.Queue(maxsize=ADMIN_EVENT_QUEUE_SIZE)
+    _admin_subscribers.add(subscriber)
+
+    async def stream():
+        try:
+            yield f"retry: {ADMIN_EVENT_RETRY_MS}\n\n"
+            expires = time.monotonic() + ADMIN_EVENT_MAX_AGE
+            while time.monotonic() < expires:
+                try:
+                    payload = await asyncio.wait_for(subscriber.get(), timeout=ADMIN_EVENT_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if not await run_in_threadpool(verify_admin_session, session_token):
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if payload is None:
+                    yield "event: resync\ndata: {}\n\n"
+                else:
+                    yield f"event: change\ndata: {payload}\n\n"
+        finally:
+            _admin_subscribers.discard(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",
+    })
+
+# ========== 差分同期 ==========
+
+CHANGES_MAX_LIMIT = 1000
+
+def change_row_projection(table: str) -> str:
+    """変更後の行のJSON（一覧APIと同じ列。画面は一覧の行を丸ごと置き換えるので、一覧に含まれる画像も返す）"""
+    if table in LIST_FIELDS:
+        return json_projection(LIST_FIELDS[table])
+    return "to_jsonb(t)::text"
+
+@router.get("/admin/changes")
+def get_admin_changes(since: int = None, tables: str = None, limit: int = 500,
+                      session_token: str = Cookie(None)):
+    """
+    指定した位置より後にコミットされた変更を返す（管理者用）
+    - 位置（seq）はトランザクションIDで、スナップショットのxminまでを返す
+      （それより前のトランザクションはすべて終了済みなので、後から割り込む変更がない）
+    - since省略時は現在の位置だけを返す（画面の初回読み込み前に取得しておく）
+    - 同じ行への複数の変更は最新の状態1件にまとめ、削除済みなら op: "delete"
+    - limit件を超える場合はトランザクション単位で区切って has_more: true
+    - sinceが保存期間より古い場合は reset: true（一覧を読み直す）
+    """
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    selected = [t.strip() for t in tables.split(',') if t.strip()] if tables else list(CHANGE_LOG_TABLES)
+    unknown = [t for t in selected if t not in CHANGE_LOG_TABLES]
+    if unknown:
+        return JSONResponse(status_code=400, content={"error": f"指定できないテーブルです: {', '.join(unknown)}"})
+    limit = max(1, min(limit, CHANGES_MAX_LIMIT))
+
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                c.execute("""
+                    SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint,
+                           (SELECT version FROM table_versions WHERE table_name = 'change_log')
+                """)
+                current, pruned = c.fetchone()
+                if since is None or since > current:
+                    return {"seq": current, "reset": since is not None, "changes": [], "has_more": False}
+                if since <= (pruned or 0):
+                    return {"seq": current, "reset": True, "changes": [], "has_more": False}
+
+                # limit件目の次の変更のトランザクションまでを範囲にし（同じトランザクションの変更は分けない）、
+                # その中の変更を行ごとにまとめて現在の行と結合する
+                c.execute("""
+                    SELECT txid::text::bigint FROM change_log
+                    WHERE txid >= %s::text::xid8 AND txid < %s::text::xid8 AND table_name = ANY(%s)
+                    ORDER BY txid, seq
+                    OFFSET %s LIMIT 1
+                """, (since, current, selected, limit))
+                row = c.fetchone()
+                upper = max(row[0], since + 1) if row else current
+                has_more = upper < current
+
+                joined = " UNION ALL ".join(f"""
+                    SELECT l.txid, l.seq, l.table_name, l.row_id,
+                           CASE WHEN t.id IS NOT NULL THEN {change_row_projection(table)} END AS row_json
+                    FROM latest l LEFT JOIN {table} t ON t.id = l.row_id
+                    WHERE l.table_name = '{table}'
+                """ for table in selected)
+                c.execute(f"""
+                    WITH latest AS (
+                        SELECT DISTINCT ON (table_name, row_id) txid, seq, table_name, row_id
+                        FROM change_log
+                        WHERE txid >= %s::text::xid8 AND txid < %s::text::xid8 AND table_name = ANY(%s)
+                        ORDER BY table_name, row_id, txid DESC, seq DESC
+                    )
+                    SELECT seq, table_name, row_id, row_json FROM ({joined}) AS changes ORDER BY txid, seq
+                """, (since, upper, selected))
+                rows = c.fetchall()
+    except Exception as e:
+        logger.error(f"差分取得エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    # 行のJSONはPostgresで作った文字列のまま埋め込む
+    changes = ",".join(
+        json.dumps({"seq": seq, "table": table, "id": row_id, "op": "delete"}, ensure_ascii=False)
+        if row_json is None else
+        '{"seq":%d,"table":%s,"id":%d,"op":"upsert","row":%s}' % (seq, json.dumps(table), row_id, row_json)
+        for seq, table, row_id, row_json in rows
+    )
+    return Response(
+        content='{"seq":%d,"reset":false,"has_more":%s,"changes":[%s]}' % (upper, 'true' if has_more else 'false', changes),
+        media_type="application/json",
+        headers={"Cache-Control": "no-store"},
+    )
+
+# ========== 部分更新（PATCH）・並び替え ==========
+
+# PATCHで更新できる列
+SERVICE_PATCH_FIELDS = ('service_name', 'description', 'intro_text', 'price', 'campaign_price', 'duration',
+                        'icon', 'image_data', 'is_popular', 'is_campaign', 'show_in_booking', 'show_in_intro',
+                        'display_order', 'is_active')
+PRODUCT_PATCH_FIELDS = ('sku', 'product_name', 'description', 'price', 'original_price', 'brand', 'category',
+                        'stock_quantity', 'image_data', 'is_active')
+
+# 表示順の一括更新ができるテーブル
+REORDER_TABLES = ('services', 'categories', 'available_slots')
+
+def patch_row(table: str, row_id: int, data: dict, allowed_fields) -> bool:
+    """
+    送られた列だけをUPDATE（行が存在しなければFalse）
+    - 許可されていない列・空の更新はValueError
+    """
+    if not isinstance(data, dict) or not data:
+        raise ValueError("更新する項目がありません")
+    unknown = [field for field in data if field not in allowed_fields]
+    if unknown:
+        raise ValueError(f"更新できない項目です: {', '.join(unknown)}")
+
+    fields = list(data)
+    assignments = ", ".join(f"{field} = %s" for field in fields)
+    with get_db_connection() as conn:
+        with conn.cursor() as c:
+            c.execute(f"""
+                UPDATE {table}
+                SET {assignments}, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                RETURNING id
+            """, [data[field] for field in fields] + [row_id])
+            updated = c.fetchone() is not None
+            conn.commit()
+    return updated
+
+def reorder_display_order(table: str, items) -> int:
+    """
+    display_orderを1回のUPDATEでまとめて更新（更新した行数を返す）
+    - items: [{"id": 1, "display_order": 0}, ...] または並べたいidのリスト
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("並び順が指定されていません")
+    if all(isinstance(item, int) for item in items):
+        ids, orders = items, list(range(len(items)))
+    else:
+        try:
+            ids = [int(item['id']) for item in items]
+            orders = [int(item['display_order']) for item in items]
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("並び順の形式が正しくありません")
+
+    with get_db_connection() as conn:
+        with conn.cursor() as c:
+            c.execute(f"""
+                UPDATE {table} AS t
+                SET display_order = v.display_order
+                FROM UNNEST(%s::int[], %s::int[]) AS v(id, display_order)
+                WHERE t.id = v.id AND t.display_order IS DISTINCT FROM v.display_order
+            """, (ids, orders))
+            updated = c.rowcount
+            conn.commit()
+    return updated
+
+@router.post("/admin/{table}/reorder")
+async def reorder_admin(table: str, request: Request, session_token: str = Cookie(None)):
+    """表示順を一括更新（管理者用、services / categories / available-slots）"""
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    table = table.replace('-', '_')
+    if table not in REORDER_TABLES:
+        return JSONResponse(status_code=404, content={"error": "並び替えできない対象です"})
+
+    try:
+        data = await request.json()
+        updated = reorder_display_order(table, data.get('order') if isinstance(data, dict) else data)
+        invalidate_catalog()
+        return {"success": True, "updated": updated, "message": "表示順を更新しました"}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        logger.error(f"表示順更新エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+# ========== 商品API ==========
+
+# 並び順ごとの ORDER BY式 と方向（インデックスは migrations/0012_product_sort_indexes.sql）
+# キーセットページングでは最後の行の同じ式の値を (式...) > (値...) で比較するので、式はNULLにならないようにする
+PRODUCT_SORTS = {
+    "default": (["COALESCE(category, '')", "COALESCE(brand, '')", "product_name", "id"], "ASC"),
+    "price_asc": (["price", "id"], "ASC"),
+    "price_desc": (["price", "id"], "DESC"),
+    "newest": (["COALESCE(created_at, '-infinity'::timestamp)", "id"], "DESC"),
+}
+
+PRODUCT_PAGE_SIZE = 24
+PRODUCT_MAX_PAGE_SIZE = 100
+
+def encode_product_cursor(row, sort_keys):
+    """最後の行からページングカーソルを生成（値はPostgresで文字列にした並び順の式、row['sort_key']）"""
+    raw = json.dumps(row['sort_key'], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_product_cursor(cursor: str, sort_keys):
+    """ページングカーソルを復元（不正な場合はValueError）"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("不正なカーソルです")
+    if not isinstance(values, list) or len(values) != len(sort_keys):
+        raise ValueError("カーソルと並び順が一致しません")
+    if not all(isinstance(value, str) for value in values):
+        raise ValueError("不正なカーソルです")
+    return values
+
+def get_product_facets(c, base_conditions, base_params, category: str = None, brand: str = None):
+    """
+    カテゴリー・ブランド別の件数を1クエリで集計
+    - カテゴリーの件数にはブランド条件のみ、ブランドの件数にはカテゴリー条件のみを適用
+    """
+    category_cond = "category = %s" if category else "TRUE"
+    brand_cond = "brand = %s" if brand else "TRUE"
+    params = ([brand] if brand else []) + ([category] if category else []) + base_params
+    c.execute(f"""
+        SELECT CASE WHEN GROUPING(brand) = 1 THEN 'categories' ELSE 'brands' END AS facet,
+               CASE WHEN GROUPING(brand) = 1 THEN category ELSE brand END AS value,
+               CASE WHEN GROUPING(brand) = 1
+                    THEN COUNT(*) FILTER (WHERE {brand_cond})
+                    ELSE COUNT(*) FILTER (WHERE {category_cond})
+               END AS count
+        FROM products
+        WHERE {' AND '.join(base_conditions)}
+        GROUP BY GROUPING SETS ((category), (brand))
+        ORDER BY 1, 3 DESC, 2
+    """, params)
+
+    facets = {"categories": [], "brands": []}
+    for row in c.fetchall():
+        if row['value'] is not None and row['count'] > 0:
+            facets[row['facet']].append({"value": row['value'], "count": row['count']})
+    return facets
+
+@router.get("/products")
+def get_products(request: Request,
+                 category: str = None, brand: str = None, active_only: bool = True,
+                 min_price: float = None, max_price: float = None, sort: str = "default",
+                 limit: int = None, cursor: str = None, facets: bool = False, fields: str = None):
+    """
+    商品一覧を取得
+    - limit / cursor: キーセットページング（cursorは前回レスポンスのnext_cursor）
+    - sort: default / price_asc / price_desc / newest
+    - facets: カテゴリー・ブランド別の件数を同時に返す
+    - fields: 返す列をカンマ区切りで指定
+    """
+    if sort not in PRODUCT_SORTS:
+        return JSONResponse(status_code=400, content={"error": f"不正な並び順です: {sort}"})
+    sort_keys, direction = PRODUCT_SORTS[sort]
+    try:
+        selected_fields = parse_fields('products', fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    snapshot = get_catalog_snapshot()
+    headers = catalog_cache_headers(snapshot, 'products')
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # 一覧全体の取得（管理画面など）はスナップショットから返す
+    if (sort == "default" and limit is None and not cursor and not facets
+            and min_price is None and max_price is None):
+        rows, snapshot = get_catalog_rows(snapshot, 'products', selected_fields)
+        products = [
+            product['json'] for product in rows
+            if (not active_only or product['is_active'])
+            and (not category or product['category'] == category)
+            and (not brand or product['brand'] == brand)
+        ]
+        return json_list_response("products", products, extra={"next_cursor": None},
+                                  headers=catalog_cache_headers(snapshot, 'products'))
+
+    if cursor and not limit:
+        limit = PRODUCT_PAGE_SIZE
+    if limit is not None:
+        limit = max(1, min(limit, PRODUCT_MAX_PAGE_SIZE))
+
+    # 価格・公開状態はファセットにも適用する共通条件
+    base_conditions = ["1=1"]
+    base_params = []
+    if active_only:
+        base_conditions.append("is_active = %s")
+        base_params.append(True)
+    if min_price is not None:
+        base_conditions.append("price >= %s")
+        base_params.append(min_price)
+    if max_price is not None:
+        base_conditions.append("price <= %s")
+        base_params.append(max_price)
+
+    conditions = list(base_conditions)
+    params = list(base_params)
+    if category:
+        conditions.append("category = %s")
+        params.append(category)
+    if brand:
+        conditions.append("brand = %s")
+        params.append(brand)
+
+    if cursor:
+        try:
+            cursor_values = decode_product_cursor(cursor, sort_keys)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        columns = ", ".join(sort_keys)
+        placeholders = ", ".join(["%s"] * len(sort_keys))
+        operator = ">" if direction == "ASC" else "<"
+        conditions.append(f"({columns}) {operator} ({placeholders})")
+        params.extend(cursor_values)
+
+    order_by = ", ".join(f"{expr} {direction}" for expr in sort_keys)
+
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as c:
+            # 行はPostgres側でJSON化し、カーソル用に並び順の式の値を文字列で別に受け取る
+            # （文字列のままクエリへ戻すので、-infinity や numeric も丸めずに比較できる）
+            projection = json_projection(selected_fields) if selected_fields else "row_to_json(products)::text"
+            query = f"""
+                SELECT ARRAY[{', '.join(f'({expr})::text' for expr in sort_keys)}] AS sort_key,
+                       {projection} AS json
+                FROM products
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {order_by}
+            """
+            if limit is not None:
+                # 1件多く取得して次ページの有無を判定
+                query += " LIMIT %s"
+                params.append(limit + 1)
+            c.execute(query, params)
+            products = c.fetchall()
+
+            next_cursor = None
+            if limit is not None and len(products) > limit:
+                products = products[:limit]
+                next_cursor = encode_product_cursor(products[-1], sort_keys)
+
+            extra = {"next_cursor": next_cursor}
+            if facets:
+                extra["facets"] = get_product_facets(c, base_conditions, base_params, category, brand)
+    return json_list_response("products", [product['json'] for product in products], extra=extra, headers=headers)
+
+PRODUCT_SEARCH_SIMILARITY_THRESHOLD = 0.3
+# トライグラムは3文字単位なので、これより短い検索語は部分一致だけで探す
+PRODUCT_SEARCH_MIN_TRIGRAM_LENGTH = 3
+# 検索結果の既定の列（画像は大きいので fields で指定したときだけ返す）
+PRODUCT_SEARCH_FIELDS = [field for field in LIST_FIELDS['products'] if field != 'image_data']
+
+# トライグラム検索が使えるか（起動時に detect_product_search で確認）
+# - trigram: pg_trgmが入っているか（migrations/0004 は拡張を作れない環境では何もせずに適用済みになる）
+# - multibyte: 日本語からトライグラムが作れるか（Cロケールなどでは日本語は単語の文字として扱われない）
+_product_search = {"trigram": False, "multibyte": False}
+
+def detect_product_search():
+    """pg_trgmの有無と、DBのロケールで日本語のトライグラムが作れるかを確認"""
+    with get_db_connection() as conn:
+        with conn.cursor() as c:
+            c.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            trigram = c.fetchone()[0]
+            multibyte = False
+            if trigram:
+                c.execute("SELECT cardinality(show_trgm('日本語の商品')) > 0")
+                multibyte = c.fetchone()[0]
+    _product_search.update(trigram=trigram, multibyte=multibyte)
+    if not trigram:
+        logger.warning("⚠️ pg_trgmが使えないため、商品検索は部分一致だけで行います")
+    elif not multibyte:
+        logger.info("DBのロケールでは日本語のトライグラムが作れないため、日本語の検索語は部分一致で探します")
+
+def use_trigram_search(query_text: str) -> bool:
+    """この検索語でトライグラム（表記ゆれ・誤字への対応）が効くか"""
+    if not _product_search["trigram"] or len(query_text) < PRODUCT_SEARCH_MIN_TRIGRAM_LENGTH:
+        return False
+    return query_text.isascii() or _product_search["multibyte"]
+
+def normalize_search_query(q: str) -> str:
+    """検索語を正規化（全角英数・半角カナをNFKCで統一し小文字化）"""
+    return unicodedata.normalize('NFKC', q).strip().lower()
+
+@router.get("/products/search")
+@limiter.limit("60/minute")
+def search_products(request: Request, q: str, limit: int = 20, offset: int = 0, active_only: bool = True,
+                    fields: str = None):
+    """
+    商品を検索（商品名・ブランド・説明文）
+    - 部分一致とトライグラム類似度（表記ゆれ・誤字）の両方でヒット
+    - 2文字以下の検索語・トライグラムが作れない日本語の検索語・pg_trgmがない環境では部分一致だけで探す
+    - 商品名での一致を優先して関連度順に並べる
+    - fields: 返す列をカンマ区切りで指定（既定は画像以外の一覧の列）
+    """
+    query_text = normalize_search_query(q)
+    if not query_text:
+        return JSONResponse(status_code=400, content={"error": "検索キーワードを入力してください"})
+    try:
+        selected_fields = parse_fields('products', fields) or PRODUCT_SEARCH_FIELDS
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    limit = max(1, min(limit, PRODUCT_MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    like_pattern = "%" + query_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    params = {
+        "q": query_text,
+        "like": like_pattern,
+        "limit": limit + 1,
+        "offset": offset,
+    }
+    active_condition = "AND is_active = TRUE" if active_only else ""
+    trigram = use_trigram_search(query_text)
+    if trigram:
+        score = (f"word_similarity(%(q)s, {PRODUCT_SEARCH_DOCUMENT}) + word_similarity(%(q)s, lower(product_name)) * 0.5"
+                 f" + CASE WHEN {PRODUCT_SEARCH_DOCUMENT} LIKE %(like)s THEN 0.5 ELSE 0 END")
+        condition = f"({PRODUCT_SEARCH_DOCUMENT} LIKE %(like)s OR %(q)s <%% {PRODUCT_SEARCH_DOCUMENT})"
+    else:
+        # 小文字にした文書に対するLIKE（= ILIKE）。pg_trgmがあれば同じインデックスが使われる
+        score = "CASE WHEN lower(product_name) LIKE %(like)s THEN 0.5 ELSE 0 END"
+        condition = f"{PRODUCT_SEARCH_DOCUMENT} LIKE %(like)s"
+
+    with get_db_connection() as conn:
+        with conn.cursor() as c:
+            if trigram:
+                # <% 演算子の閾値はこのトランザクション内だけ下げる
+                c.execute("SET LOCAL pg_trgm.word_similarity_threshold = %s", (PRODUCT_SEARCH_SIMILARITY_THRESHOLD,))
+            # 順位付けはidと関連度だけで行い、返すページの行だけを一覧の列でJSONにする
+            c.execute(f"""
+                WITH matches AS (
+                    SELECT id, {score} AS score
+                    FROM products
+                    WHERE {condition}
+                    {active_condition}
+                    ORDER BY score DESC, id
+                    LIMIT %(limit)s OFFSET %(offset)s
+                )
+                SELECT {json_projection(selected_fields)}
+                FROM matches JOIN products USING (id)
+                ORDER BY matches.score DESC, id
+            """, params)
+            products = [row[0] for row in c.fetchall()]
+
+    has_more = len(products) > limit
+    return json_list_response("products", products[:limit], extra={
+        "query": q,
+        "limit": limit,
+        "offset": offset,
+        "has_more": has_more,
+    })
+
+# カテゴリー管理API
+@router.get("/categories")
+def get_categories(request: Request, fields: str = None):
+    """カテゴリー一覧を取得"""
+    try:
+        selected_fields = parse_fields('categories', fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    snapshot = get_catalog_snapshot()
+    headers = catalog_cache_headers(snapshot, 'categories')
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    rows, snapshot = get_catalog_rows(snapshot, 'categories', selected_fields)
+    return json_list_response("categories", [row['json'] for row in rows],
+                              headers=catalog_cache_headers(snapshot, 'categories'))
+
+@router.post("/admin/categories")
+async def create_category(request: Request, session_token: str = Cookie(None)):
+    """カテゴリーを追加（管理者用）"""
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+    
     try:
         data = await request.json()
         with get_db_connection() as conn:
@@ -1499,14 +4010,13 @@ async def create_category(request: Request, session_token: str = Cookie(None)):
                 result = c.fetchone()
                 conn.commit()
                 
+                invalidate_catalog()
                 return {"success": True, "message": "カテゴリーを追加しました", "id": result[0]}
     except Exception as e:
-        print(f"カテゴリー追加エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"カテゴリー追加エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.delete("/admin/categories/{category_id}")
+@router.delete("/admin/categories/{category_id}")
 async def delete_category(category_id: int, session_token: str = Cookie(None)):
     """カテゴリーを削除（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1517,22 +4027,30 @@ async def delete_category(category_id: int, session_token: str = Cookie(None)):
             with conn.cursor() as c:
                 c.execute("DELETE FROM categories WHERE id = %s", (category_id,))
                 conn.commit()
+        invalidate_catalog()
         return {"success": True, "message": "カテゴリーを削除しました"}
     except Exception as e:
-        print(f"カテゴリー削除エラー: {e}")
+        logger.error(f"カテゴリー削除エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 # ブランド管理API
-@app.get("/brands")
-def get_brands():
+@router.get("/brands")
+def get_brands(request: Request, fields: str = None):
     """ブランド一覧を取得"""
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as c:
-            c.execute("SELECT * FROM brands ORDER BY brand_name")
-            brands = c.fetchall()
-    return {"brands": brands}
+    try:
+        selected_fields = parse_fields('brands', fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    snapshot = get_catalog_snapshot()
+    headers = catalog_cache_headers(snapshot, 'brands')
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    rows, snapshot = get_catalog_rows(snapshot, 'brands', selected_fields)
+    return json_list_response("brands", [row['json'] for row in rows],
+                              headers=catalog_cache_headers(snapshot, 'brands'))
 
-@app.post("/admin/brands")
+@router.post("/admin/brands")
 async def create_brand(request: Request, session_token: str = Cookie(None)):
     """ブランドを追加（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1550,15 +4068,16 @@ async def create_brand(request: Request, session_token: str = Cookie(None)):
                 """, (data['brand_name'],))
                 result = c.fetchone()
                 conn.commit()
+                invalidate_catalog()
                 if result:
                     return {"success": True, "message": "ブランドを追加しました"}
                 else:
                     return JSONResponse(status_code=400, content={"error": "ブランドは既に存在します"})
     except Exception as e:
-        print(f"ブランド追加エラー: {e}")
+        logger.error(f"ブランド追加エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.delete("/admin/brands/{brand_id}")
+@router.delete("/admin/brands/{brand_id}")
 async def delete_brand(brand_id: int, session_token: str = Cookie(None)):
     """ブランドを削除（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1569,12 +4088,13 @@ async def delete_brand(brand_id: int, session_token: str = Cookie(None)):
             with conn.cursor() as c:
                 c.execute("DELETE FROM brands WHERE id = %s", (brand_id,))
                 conn.commit()
+        invalidate_catalog()
         return {"success": True, "message": "ブランドを削除しました"}
     except Exception as e:
-        print(f"ブランド削除エラー: {e}")
+        logger.error(f"ブランド削除エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.post("/admin/products/add")
+@router.post("/admin/products/add")
 async def create_product_admin(request: Request, product_name: str = Form(...),
                                 price: float = Form(...), category: str = Form(...),
                                 stock_quantity: int = Form(...), description: str = Form(default=""),
@@ -1595,12 +4115,253 @@ async def create_product_admin(request: Request, product_name: str = Form(...),
                          (product_name, description, price, original_price, brand, category, stock_quantity, image_data))
                 product_id = c.fetchone()[0]
                 conn.commit()
+        invalidate_catalog()
         return {"success": True, "product_id": product_id, "message": "商品を追加しました"}
     except Exception as e:
-        print(f"商品追加エラー: {e}")
+        logger.error(f"商品追加エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+# ========== 商品一括インポート ==========
+
+# インポートできる列（skuがあれば既存商品を更新、なければ新規追加）
+PRODUCT_IMPORT_COLUMNS = ('sku', 'product_name', 'description', 'price', 'original_price', 'brand',
+                          'category', 'stock_quantity', 'image_data', 'is_active')
+PRODUCT_IMPORT_MAX_ERRORS = 1000
+
+# 値の検証（ステージングテーブル上でまとめて判定する）
+PRODUCT_IMPORT_CHECKS = [
+    ("parse_error IS NOT NULL", "parse_error"),
+    ("NULLIF(btrim(product_name), '') IS NULL", "'商品名は必須です'"),
+    ("NULLIF(btrim(price), '') IS NULL", "'価格は必須です'"),
+    (r"NULLIF(btrim(price), '') !~ '^\d+(\.\d{1,2})?$'", "'価格は0以上の数値で指定してください'"),
+    (r"NULLIF(btrim(original_price), '') !~ '^\d+(\.\d{1,2})?$'", "'元値は0以上の数値で指定してください'"),
+    (r"NULLIF(btrim(stock_quantity), '') !~ '^\d+$'", "'在庫数は0以上の整数で指定してください'"),
+    ("lower(NULLIF(btrim(is_active), '')) NOT IN ('true', 'false', '1', '0', 'yes', 'no', 't', 'f')", "'is_activeはtrue/falseで指定してください'"),
+    ("length(product_name) > 200", "'商品名は200文字以内で指定してください'"),
+    ("length(brand) > 100", "'ブランド名は100文字以内で指定してください'"),
+    ("length(category) > 50", "'カテゴリー名は50文字以内で指定してください'"),
+    ("length(sku) > 100", "'SKUは100文字以内で指定してください'"),
+    ("NULLIF(btrim(sku), '') IS NOT NULL AND COUNT(*) OVER (PARTITION BY btrim(sku)) > 1", "'SKUがファイル内で重複しています'"),
+]
+
+class IterStream(io.RawIOBase):
+    """バイト列のジェネレーターをCOPY FROM STDINに渡せるファイルとして扱う"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def read_csv_header(upload) -> list:
+    """CSVの1行目を読んで列名を検証（残りはそのままCOPYに流す）"""
+    header_line = upload.readline().decode('utf-8-sig')
+    columns = [column.strip() for column in next(csv.reader([header_line]), [])]
+    unknown = [column for column in columns if column not in PRODUCT_IMPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"インポートできない列です: {', '.join(unknown)}")
+    if 'product_name' not in columns or 'price' not in columns:
+        raise ValueError("product_name列とprice列は必須です")
+    if len(set(columns)) != len(columns):
+        raise ValueError("列名が重複しています")
+    return columns
+
+def jsonl_to_csv_chunks(upload, columns):
+    """JSON Linesを1行ずつCSVに変換（不正な行はparse_errorに理由を入れて流す）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for raw_line in upload:
+        line = raw_line.decode('utf-8-sig').strip()
+        if not line:
+            # 行番号をずらさないよう空行もエラーとして残す
+            writer.writerow([None] * len(columns) + ['空行です'])
+        else:
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValueError("オブジェクトではありません")
+                unknown = [key for key in item if key not in PRODUCT_IMPORT_COLUMNS]
+                if unknown:
+                    raise ValueError(f"インポートできない項目です: {', '.join(unknown)}")
+                writer.writerow([None if item.get(column) is None else str(item[column]) for column in columns] + [None])
+            except ValueError as e:
+                writer.writerow([None] * len(columns) + [f"JSONの形式が正しくありません: {e}"])
+        if buffer.tell() > 65536:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def import_products(c, upload, file_format: str, atomic: bool, dry_run: bool) -> dict:
+    """
+    CSV / JSON Lines をCOPYでステージングテーブルに流し込み、検証後に1文でproductsへupsert
+    - カテゴリー・ブランドが未登録なら追加する
+    """
+    c.execute(f"""
+        CREATE TEMP TABLE product_import (
+            line BIGINT GENERATED ALWAYS AS IDENTITY,
+            {', '.join(f'{column} TEXT' for column in PRODUCT_IMPORT_COLUMNS)},
+            parse_error TEXT,
+            errors TEXT[]
+        ) ON COMMIT DROP
+    """)
+
+    if file_format == 'csv':
+        columns = read_csv_header(upload)
+        line_offset = 1  # ヘッダー行の分
+        c.copy_expert(
+            f"COPY product_import ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')",
+            upload
+        )
+    else:
+        columns = list(PRODUCT_IMPORT_COLUMNS)
+        line_offset = 0
+        c.copy_expert(
+            f"COPY product_import ({', '.join(columns)}, parse_error) FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')",
+            io.BufferedReader(IterStream(jsonl_to_csv_chunks(upload, columns)))
+        )
+
+    # 全行をまとめて検証
+    checks = ", ".join(f"CASE WHEN {condition} THEN {message} END" for condition, message in PRODUCT_IMPORT_CHECKS)
+    c.execute(f"""
+        UPDATE product_import AS p
+        SET errors = v.errors
+        FROM (
+            SELECT line, array_remove(ARRAY[{checks}], NULL) AS errors
+            FROM product_import
+        ) AS v
+        WHERE p.line = v.line AND cardinality(v.errors) > 0
+    """)
+    c.execute("SELECT COUNT(*) FROM product_import")
+    total = c.fetchone()[0]
+    c.execute("""
+        SELECT line, errors FROM product_import
+        WHERE errors IS NOT NULL
+        ORDER BY line
+        LIMIT %s
+    """, (PRODUCT_IMPORT_MAX_ERRORS,))
+    errors = [{"line": line + line_offset, "errors": row_errors} for line, row_errors in c.fetchall()]
+    c.execute("SELECT COUNT(*) FROM product_import WHERE errors IS NOT NULL")
+    error_count = c.fetchone()[0]
+
+    result = {
+        "total": total,
+        "valid": total - error_count,
+        "error_count": error_count,
+        "errors": errors,
+        "inserted": 0,
+        "updated": 0,
+        "created_categories": 0,
+        "created_brands": 0,
+    }
+    if dry_run or (atomic and error_count) or total == error_count:
+        return result
+
+    # 未登録のカテゴリー・ブランドを追加
+    c.execute("""
+        INSERT INTO categories (category_name)
+        SELECT DISTINCT btrim(category) FROM product_import
+        WHERE errors IS NULL AND NULLIF(btrim(category), '') IS NOT NULL
+        ON CONFLICT (category_name) DO NOTHING
+    """)
+    result["created_categories"] = c.rowcount
+    c.execute("""
+        INSERT INTO brands (brand_name)
+        SELECT DISTINCT btrim(brand) FROM product_import
+        WHERE errors IS NULL AND NULLIF(btrim(brand), '') IS NOT NULL
+        ON CONFLICT (brand_name) DO NOTHING
+    """)
+    result["created_brands"] = c.rowcount
+
+    # ファイルに含まれる列だけを更新する
+    values = {
+        'sku': "NULLIF(btrim(sku), '')",
+        'product_name': "btrim(product_name)",
+        'description': "description",
+        'price': "btrim(price)::numeric",
+        'original_price': "NULLIF(btrim(original_price), '')::numeric",
+        'brand': "NULLIF(btrim(brand), '')",
+        'category': "NULLIF(btrim(category), '')",
+        'stock_quantity': "COALESCE(NULLIF(btrim(stock_quantity), '')::int, 0)",
+        'image_data': "NULLIF(image_data, '')",
+        'is_active': "COALESCE(lower(NULLIF(btrim(is_active), ''))::boolean, TRUE)",
+    }
+    insert_columns = [column for column in PRODUCT_IMPORT_COLUMNS if column in columns]
+    update_columns = [column for column in insert_columns if column != 'sku']
+    c.execute(f"""
+        INSERT INTO products ({', '.join(insert_columns)})
+        SELECT {', '.join(values[column] for column in insert_columns)}
+        FROM product_import
+        WHERE errors IS NULL
+        ORDER BY line
+        ON CONFLICT (sku) WHERE sku IS NOT NULL DO UPDATE
+        SET {', '.join(f'{column} = EXCLUDED.{column}' for column in update_columns)},
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING (xmax = 0) AS inserted
+    """)
+    outcomes = [row[0] for row in c.fetchall()]
+    result["inserted"] = sum(1 for inserted in outcomes if inserted)
+    result["updated"] = len(outcomes) - result["inserted"]
+    return result
+
+@router.post("/admin/products/import")
+def import_products_admin(file: UploadFile = File(...), file_format: str = Form(None, alias="format"),
+                          atomic: bool = Form(False), dry_run: bool = Form(False),
+                          session_token: str = Cookie(None)):
+    """
+    商品をCSV / JSON Linesで一括登録・更新（管理者用）
+    - atomic: 1行でもエラーがあれば何も取り込まない（success: false と行ごとのエラーを返す）
+    - dry_run: 検証結果だけを返す（committed: false、何も取り込まない）
+    """
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    file_format = (file_format or ('jsonl' if (file.filename or '').lower().endswith(('.jsonl', '.ndjson')) else 'csv')).lower()
+    if file_format not in ('csv', 'jsonl'):
+        return JSONResponse(status_code=400, content={"error": f"対応していない形式です: {file_format}"})
+
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as c:
+                result = import_products(c, file.file, file_format, atomic, dry_run)
+                rolled_back = not dry_run and atomic and result["error_count"] > 0
+                if dry_run or rolled_back:
+                    conn.rollback()
+                else:
+                    conn.commit()
+        if rolled_back:
+            return JSONResponse(status_code=400, content={
+                "success": False, "committed": False, "dry_run": False,
+                "error": f"エラーが{result['error_count']}件あるため、何も取り込みませんでした", **result,
+            })
+        if dry_run:
+            return {"success": True, "committed": False, "dry_run": True,
+                    "message": "検証のみ行いました（取り込みはしていません）", **result}
+        if result["inserted"] or result["updated"]:
+            invalidate_catalog()
+        return {"success": True, "committed": True, "dry_run": False, "message": "商品をインポートしました", **result}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except psycopg2.DataError as e:
+        # CSVの列数不一致など、COPY自体が失敗した場合
+        return JSONResponse(status_code=400, content={"error": f"ファイルを読み込めませんでした: {e}"})
+    except Exception as e:
+        logger.exception(f"商品インポートエラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.put("/admin/products/{product_id}")
+@router.put("/admin/products/{product_id}")
 async def update_product_admin(product_id: int, request: Request, session_token: str = Cookie(None)):
     """商品を更新（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1631,14 +4392,31 @@ async def update_product_admin(product_id: int, request: Request, session_token:
                                 WHERE id=%s""",
                              (product_name, description, price, original_price, brand, category, stock_quantity, product_id))
                 conn.commit()
+        invalidate_catalog()
+        return {"success": True, "message": "商品を更新しました"}
+    except Exception as e:
+        logger.exception(f"商品更新エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@router.patch("/admin/products/{product_id}")
+async def patch_product_admin(product_id: int, request: Request, session_token: str = Cookie(None)):
+    """商品の一部の項目だけを更新（管理者用）"""
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    try:
+        data = await request.json()
+        if not patch_row('products', product_id, data, PRODUCT_PATCH_FIELDS):
+            return JSONResponse(status_code=404, content={"error": "商品が見つかりません"})
+        invalidate_catalog()
         return {"success": True, "message": "商品を更新しました"}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
-        print(f"商品更新エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"商品更新エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.delete("/admin/products/{product_id}")
+@router.delete("/admin/products/{product_id}")
 async def delete_product_admin(product_id: int, session_token: str = Cookie(None)):
     """商品を削除（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1649,16 +4427,15 @@ async def delete_product_admin(product_id: int, session_token: str = Cookie(None
             with conn.cursor() as c:
                 c.execute("DELETE FROM products WHERE id = %s", (product_id,))
                 conn.commit()
+        invalidate_catalog()
         return {"success": True, "message": "商品を削除しました"}
     except Exception as e:
-        print(f"商品削除エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"商品削除エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 # ========== リマインダーAPI ==========
 
-@app.post("/api/set-reminder")
+@router.post("/api/set-reminder")
 async def set_reminder(request: Request):
     """リマインダーを設定"""
     try:
@@ -1680,43 +4457,37 @@ async def set_reminder(request: Request):
                 """, (email, booking_date, booking_time, customer_name, service_name))
                 conn.commit()
         
-        print(f"リマインダー設定完了: {email} - {booking_date} {booking_time}")
+        logger.info(f"リマインダー設定完了: {email} - {booking_date} {booking_time}")
         return {"success": True, "message": "リマインダーを設定しました"}
     except Exception as e:
-        print(f"リマインダー設定エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"リマインダー設定エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 # ========== サービス管理API ==========
 
-@app.get("/services")
-def get_services(active_only: bool = True, for_booking: bool = False, for_intro: bool = False):
-    """サービス一覧を取得"""
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as c:
-            query = "SELECT * FROM services WHERE 1=1"
-            params = []
-            
-            if active_only:
-                query += " AND is_active = %s"
-                params.append(True)
-            
-            if for_booking:
-                query += " AND show_in_booking = %s"
-                params.append(True)
-            
-            if for_intro:
-                query += " AND show_in_intro = %s"
-                params.append(True)
-            
-            query += " ORDER BY display_order, service_name"
-            c.execute(query, params)
-            services = c.fetchall()
-    
-    return {"services": services}
+@router.get("/services")
+def get_services(request: Request, active_only: bool = True, for_booking: bool = False, for_intro: bool = False,
+                 fields: str = None):
+    """サービス一覧を取得（fields: 返す列をカンマ区切りで指定）"""
+    try:
+        selected_fields = parse_fields('services', fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
-@app.post("/admin/services")
+    snapshot = get_catalog_snapshot()
+    headers = catalog_cache_headers(snapshot, 'services')
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    rows, snapshot = get_catalog_rows(snapshot, 'services', selected_fields)
+    services = [
+        service['json'] for service in rows
+        if (not active_only or service['is_active'])
+        and (not for_booking or service['show_in_booking'])
+        and (not for_intro or service['show_in_intro'])
+    ]
+    return json_list_response("services", services, headers=catalog_cache_headers(snapshot, 'services'))
+
+@router.post("/admin/services")
 async def create_service(request: Request, session_token: str = Cookie(None)):
     """サービスを追加（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1751,14 +4522,13 @@ async def create_service(request: Request, session_token: str = Cookie(None)):
                 service_id = c.fetchone()[0]
                 conn.commit()
         
+        invalidate_catalog()
         return {"success": True, "id": service_id, "message": "サービスを追加しました"}
     except Exception as e:
-        print(f"サービス追加エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"サービス追加エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.put("/admin/services/{service_id}")
+@router.put("/admin/services/{service_id}")
 async def update_service(service_id: int, request: Request, session_token: str = Cookie(None)):
     """サービスを更新（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1794,14 +4564,31 @@ async def update_service(service_id: int, request: Request, session_token: str =
                 ))
                 conn.commit()
         
+        invalidate_catalog()
+        return {"success": True, "message": "サービスを更新しました"}
+    except Exception as e:
+        logger.exception(f"サービス更新エラー: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@router.patch("/admin/services/{service_id}")
+async def patch_service(service_id: int, request: Request, session_token: str = Cookie(None)):
+    """サービスの一部の項目だけを更新（管理者用）"""
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    try:
+        data = await request.json()
+        if not patch_row('services', service_id, data, SERVICE_PATCH_FIELDS):
+            return JSONResponse(status_code=404, content={"error": "サービスが見つかりません"})
+        invalidate_catalog()
         return {"success": True, "message": "サービスを更新しました"}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
-        print(f"サービス更新エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"サービス更新エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.delete("/admin/services/{service_id}")
+@router.delete("/admin/services/{service_id}")
 async def delete_service(service_id: int, session_token: str = Cookie(None)):
     """サービスを削除（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1813,23 +4600,201 @@ async def delete_service(service_id: int, session_token: str = Cookie(None)):
                 c.execute("DELETE FROM services WHERE id = %s", (service_id,))
                 conn.commit()
         
+        invalidate_catalog()
         return {"success": True, "message": "サービスを削除しました"}
     except Exception as e:
-        print(f"サービス削除エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"サービス削除エラー: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
     
+# ========== バッチ読み取りAPI ==========
+
+# バッチで呼び出せる読み取り専用のGETエンドポイント
+BATCH_ALLOWED_PATHS = [
+    re.compile(r"^/(categories|brands|products|products/search|services|bookings|available-slots|api/stats)$"),
+    re.compile(r"^/business-hours/\d{4}/\d{1,2}$"),
+]
+BATCH_MAX_REQUESTS = 10
+# 同時に処理するサブリクエスト数（= バッチ1回で使う接続数の上限）
+BATCH_CONCURRENCY = 4
+
+# サブリクエストへ引き継ぐヘッダー（認証Cookieなど）
+BATCH_FORWARD_HEADERS = (b"host", b"cookie", b"user-agent", b"x-forwarded-for", b"x-forwarded-proto")
+
+def open_batch_connection(snapshot: str = None):
+    """
+    バッチ用の接続を開き、(接続, スナップショットID) を返す（全サブリクエストが同じ時点のデータを読む）
+    - snapshot省略時は読み取り専用トランザクションを始めてスナップショットを書き出す
+    - 指定時は書き出したスナップショットを取り込む（書き出した接続のトランザクション中のみ有効）
+    """
+    conn = connect_db()
+    try:
+        with conn.cursor() as c:
+            c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            if snapshot is None:
+                c.execute("SELECT pg_export_snapshot()")
+                snapshot = c.fetchone()[0]
+            else:
+                c.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            c.execute("SET TIME ZONE 'Asia/Tokyo'")
+    except Exception:
+        conn.close()
+        raise
+    return conn, snapshot
+
+def run_savepoint(conn, statement: str):
+    with conn.cursor() as c:
+        c.execute(statement)
+
+async def dispatch_batch_request(request: Request, path: str, params: dict, finished: asyncio.Event):
+    """
+    サブリクエストをアプリ内で直接処理し、(ステータス, Content-Type, 本文) を返す
+    - finished: バッチ全体の終了（または親リクエストの切断）でセットされるイベント
+    """
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": request.url.scheme,
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "root_path": request.scope.get("root_path", ""),
+        "query_string": urlencode(params or {}, doseq=True).encode("utf-8"),
+        "headers": [(k, v) for k, v in request.headers.raw if k in BATCH_FORWARD_HEADERS],
+        "client": request.scope.get("client"),
+        "server": request.scope.get("server"),
+        # メトリクスではトップレベルのリクエストと分けて数える（MetricsMiddleware）
+        "batch_subrequest": True,
+    }
+    status = 500
+    content_type = ""
+    body = bytearray()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # 本文を渡した後はStreamingResponseが切断を待ち続けるので、親の切断かバッチの終了まで待たせる
+        # （すぐ http.disconnect を返すと送信途中のストリームが打ち切られる）
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for key, value in message.get("headers", []):
+                if key.lower() == b"content-type":
+                    content_type = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            body.extend(message.get("body", b""))
+
+    await request.app(scope, receive, send)
+    return status, content_type, bytes(body)
+
+@router.post("/admin/batch")
+async def batch_read(request: Request, session_token: str = Cookie(None)):
+    """
+    複数の読み取りAPIを1回のリクエストでまとめて取得（管理者用）
+    - 本文: {"requests": [{"id": "products", "path": "/products", "params": {"active_only": "false"}}, ...]}
+    - 認証は1回だけで、全サブリクエストが同じスナップショット（読み取り専用トランザクション）を読む
+    - 最大BATCH_CONCURRENCY件を並行に処理する（接続ごとに1件ずつ、スナップショットは接続間で共有）
+    """
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+
+    try:
+        data = await request.json()
+        sub_requests = data['requests']
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "requestsを指定してください"})
+
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return JSONResponse(status_code=400, content={"error": "requestsを指定してください"})
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return JSONResponse(status_code=400, content={"error": f"一度に指定できるのは{BATCH_MAX_REQUESTS}件までです"})
+
+    for sub_request in sub_requests:
+        path = sub_request.get('path', '') if isinstance(sub_request, dict) else ''
+        if not any(pattern.match(path) for pattern in BATCH_ALLOWED_PATHS):
+            return JSONResponse(status_code=400, content={"error": f"バッチで呼び出せないパスです: {path}"})
+
+    conn, snapshot = await run_in_threadpool(open_batch_connection)
+    connections = [conn]
+    pending = list(enumerate(sub_requests))
+    parts = [None] * len(sub_requests)
+    finished = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        finished.set()
+
+    async def run_items(conn):
+        # 接続はタスクごとのコンテキストに設定するので、並行するサブリクエストと混ざらない
+        _shared_connection.set(conn)
+        while pending:
+            index, sub_request = pending.pop(0)
+            request_id = str(sub_request.get('id', index))
+            await run_in_threadpool(run_savepoint, conn, "SAVEPOINT batch_item")
+            status, content_type, body = await dispatch_batch_request(
+                request, sub_request['path'], sub_request.get('params'), finished
+            )
+            # 失敗したサブリクエストがトランザクションを壊さないように戻す
+            if status >= 500:
+                await run_in_threadpool(run_savepoint, conn, "ROLLBACK TO SAVEPOINT batch_item")
+            else:
+                await run_in_threadpool(run_savepoint, conn, "RELEASE SAVEPOINT batch_item")
+
+            # JSONの本文は再パースせずにそのまま埋め込む
+            if content_type.startswith("application/json") and body:
+                payload = body.decode("utf-8")
+            else:
+                payload = json.dumps(body.decode("utf-8", errors="replace"), ensure_ascii=False)
+            parts[index] = f'{json.dumps(request_id)}:{{"status":{status},"body":{payload}}}'
+
+    async def run_with_imported_snapshot():
+        try:
+            conn, _ = await run_in_threadpool(open_batch_connection, snapshot)
+        except Exception as e:
+            # 接続を増やせなくても、残りは他の接続で処理される
+            logger.warning(f"バッチ用の追加接続を開けませんでした: {e}")
+            return
+        connections.append(conn)
+        await run_items(conn)
+
+    watcher = asyncio.create_task(watch_disconnect())
+    workers = [asyncio.create_task(run_items(conn))] + [
+        asyncio.create_task(run_with_imported_snapshot())
+        for _ in range(min(BATCH_CONCURRENCY, len(sub_requests)) - 1)
+    ]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        finished.set()
+        watcher.cancel()
+        # 1件が失敗したら残りも止め、接続を閉じる前に終わらせる
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for opened in connections:
+            await run_in_threadpool(opened.close)
+
+    return Response(content=('{"responses":{' + ','.join(parts) + '}}').encode("utf-8"),
+                    media_type="application/json")
+
 # ========== Ontime robot API ==========
 
-@app.get("/", include_in_schema=False)
-@app.head("/", include_in_schema=False)
+@router.get("/", include_in_schema=False)
+@router.head("/", include_in_schema=False)
 def read_root():
     return {"status": "ok"}
 
 # ========== 統計API ==========
 
-@app.get("/api/stats")
+@router.get("/api/stats")
 async def get_stats(session_token: str = Cookie(None)):
     """アクセス統計を取得（管理者用）"""
     if not verify_admin_session(session_token):
@@ -1837,7 +4802,226 @@ async def get_stats(session_token: str = Cookie(None)):
     
     return get_page_view_stats()
 
-@app.get("/health")
+@router.get("/health")
 def health_check():
     """ヘルスチェック"""
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "ok",
+        "timestamp": datetime.now().isoformat(),
+        "pid": os.getpid(),
+        "is_leader": _leader_state["is_leader"],
+        "startup": STARTUP_TIMINGS,
+    }
+
+# ========== メトリクスAPI ==========
+
+# Prometheusのスクレイプ用トークン（未設定なら管理者セッションでのみ参照可能）
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def collect_reminder_backlog():
+    """送信期限が来ている（明日以前の予約で）未送信のリマインダー数"""
+    with get_db_connection(reuse_shared=False) as conn:
+        with conn.cursor() as c:
+            c.execute("""
+                SELECT COUNT(*) FROM reminders
+                WHERE sent = FALSE AND booking_date <= %s
+            """, ((get_jst_now() + timedelta(days=1)).date(),))
+            return [((), c.fetchone()[0])]
+
+REMINDER_BACKLOG = Gauge("reminder_backlog", "未送信のリマインダー数（明日以前の予約分）", collect=collect_reminder_backlog)
+
+@router.get("/metrics", include_in_schema=False)
+def metrics(request: Request, session_token: str = Cookie(None)):
+    """Prometheus形式のメトリクス（値はこのワーカー分）"""
+    authorization = request.headers.get("authorization", "")
+    token_ok = bool(METRICS_TOKEN) and secrets.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+    if not token_ok and not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8",
+                    headers={"X-Worker-Pid": str(os.getpid())})
+
+# ========== プロファイラー ==========
+
+# /admin/profile: 全スレッドのスタックを一定間隔で取り、flamegraph.pl / speedscope にそのまま渡せるcollapsed形式で返す
+PROFILE_MAX_SECONDS = 60
+# イベントループがこの時間以上止まったら、止めていたスタックと一緒に記録する
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+LOOP_LAG_CHECK_SECONDS = 0.05
+LOOP_STALL_HISTORY = 50
+
+LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "イベントループの遅れ（sleepが予定より遅れて戻った時間）",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+_profile_lock = threading.Lock()
+
+def collapse_stack(frame) -> list:
+    """フレームを呼び出し元から順に並べる"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def sample_stacks(seconds: float, interval: float):
+    """指定秒数のあいだ全スレッドのスタックを取り、スタックごとの回数を数える"""
+    me = threading.get_ident()
+    counts = {}
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            key = ";".join([names.get(ident, f"thread-{ident}")] + collapse_stack(frame))
+            counts[key] = counts.get(key, 0) + 1
+        samples += 1
+        time.sleep(interval)
+    return counts, samples
+
+class LoopLagMonitor:
+    """
+    イベントループの停止を検出する
+    - ループ上のタスクが一定間隔でハートビートを更新し、sleepの遅れを計る
+    - 別スレッドがハートビートの途切れを見つけたら、その時点のループのスタックを取っておく
+    """
+
+    def __init__(self):
+        self.stalls = deque(maxlen=LOOP_STALL_HISTORY)
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+        self._captured = None
+        self._task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        self._heartbeat = time.monotonic()
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop_lag_watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(1)
+            self._watchdog = None
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + LOOP_LAG_CHECK_SECONDS
+            await asyncio.sleep(LOOP_LAG_CHECK_SECONDS)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(now - expected, 0)
+            LOOP_LAG_SECONDS.observe(lag)
+            stack, self._captured = self._captured, None
+            if lag * 1000 >= LOOP_LAG_THRESHOLD_MS:
+                self._record(lag, stack)
+
+    def _watch(self):
+        threshold = LOOP_LAG_CHECK_SECONDS + LOOP_LAG_THRESHOLD_MS / 1000
+        while not self._stop.wait(LOOP_LAG_CHECK_SECONDS):
+            if self._captured is None and time.monotonic() - self._heartbeat > threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._captured = collapse_stack(frame)
+
+    def _record(self, lag: float, stack):
+        self.stalls.append({
+            "at": get_jst_now().isoformat(),
+            "lag_ms": round(lag * 1000, 1),
+            "stack": ";".join(stack) if stack else None,
+        })
+        where = " <- ".join(reversed(stack[-3:])) if stack else "不明"
+        logger.warning("⚠️ イベントループが%.0fms停止: %s", lag * 1000, where, extra={"lag_ms": round(lag * 1000, 1)})
+
+loop_monitor = LoopLagMonitor()
+
+@router.get("/admin/profile")
+async def admin_profile(seconds: float = 10, interval_ms: float = 5, session_token: str = Cookie(None)):
+    """
+    サンプリングプロファイラー（管理者用）
+    - seconds: 計測時間（最大60秒）
+    - interval_ms: サンプリング間隔
+    - 結果は1行に「スレッド名;呼び出し元;...;呼び出し先 回数」
+    """
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 1 <= interval_ms <= 1000:
+        return JSONResponse(status_code=400, content={"error": f"secondsは{PROFILE_MAX_SECONDS}秒以内、interval_msは1〜1000で指定してください"})
+    if not _profile_lock.acquire(blocking=False):
+        return JSONResponse(status_code=409, content={"error": "別のプロファイルを実行中です"})
+    try:
+        counts, samples = await run_in_threadpool(sample_stacks, seconds, interval_ms / 1000)
+    finally:
+        _profile_lock.release()
+
+    body = "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+    return Response(content=body, media_type="text/plain; charset=utf-8",
+                    headers={"X-Profile-Samples": str(samples), "X-Worker-Pid": str(os.getpid())})
+
+@router.get("/admin/profile/stalls")
+async def admin_loop_stalls(session_token: str = Cookie(None)):
+    """最近のイベントループ停止（新しい順、このワーカー分）"""
+    if not verify_admin_session(session_token):
+        return JSONResponse(status_code=401, content={"error": "認証が必要です"})
+    return {
+        "pid": os.getpid(),
+        "threshold_ms": LOOP_LAG_THRESHOLD_MS,
+        "stalls": list(reversed(loop_monitor.stalls)),
+    }
+
+# ========== アプリケーション ==========
+
+# ワーカーごとの起動時間（ミリ秒）: import / 起動処理（環境変数チェック・マイグレーション・サービス開始）
+STARTUP_TIMINGS = {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時の処理はimport時ではなくここで行い、終了時は実行中の処理を待ってから片付ける"""
+    started = time.perf_counter()
+    start_logging()
+    validate_env_vars()
+    ensure_directories()
+    await run_in_threadpool(run_migrations)
+    await run_in_threadpool(detect_product_search)
+    start_background_services()
+    loop_monitor.start()
+    STARTUP_TIMINGS.update(
+        import_ms=round((started - _import_started) * 1000, 1),
+        startup_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    logger.info(f"🚀 起動完了 (pid {os.getpid()}): import {STARTUP_TIMINGS['import_ms']}ms / "
+                f"起動処理 {STARTUP_TIMINGS['startup_ms']}ms", extra=STARTUP_TIMINGS)
+    try:
+        yield
+    finally:
+        logger.info(f"🛑 終了処理中 (pid {os.getpid()})")
+        loop_monitor.stop()
+        await run_in_threadpool(stop_background_services)
+        stop_admin_listener()
+        logger.info("✅ 終了処理完了")
+        stop_logging()
+
+def create_app() -> FastAPI:
+    """アプリケーションを生成（uvicorn main:app または uvicorn --factory main:create_app）"""
+    application = FastAPI(lifespan=lifespan)
+    application.add_middleware(TrustedHostMiddleware, allowed_hosts=ALLOWED_HOSTS)
+    application.add_middleware(QueryLogMiddleware)
+    application.add_middleware(MetricsMiddleware)
+    application.add_middleware(TracingMiddleware)
+    application.add_middleware(RequestIdMiddleware)
+    application.state.limiter = limiter
+    application.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+    application.include_router(router)
+    return application
+
+app = create_app()
@@ -0,0 +1,150 @@
+-- 初期スキーマ（既存のデータベースにもそのまま適用できるよう、すべてIF NOT EXISTS）
+
+CREATE TABLE IF NOT EXISTS bookings (
+    id SERIAL PRIMARY KEY,
+    customer_name VARCHAR(100) NOT NULL,
+    phone_number VARCHAR(20) NOT NULL,
+    service_name VARCHAR(100) NOT NULL,
+    booking_date DATE NOT NULL,
+    booking_time TIME NOT NULL,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
+    UNIQUE(booking_date, booking_time)
+);
+
+CREATE TABLE IF NOT EXISTS products (
+    id SERIAL PRIMARY KEY,
+    product_name VARCHAR(200) NOT NULL,
+    description TEXT,
+    price DECIMAL(10, 2) NOT NULL,
+    original_price DECIMAL(10, 2),
+    brand VARCHAR(100),
+    category VARCHAR(50),
+    stock_quantity INTEGER DEFAULT 0,
+    image_data TEXT,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
+    updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+CREATE TABLE IF NOT EXISTS categories (
+    id SERIAL PRIMARY KEY,
+    category_name VARCHAR(50) UNIQUE NOT NULL,
+    display_order INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+CREATE TABLE IF NOT EXISTS brands (
+    id SERIAL PRIMARY KEY,
+    brand_name VARCHAR(100) UNIQUE NOT NULL,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+CREATE TABLE IF NOT EXISTS reminders (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    booking_date DATE NOT NULL,
+    booking_time TIME NOT NULL,
+    customer_name VARCHAR(100) NOT NULL,
+    service_name VARCHAR(100) NOT NULL,
+    sent BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+CREATE TABLE IF NOT EXISTS page_views (
+    id SERIAL PRIMARY KEY,
+    page_name VARCHAR(100) NOT NULL,
+    view_date DATE NOT NULL,
+    view_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
+    UNIQUE(page_name, view_date)
+);
+
+-- 予約可能時間管理
+CREATE TABLE IF NOT EXISTS available_slots (
+    id SERIAL PRIMARY KEY,
+    slot_time TIME NOT NULL UNIQUE,
+    slot_label VARCHAR(20) NOT NULL,
+    is_active BOOLEAN DEFAULT TRUE,
+    display_order INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+-- 営業日管理
+CREATE TABLE IF NOT EXISTS business_hours (
+    id SERIAL PRIMARY KEY,
+    date DATE NOT NULL UNIQUE,
+    is_open BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+-- 時間枠ごとの有効/無効管理
+CREATE TABLE IF NOT EXISTS slot_availability (
+    id SERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    slot_time TIME NOT NULL,
+    is_available BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
+    updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
+    UNIQUE(date, slot_time)
+);
+
+CREATE TABLE IF NOT EXISTS services (
+    id SERIAL PRIMARY KEY,
+    service_name VARCHAR(100) NOT NULL,
+    description TEXT,
+    intro_text TEXT,
+    price DECIMAL(10, 2) NOT NULL,
+    campaign_price DECIMAL(10, 2),
+    duration VARCHAR(20),
+    icon VARCHAR(10) DEFAULT '💆',
+    image_data TEXT,
+    is_popular BOOLEAN DEFAULT FALSE,
+    is_campaign BOOLEAN DEFAULT FALSE,
+    show_in_booking BOOLEAN DEFAULT TRUE,
+    show_in_intro BOOLEAN DEFAULT FALSE,
+    display_order INTEGER DEFAULT 0,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
+    updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+-- 古いデータベースに後から追加されたカラム
+ALTER TABLE services ADD COLUMN IF NOT EXISTS campaign_price NUMERIC;
+ALTER TABLE services ADD COLUMN IF NOT EXISTS is_campaign BOOLEAN DEFAULT false;
+ALTER TABLE services ADD COLUMN IF NOT EXISTS intro_text TEXT;
+ALTER TABLE services ADD COLUMN IF NOT EXISTS image_data TEXT;
+ALTER TABLE services ADD COLUMN IF NOT EXISTS show_in_booking BOOLEAN DEFAULT TRUE;
+ALTER TABLE services ADD COLUMN IF NOT EXISTS show_in_intro BOOLEAN DEFAULT FALSE;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS image_data TEXT;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS original_price DECIMAL(10, 2);
+ALTER TABLE products ADD COLUMN IF NOT EXISTS brand VARCHAR(100);
+
+-- 初期データ
+INSERT INTO categories (category_name, display_order)
+VALUES ('スキンケア', 0)
+ON CONFLICT (category_name) DO NOTHING;
+
+INSERT INTO available_slots (slot_time, slot_label, is_active, display_order)
+VALUES ('10:00:00', '10:00', TRUE, 0),
+       ('14:00:00', '14:00', TRUE, 1),
+       ('17:00:00', '17:00', TRUE, 2)
+ON CONFLICT (slot_time) DO NOTHING;
+
+INSERT INTO services (service_name, description, price, duration, icon, is_popular, display_order)
+SELECT * FROM (VALUES
+    ('シミケア', 'お肌のシミを集中ケア。美白効果の高いトリートメントで透明感のある肌へ。', 8000, '60分', '✨', TRUE, 1),
+    ('フェイシャルWAX', '顔の産毛を丁寧に除去。ワントーン明るい透明肌に仕上げます。', 5000, '40分', '💆', FALSE, 2),
+    ('脳洗浄', 'ヘッドスパで頭皮と心をリフレッシュ。深いリラクゼーションを体験。', 7000, '50分', '🧘', TRUE, 3),
+    ('ピーリング', '古い角質を優しく除去し、つるんとしたなめらか肌へ導きます。', 6000, '45分', '🌟', FALSE, 4),
+    ('ハーブサウナ', '天然ハーブの蒸気で全身デトックス。代謝アップと美肌効果。', 9000, '70分', '🌿', FALSE, 5)
+) AS defaults
+WHERE NOT EXISTS (SELECT 1 FROM services);
+
+CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings(booking_date);
+CREATE INDEX IF NOT EXISTS idx_reminders_date ON reminders(booking_date);
+CREATE INDEX IF NOT EXISTS idx_page_views_date ON page_views(view_date);
+CREATE INDEX IF NOT EXISTS idx_slot_availability_date ON slot_availability(date);
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category);
+CREATE INDEX IF NOT EXISTS idx_services_active ON services(is_active);
+CREATE INDEX IF NOT EXISTS idx_services_order ON services(display_order);
@@ -0,0 +1,33 @@
+-- ETag用のテーブルごとの変更カウンターと、カタログ更新を全ワーカーへ知らせるトリガー
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+
+INSERT INTO table_versions (table_name)
+VALUES ('services'), ('categories'), ('brands'), ('products'), ('available_slots')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = (NOW() AT TIME ZONE 'Asia/Tokyo')
+    WHERE table_name = TG_TABLE_NAME;
+    PERFORM pg_notify('catalog_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['services', 'categories', 'brands', 'products', 'available_slots'] LOOP
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+             FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed()',
+            'trg_' || t || '_catalog_changed', t);
+    END LOOP;
+END $$;
@@ -0,0 +1,4 @@
+-- 商品一覧のキーセットページング・ファセット集計用
+CREATE INDEX IF NOT EXISTS idx_products_active_price ON products(is_active, price, id);
+CREATE INDEX IF NOT EXISTS idx_products_active_created ON products(is_active, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_active_category_brand ON products(is_active, category, brand);
@@ -0,0 +1,12 @@
+-- 商品検索用のトライグラムインデックス（pg_trgmが使えない環境ではスキップ）
+-- 式はmain.pyのPRODUCT_SEARCH_DOCUMENTと同じものにすること
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS idx_products_search_trgm
+    ON products USING GIN (
+        lower(product_name::text || ' ' || COALESCE(brand::text, '') || ' ' || COALESCE(description, '')) gin_trgm_ops
+    );
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE '検索インデックス作成スキップ: %', SQLERRM;
+END $$;
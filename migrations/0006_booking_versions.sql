@@ -0,0 +1,17 @@
+-- 予約は変更カウンターだけを更新（カレンダー配信のETagに使う）
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, updated_at = (NOW() AT TIME ZONE 'Asia/Tokyo')
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO table_versions (table_name) VALUES ('bookings')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE TRIGGER trg_bookings_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON bookings
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
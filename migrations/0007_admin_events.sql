@@ -0,0 +1,56 @@
+-- 管理画面向けの変更通知（1文ごとに、変わった日付をまとめて1件のNOTIFYにする）
+
+CREATE OR REPLACE FUNCTION notify_admin_changed() RETURNS trigger AS $$
+DECLARE
+    changed_dates JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(DISTINCT to_jsonb(r) -> TG_ARGV[0]) INTO changed_dates FROM new_rows r;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(DISTINCT to_jsonb(r) -> TG_ARGV[0]) INTO changed_dates FROM old_rows r;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT jsonb_agg(DISTINCT d) INTO changed_dates FROM (
+            SELECT to_jsonb(r) -> TG_ARGV[0] AS d FROM new_rows r
+            UNION SELECT to_jsonb(r) -> TG_ARGV[0] FROM old_rows r
+        ) AS u;
+    END IF;
+    IF TG_OP <> 'TRUNCATE' AND changed_dates IS NULL THEN
+        RETURN NULL;
+    END IF;
+    -- NOTIFYの上限(8000バイト)を超えそうなら日付を省略（受信側で全体を読み直す）
+    IF jsonb_array_length(COALESCE(changed_dates, '[]')) > 200 THEN
+        changed_dates := NULL;
+    END IF;
+    PERFORM pg_notify('admin_changes', json_build_object(
+        'table', TG_TABLE_NAME, 'op', lower(TG_OP), 'dates', changed_dates
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 遷移テーブルは1つのトリガーに1イベントしか指定できないため操作ごとに作る
+DO $$
+DECLARE
+    target RECORD;
+BEGIN
+    FOR target IN SELECT * FROM (VALUES
+        ('bookings', 'booking_date'), ('business_hours', 'date'), ('slot_availability', 'date')
+    ) AS v(table_name, date_column) LOOP
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION notify_admin_changed(%L)',
+            'trg_' || target.table_name || '_admin_insert', target.table_name, target.date_column);
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION notify_admin_changed(%L)',
+            'trg_' || target.table_name || '_admin_update', target.table_name, target.date_column);
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION notify_admin_changed(%L)',
+            'trg_' || target.table_name || '_admin_delete', target.table_name, target.date_column);
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER TRUNCATE ON %I
+             FOR EACH STATEMENT EXECUTE FUNCTION notify_admin_changed(%L)',
+            'trg_' || target.table_name || '_admin_truncate', target.table_name, target.date_column);
+    END LOOP;
+END $$;
@@ -0,0 +1,48 @@
+-- 差分同期用の変更履歴（seqはコミット順に増える）
+
+CREATE TABLE IF NOT EXISTS change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR(50) NOT NULL,
+    row_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo')
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log(changed_at);
+
+-- 削除済みのseqの上限（version列）を記録する行
+INSERT INTO table_versions (table_name) VALUES ('change_log')
+ON CONFLICT (table_name) DO NOTHING;
+
+-- 変更された行のidを1文ごとにまとめて記録
+-- seqの採番をコミット順にするため、記録するトランザクションはアドバイザリーロックで直列化する
+-- （未コミットの小さいseqを後から追い越して読み飛ばすことがないように）
+CREATE OR REPLACE FUNCTION record_changes() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('change_log'));
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_id) SELECT TG_TABLE_NAME, id FROM old_rows;
+    ELSE
+        INSERT INTO change_log (table_name, row_id) SELECT TG_TABLE_NAME, id FROM new_rows;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['bookings', 'products', 'services', 'available_slots', 'business_hours', 'slot_availability'] LOOP
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION record_changes()',
+            'trg_' || t || '_change_log_insert', t);
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER UPDATE ON %I REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION record_changes()',
+            'trg_' || t || '_change_log_update', t);
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION record_changes()',
+            'trg_' || t || '_change_log_delete', t);
+    END LOOP;
+END $$;
@@ -0,0 +1,8 @@
+-- 全ワーカーで共有する管理画面のセッション（トークンはハッシュで保存）
+CREATE TABLE IF NOT EXISTS admin_sessions (
+    token_hash CHAR(64) PRIMARY KEY,
+    username VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'Asia/Tokyo'),
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_admin_sessions_expires_at ON admin_sessions(expires_at);
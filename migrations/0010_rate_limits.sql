@@ -0,0 +1,10 @@
+-- レート制限のカウンター（全ワーカー共有、消えても困らないのでUNLOGGED）
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+    key TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL
+);
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_windows (
+    key TEXT PRIMARY KEY,
+    hits DOUBLE PRECISION[] NOT NULL
+);
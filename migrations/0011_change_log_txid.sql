@@ -0,0 +1,23 @@
+-- 変更履歴をコミット順に読むため、記録したトランザクションのID（xid8）を持たせる
+-- 読み取り側はスナップショットのxmin（これより小さいIDのトランザクションはすべて終了済み）までを返すので、
+-- 記録時のアドバイザリーロック（書き込みトランザクション全体の直列化）は不要になる
+
+ALTER TABLE change_log ADD COLUMN IF NOT EXISTS txid xid8 NOT NULL DEFAULT pg_current_xact_id();
+CREATE INDEX IF NOT EXISTS idx_change_log_txid ON change_log(txid, seq);
+
+CREATE OR REPLACE FUNCTION record_changes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_id) SELECT TG_TABLE_NAME, id FROM old_rows;
+    ELSE
+        INSERT INTO change_log (table_name, row_id) SELECT TG_TABLE_NAME, id FROM new_rows;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 削除済みの範囲（version列）もトランザクションIDで持つ
+-- 以前のseqの位置を持っている画面は、ここより前とみなされて一覧を読み直す
+UPDATE table_versions
+SET version = pg_current_xact_id()::text::bigint, updated_at = (NOW() AT TIME ZONE 'Asia/Tokyo')
+WHERE table_name = 'change_log';
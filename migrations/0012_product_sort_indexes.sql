@@ -0,0 +1,7 @@
+-- 商品一覧の並び順（main.py の PRODUCT_SORTS）と同じ式のインデックス
+-- newest はNULLの作成日時を -infinity として並べるので、created_at 単独のインデックスを置き換える
+CREATE INDEX IF NOT EXISTS idx_products_active_default
+    ON products(is_active, COALESCE(category, ''), COALESCE(brand, ''), product_name, id);
+CREATE INDEX IF NOT EXISTS idx_products_active_newest
+    ON products(is_active, COALESCE(created_at, '-infinity'::timestamp) DESC, id DESC);
+DROP INDEX IF EXISTS idx_products_active_created;
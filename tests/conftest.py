@@ -0,0 +1,75 @@
+"""
+main.py のテスト（実際のPostgreSQLに対してアプリを起動する）
+
+使い捨てのDBを TEST_DATABASE_URL に指定して実行する（未設定ならスキップ、pytest と httpx が必要）:
+    TEST_DATABASE_URL=postgresql://localhost/salon_test python -m pytest -q tests
+"""
+import os
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+ADMIN_PASSWORD = "test-password"
+ICS_FEED_TOKEN = "test-ics-token"
+
+# main.py はimport時に環境変数を読むので、importより前に設定する
+if TEST_DATABASE_URL:
+    os.environ.pop("ADMIN_PASSWORD_HASH", None)
+    os.environ.update({
+        "DATABASE_URL": TEST_DATABASE_URL,
+        "ADMIN_USERNAME": "admin",
+        "ADMIN_PASSWORD": ADMIN_PASSWORD,
+        "RATE_LIMIT_ENABLED": "false",
+        "SESSION_STORE": "memory",
+        "ENVIRONMENT": "development",
+        "ICS_FEED_TOKEN": ICS_FEED_TOKEN,
+    })
+
+# テストごとに空にするテーブル
+RESET_TABLES = ("bookings", "products", "change_log")
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL が未設定です")
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def app_client(main_module):
+    from fastapi.testclient import TestClient
+    # 起動処理（マイグレーション・バックグラウンドサービス）もlifespanで実行される
+    with TestClient(main_module.app, base_url="http://localhost") as client:
+        yield client
+
+
+@pytest.fixture
+def db(main_module):
+    """テスト用のDB接続（テスト前に対象テーブルを空にする）"""
+    import psycopg2
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    with conn.cursor() as c:
+        c.execute(f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY")
+    conn.commit()
+    main_module.invalidate_catalog()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def client(app_client, db):
+    app_client.cookies.clear()
+    return app_client
+
+
+@pytest.fixture
+def admin_client(client):
+    response = client.post("/admin/login", data={"username": "admin", "password": ADMIN_PASSWORD},
+                           follow_redirects=False)
+    assert response.status_code == 303 and "session_token" in response.cookies
+    client.cookies.set("session_token", response.cookies["session_token"])
+    return client
@@ -0,0 +1,51 @@
+"""/admin/batch のテスト"""
+from concurrent.futures import ThreadPoolExecutor
+
+# 応答がなければハングとみなす（秒）
+RESPONSE_TIMEOUT = 15
+
+
+def post_batch(client, requests):
+    # ハングした場合もテストが止まらないよう、別スレッドで送ってタイムアウトで打ち切る
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(client.post, "/admin/batch", json={"requests": requests})
+        return future.result(timeout=RESPONSE_TIMEOUT)
+
+
+def test_batch_includes_streaming_endpoint(admin_client, db):
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO bookings (customer_name, phone_number, service_name, booking_date, booking_time)
+            VALUES ('山田花子', '090-0000-0000', 'シミケア', '2030-01-10', '10:00')
+        """)
+    db.commit()
+
+    # /bookings は StreamingResponse（stream_json_query）で返る
+    response = post_batch(admin_client, [
+        {"id": "bookings", "path": "/bookings"},
+        {"id": "slots", "path": "/available-slots"},
+        {"id": "categories", "path": "/categories"},
+    ])
+
+    assert response.status_code == 200
+    responses = response.json()["responses"]
+    assert responses["bookings"]["status"] == 200
+    assert [booking["customer_name"] for booking in responses["bookings"]["body"]["bookings"]] == ["山田花子"]
+    assert responses["slots"]["status"] == 200
+    assert responses["categories"]["status"] == 200
+
+
+def test_batch_keeps_request_order_with_concurrency(admin_client, db, main_module):
+    requests = [{"id": f"item{index}", "path": "/bookings"} for index in range(main_module.BATCH_CONCURRENCY + 2)]
+
+    response = post_batch(admin_client, requests)
+
+    assert response.status_code == 200
+    responses = response.json()["responses"]
+    assert list(responses) == [request["id"] for request in requests]
+    assert all(item["status"] == 200 for item in responses.values())
+
+
+def test_batch_requires_admin(client):
+    response = client.post("/admin/batch", json={"requests": [{"path": "/bookings"}]})
+    assert response.status_code == 401
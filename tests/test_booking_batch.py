@@ -0,0 +1,97 @@
+"""/admin/bookings/batch のテスト"""
+
+SLOT_DATE = "2030-01-10"
+
+
+def insert_bookings(db, *times):
+    ids = []
+    with db.cursor() as c:
+        for index, booking_time in enumerate(times):
+            c.execute("""
+                INSERT INTO bookings (customer_name, phone_number, service_name, booking_date, booking_time)
+                VALUES (%s, '090-0000-0000', 'シミケア', %s, %s)
+                RETURNING id
+            """, (f"お客様{index}", SLOT_DATE, booking_time))
+            ids.append(c.fetchone()[0])
+    db.commit()
+    return ids
+
+
+def booking_times(db):
+    with db.cursor() as c:
+        c.execute("SELECT id, booking_date, booking_time FROM bookings ORDER BY id")
+        return {booking_id: (booking_date.isoformat(), booking_time.strftime("%H:%M"))
+                for booking_id, booking_date, booking_time in c.fetchall()}
+
+
+def post_batch(client, operations, mode):
+    return client.post("/admin/bookings/batch", json={"mode": mode, "operations": operations})
+
+
+def move(booking_id, booking_time, booking_date=SLOT_DATE):
+    return {"op": "update", "id": booking_id, "booking_date": booking_date, "booking_time": booking_time}
+
+
+def test_swap_two_bookings(admin_client, db):
+    first, second = insert_bookings(db, "10:00", "11:00")
+
+    response = post_batch(admin_client, [move(first, "11:00"), move(second, "10:00")], "atomic")
+
+    assert response.status_code == 200, response.text
+    assert [result["status"] for result in response.json()["results"]] == ["ok", "ok"]
+    assert booking_times(db) == {first: (SLOT_DATE, "11:00"), second: (SLOT_DATE, "10:00")}
+
+
+def test_rotate_three_bookings(admin_client, db):
+    ids = insert_bookings(db, "10:00", "11:00", "12:00")
+
+    response = post_batch(admin_client, [move(ids[0], "11:00"), move(ids[1], "12:00"), move(ids[2], "10:00")],
+                          "atomic")
+
+    assert response.status_code == 200, response.text
+    assert booking_times(db) == {ids[0]: (SLOT_DATE, "11:00"), ids[1]: (SLOT_DATE, "12:00"),
+                                 ids[2]: (SLOT_DATE, "10:00")}
+
+
+def test_best_effort_reports_only_colliding_items(admin_client, db):
+    first, second, third = insert_bookings(db, "10:00", "11:00", "12:00")
+
+    response = post_batch(admin_client, [
+        move(first, "13:00"),                              # 空いている枠へ移動
+        move(second, "12:00"),                             # 動かない予約の枠 → 衝突
+        {"op": "update", "id": third, "notes": "メモ"},     # 日時は変えない
+        {"op": "create", "customer_name": "新規", "phone_number": "090-1111-1111",
+         "service_name": "シミケア", "booking_date": SLOT_DATE, "booking_time": "10:00"},  # 移動で空く枠
+    ], "best_effort")
+
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["ok", "conflict", "ok", "ok"]
+    times = booking_times(db)
+    assert times[first] == (SLOT_DATE, "13:00")
+    assert times[second] == (SLOT_DATE, "11:00")
+    assert times[third] == (SLOT_DATE, "12:00")
+    assert times[results[3]["id"]] == (SLOT_DATE, "10:00")
+
+
+def test_atomic_rolls_back_on_conflict(admin_client, db):
+    first, second = insert_bookings(db, "10:00", "11:00")
+    before = booking_times(db)
+
+    response = post_batch(admin_client, [move(first, "12:00"), move(second, "12:00")], "atomic")
+
+    assert response.status_code == 409
+    assert [result["status"] for result in response.json()["results"]] == ["conflict", "conflict"]
+    assert booking_times(db) == before
+
+
+def test_chain_stops_when_target_is_not_released(admin_client, db):
+    # 2件目が動けないので、2件目の枠へ移ろうとした1件目も衝突になる
+    first, second, third = insert_bookings(db, "10:00", "11:00", "12:00")
+
+    response = post_batch(admin_client, [move(first, "11:00"), move(second, "12:00")], "best_effort")
+
+    assert response.status_code == 200, response.text
+    assert [result["status"] for result in response.json()["results"]] == ["conflict", "conflict"]
+    assert booking_times(db) == {first: (SLOT_DATE, "10:00"), second: (SLOT_DATE, "11:00"),
+                                 third: (SLOT_DATE, "12:00")}
@@ -0,0 +1,52 @@
+"""/calendar/{token}/bookings.ics のテスト"""
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+
+from conftest import ICS_FEED_TOKEN
+
+FEED_URL = f"/calendar/{ICS_FEED_TOKEN}/bookings.ics"
+
+
+def insert_booking(db, main_module):
+    booking_date = main_module.get_jst_now().date() + timedelta(days=1)
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO bookings (customer_name, phone_number, service_name, booking_date, booking_time)
+            VALUES ('山田花子', '090-0000-0000', 'シミケア', %s, '10:00')
+            RETURNING id
+        """, (booking_date,))
+        booking_id = c.fetchone()[0]
+    db.commit()
+    return booking_id
+
+
+def test_feed_returns_calendar(client, db, main_module):
+    booking_id = insert_booking(db, main_module)
+
+    response = client.get(FEED_URL)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/calendar")
+    assert f"UID:booking-{booking_id}@saloncoeur.com" in response.text
+    assert response.headers["etag"].startswith('"ics-')
+    assert response.headers["last-modified"].endswith(" GMT")
+    assert parsedate_to_datetime(response.headers["last-modified"]).tzinfo is not None
+
+
+def test_feed_not_modified(client, db, main_module):
+    insert_booking(db, main_module)
+    first = client.get(FEED_URL)
+    assert first.status_code == 200
+
+    by_etag = client.get(FEED_URL, headers={"If-None-Match": first.headers["etag"]})
+    assert by_etag.status_code == 304
+    assert by_etag.headers["etag"] == first.headers["etag"]
+    assert by_etag.content == b""
+
+    by_date = client.get(FEED_URL, headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert by_date.status_code == 304
+    assert by_date.headers["last-modified"] == first.headers["last-modified"]
+
+
+def test_feed_rejects_wrong_token(client):
+    assert client.get("/calendar/wrong-token/bookings.ics").status_code == 404
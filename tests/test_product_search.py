@@ -0,0 +1,42 @@
+"""/products/search のテスト"""
+import pytest
+
+
+def insert_products(db, *names):
+    with db.cursor() as c:
+        for name in names:
+            c.execute("""
+                INSERT INTO products (product_name, description, price, brand, category, image_data)
+                VALUES (%s, '', 1000, 'ブランド', 'スキンケア', 'data:image/jpeg;base64,AAAA')
+            """, (name,))
+    db.commit()
+
+
+def test_short_japanese_query_uses_partial_match(client, db):
+    insert_products(db, "美容液", "化粧水", "美白クリーム")
+
+    response = client.get("/products/search", params={"q": "美"})
+
+    assert response.status_code == 200
+    names = [product["product_name"] for product in response.json()["products"]]
+    assert sorted(names) == ["美白クリーム", "美容液"]
+
+
+def test_results_exclude_images_unless_requested(client, db):
+    insert_products(db, "ローズオイル")
+
+    default = client.get("/products/search", params={"q": "ローズ"}).json()["products"]
+    assert default and "image_data" not in default[0]
+
+    requested = client.get("/products/search", params={"q": "ローズ", "fields": "id,image_data"}).json()["products"]
+    assert requested[0]["image_data"].startswith("data:image/")
+
+
+def test_trigram_search_tolerates_typos(client, db, main_module):
+    if not main_module._product_search["trigram"]:
+        pytest.skip("pg_trgmが入っていません")
+    insert_products(db, "Hydrating Serum")
+
+    response = client.get("/products/search", params={"q": "hydratng"})
+
+    assert [product["product_name"] for product in response.json()["products"]] == ["Hydrating Serum"]